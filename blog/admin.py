@@ -1,5 +1,10 @@
 from django.contrib import admin
-from .models import Post, Comment
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.db.models import Q
+from .models import Post, Comment, Task
+from .counters import adjust_approved_comment_count, approve_comments
+from .pagination import EstimatedCountPaginator
+from .search import search_posts
 from django_summernote.admin import SummernoteModelAdmin
 # Register your models here.
 
@@ -8,11 +13,42 @@ from django_summernote.admin import SummernoteModelAdmin
 # managed and edited through the Django admin panel.
 
 
+# Changelists with a lot of rows:
+#   - paginator: the page links of an unfiltered list come from PostgreSQL's
+#     estimate of the table size instead of a COUNT(*) over the whole table
+#     (blog/pagination.py);
+#   - show_full_result_count = False: no second COUNT(*) for the
+#     "N results (M total)" line when a filter is applied;
+#   - date_hierarchy and ordering on created_on: served by the created_on
+#     indexes (see the models) rather than a sort of the whole table;
+#   - the big text columns are only loaded on the edit pages, not for every
+#     row of the list.
+
+def is_changelist(request):
+    # url_name is None for a URL pattern without a name
+    return bool(request.resolver_match and
+                (request.resolver_match.url_name or '').endswith('_changelist'))
+
+
+class SearchChangeList(ChangeList):
+    # ChangeList sorts every list by the admin's ordering, which would undo
+    # the best-first order of a search. Unless a column header was clicked,
+    # a ranked search keeps the order search_posts gave it.
+    def get_ordering(self, request, queryset):
+        if ORDER_VAR not in self.params and 'rank' in queryset.query.annotations:
+            return list(queryset.query.order_by)
+        return super().get_ordering(request, queryset)
+
+
 @admin.register(Post)
 class PostAdmin(SummernoteModelAdmin):
     prepopulated_fields = {'slug': ("title",)}
     list_filter = ('status', 'created_on')
     list_display = ('title', 'slug', 'status', 'created_on')
+    date_hierarchy = 'created_on'
+    ordering = ('-created_on', '-id')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     search_fields = ('title', 'content')
     # summernote_fields = ('content'): This line specifies that the "content" field of the "Post"
     # model should use the Summernote editor in the admin interface. The summernote_fields attribute
@@ -20,6 +56,28 @@ class PostAdmin(SummernoteModelAdmin):
     # In this case, it's just the "content" field.
     summernote_fields = ('content')
 
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if is_changelist(request):
+            queryset = queryset.defer('content', 'content_html', 'search_vector')
+        return queryset
+
+    # The admin search also goes through search_posts (blog/search.py), so
+    # the best matches come first; on PostgreSQL it uses the full-text index,
+    # which finds word forms ("caches" for "caching"). The usual icontains
+    # search over search_fields is kept next to it for what the index doesn't
+    # find: parts of words, slugs, exact strings.
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(
+            request, queryset, search_term)
+        if search_term.strip():
+            results = search_posts(queryset, search_term,
+                                   also=Q(pk__in=results.values('pk')))
+        return results, may_have_duplicates
+
+    def get_changelist(self, request, **kwargs):
+        return SearchChangeList
+
 
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
@@ -27,9 +85,46 @@ class CommentAdmin(admin.ModelAdmin):
     list_filter = ('approved', 'created_on')
     search_fields = ('name', 'email', 'body')
     actions = ['approve_comments',]
+    # the post column: fetched with a JOIN instead of one query per row
+    list_select_related = ('post',)
+    # a plain id box rather than a <select> of every account
+    raw_id_fields = ('user',)
+    date_hierarchy = 'created_on'
+    # newest first, which is what a moderator wants to see
+    ordering = ('-created_on', '-id')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if is_changelist(request):
+            # only the post's title is shown
+            queryset = queryset.defer(
+                'post__content', 'post__content_html', 'post__search_vector')
+        return queryset
 
     def approve_comments(self, request, queryset):
-        queryset.update(approved=True)
+        # also bumps Post.approved_comment_count for the newly approved ones,
+        # in batches, without loading the comments
+        approve_comments(queryset)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # New comments are counted by the post_save signal. For edits, move the
+        # count if the comment was (un)approved or moved to another post.
+        if change and ('approved' in form.changed_data or 'post' in form.changed_data):
+            if form.initial.get('approved'):
+                adjust_approved_comment_count(form.initial['post'], -1)
+            if obj.approved:
+                adjust_approved_comment_count(obj.post_id, 1)
+
+
+# Background tasks (blog/tasks.py): mostly useful for looking at failed ones.
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'run_after', 'attempts', 'failed', 'created_on')
+    list_filter = ('name', 'failed')
+    readonly_fields = ('last_error',)
 
 
 # admin.site.register(Post)
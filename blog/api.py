@@ -0,0 +1,222 @@
+import hashlib
+import itertools
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import urlencode
+from django.views.decorators.http import require_safe
+
+from .models import Post, Comment
+from .pagination import InvalidCursor, decode_cursor, encode_key
+
+# Read-only JSON API, for the mobile client and the prerenderer:
+
+#   /api/posts/                        published posts, newest first
+#   /api/posts/<slug>/                 one published post
+#   /api/posts/<slug>/comments/        its approved comments, oldest first
+
+# Lists are paged with cursors, like the home page's BLOG_CURSOR_PAGINATION
+# (blog/pagination.py): ?limit=N (at most MAX_LIMIT) and the "next" URL each
+# page ends with. ?fields=slug,title,... picks the fields to send (see
+# POST_FIELDS and COMMENT_FIELDS); lists leave out a post's content unless it
+# is asked for.
+
+# Rows are read with .values() and written out one by one as the query's
+# .iterator() produces them: no model instances are built and a page of
+# full posts is never held in memory as a whole. Since a streamed body can't
+# be hashed before it's sent, a list's ETag comes from a narrow query over
+# the page's keys and counters instead (like blog/conditional.py), checked
+# before the page itself is read; a matching If-None-Match gets a 304.
+
+# The page's query is started, and its first row read, before the view
+# returns. The rest of the body is only written after the middleware has
+# finished with the request, but by then the query is already running on
+# the database the request was routed to: a client pinned to the primary
+# (codestar/routers.py) doesn't get the rest from a replica.
+
+# field -> column
+POST_FIELDS = {
+    'slug': 'slug',
+    'title': 'title',
+    'author': 'author__username',
+    'excerpt': 'excerpt',
+    # sanitized HTML, as shown on the post page (blog/content.py)
+    'content': 'content_html',
+    # precomputed featured image URLs (blog/images.py); {} for the default
+    'image': 'featured_image_urls',
+    'created_on': 'created_on',
+    'updated_on': 'updated_on',
+    'like_count': 'like_count',
+    'comment_count': 'approved_comment_count',
+}
+LIST_POST_FIELDS = [field for field in POST_FIELDS if field != 'content']
+COMMENT_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'body': 'body',
+    'created_on': 'created_on',
+}
+
+PAGE_SIZE = 20
+MAX_LIMIT = 100
+# rows fetched per round trip while streaming (PostgreSQL server-side cursor)
+CHUNK_SIZE = 100
+
+
+class BadRequest(Exception):
+    pass
+
+
+def error(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+
+def _fields(request, available, default):
+    raw = request.GET.get('fields')
+    if not raw:
+        return list(default)
+    fields = [field.strip() for field in raw.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        raise BadRequest(f"Unknown fields: {', '.join(unknown)}. "
+                         f"Available: {', '.join(available)}.")
+    return fields
+
+
+def _limit(request):
+    try:
+        limit = int(request.GET.get('limit', PAGE_SIZE))
+    except ValueError:
+        raise BadRequest("limit must be a number.")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise BadRequest(f"limit must be between 1 and {MAX_LIMIT}.")
+    return limit
+
+
+def _after_cursor(request, queryset, descending):
+    # the rows after ?cursor=, in (created_on, id) order
+    cursor = request.GET.get('cursor')
+    if cursor:
+        try:
+            _, created_on, pk = decode_cursor(cursor)
+        except InvalidCursor:
+            raise BadRequest("Invalid cursor.")
+        after = 'lt' if descending else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'created_on__{after}': created_on}) |
+            Q(created_on=created_on, **{f'id__{after}': pk}))
+    order = ('-created_on', '-id') if descending else ('created_on', 'id')
+    return queryset.order_by(*order)
+
+
+def _etag(*parts):
+    return '"%s"' % hashlib.md5(
+        json.dumps(parts, cls=DjangoJSONEncoder).encode()).hexdigest()
+
+
+def _next_url(request, row):
+    query = request.GET.copy()
+    query['cursor'] = encode_key('n', row['created_on'], row['id'])
+    return f"{request.path}?{urlencode(sorted(query.items()))}"
+
+
+def _stream_page(request, rows, limit, fields, columns):
+    # {"results": [...], "next": url or null}, written as the rows arrive.
+    # rows holds up to limit + 1 rows; the extra one only tells whether
+    # there is a next page.
+    yield '{"results": ['
+    sent, last, next_url = 0, None, None
+    for row in rows:
+        if sent == limit:
+            next_url = _next_url(request, last)
+            break
+        if sent:
+            yield ', '
+        yield json.dumps({field: row[columns[field]] for field in fields},
+                         cls=DjangoJSONEncoder)
+        sent, last = sent + 1, row
+    yield '], "next": %s}' % json.dumps(next_url)
+
+
+def _page_response(request, queryset, fields, columns, validator_columns,
+                   descending):
+    limit = _limit(request)
+    queryset = _after_cursor(request, queryset, descending)
+    page = queryset[:limit + 1]
+
+    # narrow columns first: is the client's copy still current?
+    keys = list(page.values_list(*validator_columns))
+    etag = _etag(request.path, fields, limit, request.GET.get('cursor'), keys)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    # the cursor needs created_on and id, whichever fields were asked for
+    wanted = {columns[field] for field in fields} | {'created_on', 'id'}
+    rows = page.values(*wanted).iterator(chunk_size=CHUNK_SIZE)
+    # run the query now, while the request is still being handled
+    first = next(rows, None)
+    if first is not None:
+        rows = itertools.chain([first], rows)
+    response = StreamingHttpResponse(
+        _stream_page(request, rows, limit, fields, columns),
+        content_type='application/json')
+    response['ETag'] = etag
+    return response
+
+
+def _api_view(view):
+    # GET/HEAD only, and BadRequest becomes a JSON 400
+    @require_safe
+    def wrapped(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as e:
+            return error(str(e), 400)
+    wrapped.__name__ = view.__name__
+    return wrapped
+
+
+@_api_view
+def post_list(request):
+    fields = _fields(request, POST_FIELDS, LIST_POST_FIELDS)
+    return _page_response(
+        request, Post.objects.filter(status=1), fields, POST_FIELDS,
+        ('id', 'updated_on', 'like_count', 'approved_comment_count'),
+        descending=True)
+
+
+@_api_view
+def post_detail(request, slug):
+    fields = _fields(request, POST_FIELDS, POST_FIELDS)
+    row = (Post.objects.filter(status=1, slug=slug)
+           .values(*(POST_FIELDS[field] for field in fields)).first())
+    if row is None:
+        return error("Not found.", 404)
+    data = {field: row[POST_FIELDS[field]] for field in fields}
+    # a single post is small: hash what would be sent
+    body = json.dumps(data, cls=DjangoJSONEncoder)
+    etag = _etag(body)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    return response
+
+
+@_api_view
+def comment_list(request, slug):
+    fields = _fields(request, COMMENT_FIELDS, COMMENT_FIELDS)
+    post_id = (Post.objects.filter(status=1, slug=slug)
+               .values_list('id', flat=True).first())
+    if post_id is None:
+        return error("Not found.", 404)
+    # comments have no updated_on: their ids change when one is approved or
+    # removed, and the ETag also covers the columns an edit in the admin can
+    # change (a page is at most MAX_LIMIT short comments)
+    return _page_response(
+        request, Comment.objects.filter(post_id=post_id, approved=True),
+        fields, COMMENT_FIELDS, ('id', 'name', 'body'), descending=False)
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class BlogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'blog'
+
+    def ready(self):
+        # registers the signal handlers that keep Post's stored counters in sync
+        from . import signals  # noqa: F401
+        # registers the background task handlers (blog/tasks.py)
+        from . import moderation, related  # noqa: F401
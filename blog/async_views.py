@@ -0,0 +1,191 @@
+import asyncio
+import calendar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.paginator import InvalidPage, Page, Paginator
+from django.db import close_old_connections
+from django.http import Http404, HttpResponseNotAllowed
+from django.shortcuts import render
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .models import Post, Comment
+from .forms import CommentForm
+from .pagination import paginate_by_cursor
+from .cache import is_cacheable_request
+from .stats import popular_posts, record_view
+from .related import related_posts
+from .conditional import (
+    post_detail_etag, post_detail_last_modified,
+    post_list_etag, post_list_last_modified)
+from . import views
+
+# Async versions of PostList, PostDetail and PostLike, used instead of the
+# views in blog/views.py when BLOG_ASYNC_VIEWS is on and the site runs under
+# ASGI (see codestar/asgi.py).
+
+# A sync view runs its queries one after another while its worker waits. Here
+# the lookups a page needs that don't depend on each other - the post, its
+# comments and whether you liked it; or a list page's rows and the post count
+# for its page links - are started together, each on its own thread (and so
+# its own database connection), and the event loop serves other requests
+# while they run. A page then takes about as long as its slowest query rather
+# than the sum of them.
+
+# The ORM in Django 3.2 is sync-only, so every query still runs in a thread
+# through sync_to_async. Work that gains nothing from concurrency - pages
+# served from the page cache, posting a comment, the like toggle - is
+# handed to the sync views in blog/views.py, off the event loop.
+
+# None of it uses sync_to_async's default thread_sensitive=True: under Django
+# 3.2 that runs the call on one thread shared by every request in flight, so
+# the requests would queue behind each other there. Each call only touches
+# its own request, and a view's transaction never spans two calls, so any
+# thread will do.
+
+
+def run_in_thread(func, *args, **kwargs):
+    # Runs func on a worker thread of its own, so several can run at once.
+    # The thread's database connection outlives the call; close it if it's
+    # past CONN_MAX_AGE or broken, like request_finished would.
+    def call():
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(call, thread_sensitive=False)()
+
+
+def _validators(request, etag_func, last_modified_func, **kwargs):
+    # The same validators the sync views use with @condition. Also loads
+    # request.user, which needs the database, so the async code after this
+    # can use it.
+    request.user.is_authenticated
+    etag = etag_func(request, **kwargs)
+    last_modified = last_modified_func(request, **kwargs)
+    return (quote_etag(etag) if etag else None,
+            calendar.timegm(last_modified.utctimetuple()) if last_modified else None)
+
+
+async def _render(request, template, context, etag, last_modified):
+    response = await run_in_thread(render, request, template, context)
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+PAGINATE_BY = views.PostList.paginate_by
+
+
+# Django 3.2 only runs async *function* views natively (class-based views
+# can't have async handlers until 4.1), hence functions here.
+
+async def post_list(request):
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    if await run_in_thread(is_cacheable_request, request):
+        return await run_in_thread(views.PostList.as_view(), request)
+
+    etag, last_modified = await run_in_thread(
+        _validators, request, post_list_etag, post_list_last_modified,
+        per_page=PAGINATE_BY)
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    queryset = views.PostList.queryset
+    if settings.BLOG_CURSOR_PAGINATION:
+        paginator, page, posts, is_paginated = await run_in_thread(
+            paginate_by_cursor, queryset, PAGINATE_BY, request.GET.get('cursor'))
+    else:
+        paginator, page = await _paginate(request, queryset)
+        posts, is_paginated = page.object_list, page.has_other_pages()
+
+    context = {
+        'paginator': paginator, 'page_obj': page, 'is_paginated': is_paginated,
+        'object_list': posts, 'post_list': posts,
+        'popular_posts': popular_posts(),
+    }
+    return await _render(request, 'index.html', context, etag, last_modified)
+
+
+async def _paginate(request, queryset):
+    # Like ListView.paginate_queryset, except that the page's rows and the
+    # COUNT(*) for the page links are fetched at the same time.
+    paginator = Paginator(queryset, PAGINATE_BY)
+    number = request.GET.get('page') or 1
+    if number == 'last':
+        number = await run_in_thread(lambda: paginator.num_pages)
+    try:
+        number = int(number)
+        if number < 1:
+            raise InvalidPage
+    except (TypeError, ValueError, InvalidPage):
+        raise Http404("Invalid page.")
+
+    offset = (number - 1) * PAGINATE_BY
+    count, rows = await asyncio.gather(
+        run_in_thread(queryset.count),
+        run_in_thread(list, queryset[offset:offset + PAGINATE_BY]))
+    # hand the paginator the count, so it doesn't run it again
+    paginator.count = count
+    try:
+        paginator.validate_number(number)
+    except InvalidPage:
+        raise Http404("Invalid page.")
+    return paginator, Page(rows, number, paginator)
+
+
+async def post_detail(request, slug):
+    if request.method == 'POST':
+        # posting a comment: one write, nothing to run concurrently
+        return await run_in_thread(views.PostDetail.as_view(), request, slug=slug)
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD', 'POST'])
+    if await run_in_thread(is_cacheable_request, request):
+        return await run_in_thread(views.PostDetail.as_view(), request, slug=slug)
+    if request.method == 'GET':
+        record_view(slug)
+
+    etag, last_modified = await run_in_thread(
+        _validators, request, post_detail_etag, post_detail_last_modified,
+        slug=slug)
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    # the lookups only need the slug, so they run side by side
+    post = (Post.objects.filter(status=1, slug=slug)
+            .select_related('author')
+            .defer('content', 'search_vector'))
+    comments = (Comment.objects
+                .filter(post__slug=slug, post__status=1, approved=True)
+                .order_by('created_on'))
+    lookups = [run_in_thread(post.first), run_in_thread(list, comments),
+               run_in_thread(related_posts, post__slug=slug, post__status=1)]
+    if request.user.is_authenticated:
+        lookups.append(run_in_thread(
+            Post.likes.through.objects.filter(
+                post__slug=slug, user_id=request.user.id).exists))
+    post, comments, related, *liked = await asyncio.gather(*lookups)
+    if post is None:
+        raise Http404("No post matches the given slug.")
+
+    context = {
+        'post': post,
+        'comments': comments,
+        'related_posts': related,
+        'liked': bool(liked and liked[0]),
+        'comment_form': CommentForm(),
+    }
+    return await _render(request, 'post_detail.html', context, etag, last_modified)
+
+
+async def post_like(request, slug):
+    # the toggle is a single transaction (blog/likes.py)
+    return await run_in_thread(views.PostLike.as_view(), request, slug=slug)
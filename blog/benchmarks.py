@@ -0,0 +1,64 @@
+import math
+import statistics
+from collections import namedtuple
+
+from django.urls import reverse
+
+# Shared by the benchmark commands (bench_views, load_test) and by the query
+# budget tests in blog/tests.py.
+
+# The benchmarks run against whatever DATABASE_URL points at, so fill it with
+# a known amount of data first. With CLOUDINARY_OFFLINE=True (see
+# codestar/settings.py) nothing needs a network connection:
+
+#   python manage.py seed_blog --posts 10000 --comments 50000 --likes 30000
+#   python manage.py bench_views --check
+#   python manage.py load_test --server wsgi --concurrency 16
+#   python manage.py load_test --server asgi --concurrency 16
+#   python manage.py bench_async_views
+
+# The most queries each endpoint may run. A change that adds a query to one of
+# the hot pages makes the budget tests (and `bench_views --check`) fail, so it
+# has to be a deliberate decision rather than an accident.
+QUERY_BUDGETS = {
+    # the count for the page links, the page (the ETag comes from the page
+    # cache's "list" token, see blog/conditional.py)
+    'post_list': 2,
+    'post_list_page_2': 2,
+    # validators, the post, its comments, its related posts
+    'post_detail': 4,
+    # + the session and the user
+    'post_detail_authenticated': 6,
+    # session, user, the toggle (delete or insert, counter update) and the
+    # savepoints around it
+    'post_like': 7,
+}
+
+Scenario = namedtuple('Scenario', 'name method path authenticated')
+
+
+def scenarios(slug):
+    # the requests benchmarked for the published post `slug`
+    detail = reverse('post_detail', args=[slug])
+    return [
+        Scenario('post_list', 'get', reverse('home'), False),
+        Scenario('post_list_page_2', 'get', reverse('home') + '?page=2', False),
+        Scenario('post_detail', 'get', detail, False),
+        Scenario('post_detail_authenticated', 'get', detail, True),
+        Scenario('post_like', 'post', reverse('post_like', args=[slug]), True),
+    ]
+
+
+def percentile(sorted_timings, percent):
+    # nearest-rank percentile of an already sorted list
+    rank = max(math.ceil(percent / 100 * len(sorted_timings)), 1)
+    return sorted_timings[rank - 1]
+
+
+def summarize(timings_ms):
+    timings = sorted(timings_ms)
+    return {
+        'p50': statistics.median(timings),
+        'p99': percentile(timings, 99),
+        'mean': statistics.fmean(timings),
+    }
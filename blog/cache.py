@@ -0,0 +1,204 @@
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from codestar.routers import use_primary
+
+# Full-page cache for anonymous readers.
+
+# Logged-out visitors all see the same home page and post pages, so after one
+# of them renders a page we keep the finished HTML in the cache (settings.CACHES)
+# and hand it to the next visitors without touching the database or the
+# templates at all. Logged-in users, non-GET requests and pages carrying a
+# flash message always bypass the cache.
+
+# Invalidation: every cached page depends on one or more "scopes" - "list" for
+# the post list pages and "post:<slug>" for a post's detail page. Each scope
+# has a random token in the cache, and a page is stored together with the
+# tokens it was rendered under. When something changes (see blog/signals.py)
+# the scope gets a new token, so every page stored under the old one is
+# outdated at once, without having to know which page keys exist.
+
+# Stampede protection: outdated or expired pages are kept for a while
+# (BLOG_PAGE_CACHE_STALE_TIMEOUT). The first request to find a page outdated
+# takes a short lock and renders a fresh copy; requests arriving meanwhile keep
+# getting the old copy instead of all hitting the database at the same time.
+# When there is no copy at all yet, they wait up to LOCK_WAIT seconds for the
+# lock holder's, and only render the page themselves if it doesn't come.
+# Only the lock holder deletes the lock: it is stored with a value of its own,
+# since after LOCK_TIMEOUT it may have expired and been taken by another
+# request.
+
+# A page rendered to be stored reads from the primary database, not a read
+# replica (codestar/routers.py): the scope was usually just invalidated by a
+# write, which a lagging replica may not have yet, and the copy stored now is
+# served until BLOG_PAGE_CACHE_TIMEOUT.
+
+PAGE_KEY = 'blog:page:{}'
+TOKEN_KEY = 'blog:token:{}'
+LOCK_KEY = 'blog:lock:{}'
+LOCK_TIMEOUT = 30
+LOCK_WAIT = 2
+LOCK_POLL_INTERVAL = 0.05
+
+# response headers worth keeping with a cached page
+CACHED_HEADERS = ('Content-Type', 'Content-Language', 'ETag', 'Last-Modified')
+
+
+def post_scope(slug):
+    return f'post:{slug}'
+
+
+def invalidate(*scopes):
+    # giving a scope a new token outdates every page rendered under the old one
+    cache.set_many(
+        {TOKEN_KEY.format(scope): uuid.uuid4().hex for scope in scopes},
+        timeout=None)
+
+
+def invalidate_post(slug):
+    # a post's own page, plus the list pages that show its card
+    invalidate('list', post_scope(slug))
+
+
+def current_tokens(scopes):
+    keys = [TOKEN_KEY.format(scope) for scope in scopes]
+    tokens = cache.get_many(keys)
+    for key in keys:
+        if key not in tokens:
+            # first use of this scope (or its token was evicted): any page
+            # stored without it must count as outdated, so mint a new one
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+            tokens[key] = cache.get(key)
+    return [tokens[key] for key in keys]
+
+
+def is_cacheable_request(request):
+    if not settings.BLOG_PAGE_CACHE or request.method not in ('GET', 'HEAD'):
+        return False
+    if request.user.is_authenticated:
+        return False
+    # len() peeks at pending flash messages without marking them as shown;
+    # a page showing one must be rendered for this visitor only
+    return len(messages.get_messages(request)) == 0
+
+
+def is_cacheable_response(response):
+    return (response.status_code == 200 and not response.cookies
+            and not response.has_header('Cache-Control')
+            and not getattr(response, 'streaming', False))
+
+
+def _from_entry(entry, status):
+    response = HttpResponse(entry['content'])
+    for header, value in entry['headers'].items():
+        response[header] = value
+    response['X-Page-Cache'] = status
+    return response
+
+
+def _store(key, response, tokens):
+    entry = {
+        'content': response.content,
+        'headers': {h: response[h] for h in CACHED_HEADERS if response.has_header(h)},
+        'tokens': tokens,
+        'expires': time.time() + settings.BLOG_PAGE_CACHE_TIMEOUT,
+    }
+    cache.set(key, entry, timeout=(settings.BLOG_PAGE_CACHE_TIMEOUT +
+                                   settings.BLOG_PAGE_CACHE_STALE_TIMEOUT))
+
+
+def _is_fresh(entry, tokens):
+    return (entry is not None and entry['tokens'] == tokens
+            and entry['expires'] > time.time())
+
+
+def _hit(request, entry):
+    # the cached page's own ETag/Last-Modified can answer a conditional
+    # request with a 304
+    headers = entry['headers']
+    last_modified = headers.get('Last-Modified')
+    return get_conditional_response(
+        request, etag=headers.get('ETag'),
+        last_modified=last_modified and parse_http_date_safe(last_modified),
+        response=_from_entry(entry, 'HIT'))
+
+
+def _render(key, render, tokens):
+    with use_primary():
+        response = render()
+        if hasattr(response, 'render') and callable(response.render):
+            response = response.render()
+    if is_cacheable_response(response):
+        _store(key, response, tokens)
+        response['X-Page-Cache'] = 'MISS'
+    return response
+
+
+def _wait_for_copy(key, lock_key, tokens):
+    # The fresh copy another request is rendering, or None if it isn't
+    # stored within LOCK_WAIT seconds (or that request finished without
+    # storing one: the page wasn't cacheable).
+    for _ in range(int(LOCK_WAIT / LOCK_POLL_INTERVAL)):
+        time.sleep(LOCK_POLL_INTERVAL)
+        entry = cache.get(key)
+        if _is_fresh(entry, tokens):
+            return entry
+        if cache.get(lock_key) is None:
+            return None
+    return None
+
+
+def cached_page(request, scopes, render):
+    # Returns the cached page for the request if it's still good, otherwise
+    # calls render() to build the response and stores it for next time.
+    path_hash = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    key = PAGE_KEY.format(path_hash)
+    lock_key = LOCK_KEY.format(path_hash)
+
+    tokens = current_tokens(scopes)
+    entry = cache.get(key)
+    if _is_fresh(entry, tokens):
+        return _hit(request, entry)
+
+    owner = uuid.uuid4().hex
+    if not cache.add(lock_key, owner, timeout=LOCK_TIMEOUT):
+        # someone else is already rendering the fresh copy
+        if entry is not None:
+            return _from_entry(entry, 'STALE')
+        entry = _wait_for_copy(key, lock_key, tokens)
+        if entry is not None:
+            return _hit(request, entry)
+        # it didn't come: render the page here, leaving the lock alone
+        return _render(key, render, tokens)
+
+    try:
+        return _render(key, render, tokens)
+    finally:
+        # unless the lock expired while rendering and is someone else's now
+        if cache.get(lock_key) == owner:
+            cache.delete(lock_key)
+
+
+class AnonymousPageCacheMixin:
+    # For class-based views: serves GET requests from logged-out visitors out
+    # of the page cache. Views list the scopes their page depends on.
+
+    def get_page_cache_scopes(self):
+        raise NotImplementedError
+
+    def dispatch(self, request, *args, **kwargs):
+        if not is_cacheable_request(request):
+            return super().dispatch(request, *args, **kwargs)
+        # setup() has already stored the url kwargs on self
+        return cached_page(
+            request, self.get_page_cache_scopes(),
+            lambda: super(AnonymousPageCacheMixin, self).dispatch(
+                request, *args, **kwargs))
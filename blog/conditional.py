@@ -0,0 +1,130 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib import messages
+from django.db.models import Max, OuterRef, Q, Subquery
+from django.http import Http404
+
+from .cache import current_tokens
+from .models import Post, RelatedPost
+from .pagination import paginate_by_cursor
+from .stats import popular_version
+
+# Validators for conditional GETs (ETag / Last-Modified) of the blog pages.
+
+# They are used with Django's @condition decorator: when the browser or CDN
+# already holds the current version of a page (its If-None-Match matches our
+# ETag) the view answers 304 Not Modified straight away, without loading the
+# comments or rendering the template. Each validator costs at most one small,
+# indexed query.
+
+# The ETag covers everything the page shows: post edits (updated_on), likes
+# (like_count), comments being approved, edited or deleted, the related posts being
+# recomputed (blog/related.py), and who is looking (a logged-in user sees
+# their own like button and name). Last-Modified can't
+# express like counts, so it is only used by clients that don't send
+# If-None-Match; all browsers send both.
+
+# Pages with a pending flash message get no validators at all, so a 304 can
+# never swallow the message.
+
+
+def _make_etag(request, *parts):
+    raw = '|'.join(str(part) for part in (request.user.pk, *parts))
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def _cached_on_request(request, compute):
+    # @condition calls the etag and the last-modified functions separately;
+    # run the query once and reuse the result for both
+    if not hasattr(request, '_blog_validators'):
+        if len(messages.get_messages(request)):
+            request._blog_validators = (None, None)
+        else:
+            request._blog_validators = compute()
+    return request._blog_validators
+
+
+def _post_detail_validators(request, slug):
+    row = (
+        Post.objects.filter(status=1, slug=slug)
+        # the newest approval or edit of a shown comment
+        .annotate(last_comment=Max(
+            'comments__updated_on', filter=Q(comments__approved=True)))
+        # a list is rewritten as a whole, so its rows share one computed_on
+        .annotate(related_on=Subquery(
+            RelatedPost.objects.filter(post=OuterRef('pk'))
+            .order_by('rank').values('computed_on')[:1]))
+        .values('updated_on', 'like_count', 'approved_comment_count',
+                'last_comment', 'related_on')
+        .first()
+    )
+    if row is None:
+        # let the view produce its 404
+        return (None, None)
+    last_modified = max(filter(None, (row['updated_on'], row['last_comment'],
+                                      row['related_on'])))
+    etag = _make_etag(request, slug, *row.values())
+    return (etag, last_modified)
+
+
+def post_detail_etag(request, slug, *args, **kwargs):
+    return _cached_on_request(
+        request, lambda: _post_detail_validators(request, slug))[0]
+
+
+def post_detail_last_modified(request, slug, *args, **kwargs):
+    return _cached_on_request(
+        request, lambda: _post_detail_validators(request, slug))[1]
+
+
+def _post_list_validators(request, per_page):
+    # The list page changes when a post on it is edited or liked, or when
+    # posts are added or removed around it, and when the popular posts list
+    # changes (its version comes from blog/stats.py).
+    popular, popular_changed_on = popular_version()
+    if not settings.BLOG_CURSOR_PAGINATION:
+        # With ?page=N the page's rows are the OFFSET query itself, as slow on
+        # deep pages as rendering them. Instead the ETag uses the token of the
+        # page cache's "list" scope (blog/cache.py), which gets a new value on
+        # every one of those changes: no query at all. A token has no date, so
+        # these pages have no Last-Modified.
+        try:
+            number = int(request.GET.get('page', 1))
+        except ValueError:
+            # e.g. ?page=last: let the paginator deal with it
+            return (None, None)
+        if number < 1:
+            return (None, None)
+        return (_make_etag(request, number, *current_tokens(['list']), popular), None)
+
+    # A cursor page is one keyset query: the narrow (id, updated_on,
+    # like_count) rows of the page itself, plus the first row of the next
+    # page, which decides whether NEXT is shown.
+    queryset = (Post.objects.filter(status=1)
+                .order_by('-created_on', '-id')
+                .only('id', 'created_on', 'updated_on', 'like_count'))
+    cursor = request.GET.get('cursor')
+    try:
+        page = paginate_by_cursor(queryset, per_page, cursor)[1]
+    except Http404:
+        return (None, None)
+    rows = list(page.object_list)
+    if not rows:
+        return (None, None)
+    parts = [cursor, page.has_next()]
+    parts += [(row.pk, row.updated_on, row.like_count) for row in rows]
+    parts.append(popular)
+    last_modified = max(filter(None, [popular_changed_on,
+                                      *(row.updated_on for row in rows)]))
+    return (_make_etag(request, *parts), last_modified)
+
+
+def post_list_etag(request, *args, per_page, **kwargs):
+    return _cached_on_request(
+        request, lambda: _post_list_validators(request, per_page))[0]
+
+
+def post_list_last_modified(request, *args, per_page, **kwargs):
+    return _cached_on_request(
+        request, lambda: _post_list_validators(request, per_page))[1]
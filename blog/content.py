@@ -0,0 +1,129 @@
+import re
+
+from bleach.html5lib_shim import BleachHTMLParser, Filter, getTreeWalker
+from bleach.sanitizer import Cleaner
+from django.utils.text import Truncator
+
+# The post content pipeline.
+
+# Post.content is whatever HTML the Summernote editor produced. When a post is
+# saved (see blog/signals.py) we turn it into the HTML that is actually shown,
+# once, and store it in Post.content_html:
+
+#   1. sanitize it - only known-safe tags and attributes are kept, so a
+#      pasted <script> or onclick= can't end up on the page;
+#   2. make images lazy-load, so the browser only downloads them when they
+#      are about to scroll into view;
+#   3. for images hosted on Cloudinary, ask for a resized, auto format/quality
+#      version and offer a srcset so phones don't download desktop-sized
+#      images.
+
+# If the post has no excerpt we also write one from the text of the content
+# (leaving out the code inside <script> and <style>), and mark it as generated (Post.excerpt_generated): a generated excerpt is
+# rewritten whenever the content changes, until someone edits it.
+
+# post_detail.html then outputs content_html as it is, with no processing per
+# request. `python manage.py render_post_content` fills it for posts saved
+# before this existed (or saved with bulk operations, which skip signals).
+
+ALLOWED_TAGS = frozenset({
+    'a', 'abbr', 'b', 'blockquote', 'br', 'code', 'div', 'em', 'figcaption',
+    'figure', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'li', 'ol',
+    'p', 'pre', 's', 'span', 'strike', 'strong', 'sub', 'sup', 'table',
+    'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'u', 'ul',
+})
+ALLOWED_ATTRIBUTES = {
+    'a': ['href', 'title', 'target', 'rel'],
+    'abbr': ['title'],
+    'img': ['src', 'alt', 'title', 'width', 'height'],
+    'td': ['colspan', 'rowspan'],
+    'th': ['colspan', 'rowspan'],
+}
+
+# widths offered in an image's srcset, and which of them is the plain src
+IMAGE_WIDTHS = (480, 800, 1200)
+DEFAULT_IMAGE_WIDTH = 800
+# the post body is roughly two thirds of the screen on desktop, all of it on phones
+IMAGE_SIZES = '(min-width: 768px) 66vw, 100vw'
+
+# https://res.cloudinary.com/<cloud>/image/upload/<rest>, where <rest> may
+# already start with transformations like "w_300,c_fill/"
+CLOUDINARY_URL = re.compile(
+    r'^(?P<base>https?://res\.cloudinary\.com/[^/]+/image/upload/)(?P<rest>.+)$')
+CLOUDINARY_TRANSFORMATION = re.compile(r'^[a-z]{1,3}_[^/]*/')
+
+EXCERPT_WORDS = 30
+# elements whose contents are code rather than text
+NON_TEXT_TAGS = frozenset({'script', 'style'})
+
+
+def cloudinary_url(src, width):
+    # Returns src resized to width with automatic format and quality, or None
+    # if src isn't an untransformed Cloudinary upload.
+    match = CLOUDINARY_URL.match(src)
+    if not match or CLOUDINARY_TRANSFORMATION.match(match['rest']):
+        return None
+    return f"{match['base']}f_auto,q_auto,c_limit,w_{width}/{match['rest']}"
+
+
+class ImageFilter(Filter):
+    # html5lib token filter: runs over the sanitized tags and adds lazy
+    # loading and responsive Cloudinary URLs to every <img>.
+
+    def __iter__(self):
+        for token in super().__iter__():
+            if token['type'] in ('StartTag', 'EmptyTag') and token['name'] == 'img':
+                attrs = token['data']
+                attrs[(None, 'loading')] = 'lazy'
+                attrs[(None, 'decoding')] = 'async'
+                src = attrs.get((None, 'src'), '')
+                if cloudinary_url(src, DEFAULT_IMAGE_WIDTH):
+                    attrs[(None, 'src')] = cloudinary_url(src, DEFAULT_IMAGE_WIDTH)
+                    attrs[(None, 'srcset')] = ', '.join(
+                        f"{cloudinary_url(src, width)} {width}w"
+                        for width in IMAGE_WIDTHS)
+                    attrs[(None, 'sizes')] = IMAGE_SIZES
+            yield token
+
+
+cleaner = Cleaner(
+    tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES,
+    strip=True, filters=[ImageFilter])
+# every tag kept, so plain_text() can tell which element the text is in
+text_parser = BleachHTMLParser(tags=None, strip=True, consume_entities=True,
+                               namespaceHTMLElements=False)
+text_walker = getTreeWalker('etree')
+
+
+def render_content(source):
+    return cleaner.clean(source or '')
+
+
+def plain_text(source):
+    # the text of some HTML, with tags dropped and whitespace collapsed
+    text, in_code = [], False
+    for token in text_walker(text_parser.parseFragment(source or '')):
+        if token['type'] in ('StartTag', 'EndTag') and token['name'] in NON_TEXT_TAGS:
+            # no tags inside these two, so they can't be nested
+            in_code = token['type'] == 'StartTag'
+        elif token['type'] in ('Characters', 'SpaceCharacters') and not in_code:
+            text.append(token['data'])
+    return ' '.join(''.join(text).split())
+
+
+def make_excerpt(source):
+    return Truncator(plain_text(source)).words(EXCERPT_WORDS)
+
+
+def render_post(post):
+    # Fills post.content_html (and post.excerpt, if it's blank or generated)
+    # from post.content. Doesn't save the post.
+    post.content_html = render_content(post.content)
+    if post.excerpt != getattr(post, '_loaded_excerpt', post.excerpt):
+        # someone wrote an excerpt since the post was loaded: keep it
+        post.excerpt_generated = False
+    if not post.excerpt.strip() or post.excerpt_generated:
+        post.excerpt = make_excerpt(post.content)
+        post.excerpt_generated = True
+    # what is being saved now is what later edits are compared with
+    post._loaded_excerpt = post.excerpt
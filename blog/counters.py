@@ -0,0 +1,89 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Post, Comment
+from .cache import invalidate, post_scope
+
+# Post.like_count and Post.approved_comment_count are stored copies of
+# post.likes.count() and post.comments.filter(approved=True).count(), so the
+# templates can show them without counting rows on every render.
+
+# They are kept up to date with F() expressions (for likes, see
+# blog/likes.py and count_likes in blog/signals.py): UPDATE ... SET
+# like_count = like_count + 1 is done by the database itself, so two requests
+# changing the same post at the same time can't overwrite each other's change
+# the way a read-modify-save in Python would. If they ever drift anyway (e.g.
+# likes deleted along with their user),
+# `python manage.py recount_post_counters` rebuilds them.
+
+
+def adjust_approved_comment_count(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        approved_comment_count=F('approved_comment_count') + delta)
+
+
+def adjust_like_count(post_ids, delta):
+    Post.objects.filter(pk__in=post_ids).update(
+        like_count=F('like_count') + delta)
+
+
+def approve_comments(queryset, batch_size=1000):
+    # Approves the comments in the queryset and bumps each affected post's
+    # counter by the number of its comments that were newly approved. The
+    # per-post numbers are worked out with one GROUP BY in the database, so
+    # the comments themselves never have to be loaded.
+    # Works through the comments batch_size ids at a time, each batch in its
+    # own short transaction, so approving a whole filtered changelist doesn't
+    # hold locks on every matching row at once. Returns the number approved.
+    ids = (queryset.filter(approved=False).order_by('pk')
+           .values_list('pk', flat=True))
+    approved, slugs, last_pk = 0, set(), 0
+    while True:
+        batch = list(ids.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            break
+        with transaction.atomic():
+            pending = Comment.objects.filter(pk__in=batch, approved=False)
+            per_post = list(pending.order_by().values('post_id', 'post__slug')
+                            .annotate(n=Count('id')))
+            approved += pending.update(approved=True, updated_on=timezone.now())
+            for row in per_post:
+                adjust_approved_comment_count(row['post_id'], row['n'])
+        slugs.update(row['post__slug'] for row in per_post)
+        if len(batch) < batch_size:
+            break
+        last_pk = batch[-1]
+    # update() doesn't send post_save, so refresh the cached post pages here
+    if slugs:
+        invalidate(*(post_scope(slug) for slug in slugs))
+    return approved
+
+
+def _count_subquery(queryset, field):
+    counts = (queryset.filter(**{field: OuterRef('pk')})
+              .order_by().values(field).annotate(n=Count('*')).values('n'))
+    return Coalesce(Subquery(counts), Value(0))
+
+
+def recount(queryset=None, batch_size=1000):
+    # Recomputes both counters from the source tables, in batches of posts so
+    # a large table isn't locked by a single giant UPDATE.
+    # Returns the number of posts processed.
+    queryset = Post.objects.all() if queryset is None else queryset
+    Like = Post.likes.through
+    like_count = _count_subquery(Like.objects.all(), 'post_id')
+    comment_count = _count_subquery(
+        Comment.objects.filter(approved=True), 'post_id')
+
+    ids = queryset.order_by('pk').values_list('pk', flat=True)
+    done, last_pk = 0, 0
+    while True:
+        batch = list(ids.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return done
+        Post.objects.filter(pk__in=batch).update(
+            like_count=like_count, approved_comment_count=comment_count)
+        done += len(batch)
+        last_pk = batch[-1]
@@ -0,0 +1,284 @@
+import hashlib
+from io import StringIO
+
+from django.core.cache import cache
+from django.db import router
+from django.db.models import Count, F, IntegerField, Max
+from django.db.models.functions import Cast
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.feedgenerator import rfc2822_date, rfc3339_date
+from django.utils.http import http_date
+from django.utils.xmlutils import SimplerXMLGenerator
+from django.views.decorators.http import require_safe
+
+from .models import Post
+from .cache import current_tokens
+
+# RSS and Atom feeds of the latest posts, and a sitemap of every post, so
+# crawlers find posts without walking every page of the post list.
+
+# Django's syndication and sitemaps frameworks build the whole document in
+# memory, and the sitemaps one pages with OFFSET. Here instead:
+
+#   * each document is written out as the rows arrive from a
+#     .values_list().iterator() query, a few rows at a time;
+#   * the sitemap is split into shards of SHARD_SIZE post ids each
+#     (sitemap-0.xml has ids 1-SHARD_SIZE, and so on), listed by the index at
+#     /sitemap.xml. A shard is read with a primary key range, never an OFFSET,
+#     and holds at most SHARD_SIZE URLs however many posts there are, so
+#     memory stays flat as the table grows;
+#   * a finished document is kept in the cache. A shard is stored under its
+#     own signature - the newest updated_on and the number of published posts
+#     in its id range, one indexed range query - so editing, publishing or
+#     deleting a post rebuilds only its shard. The index and the feeds depend
+#     on every post and use the page cache's "list" token (blog/cache.py),
+#     which every post change renews.
+
+# A streamed document is written after the view has returned, when the
+# request's read replica routing (codestar/routers.py) is over. The view
+# therefore asks the router for the database up front, and the rows are read
+# from that one: the same database its cache key came from.
+
+FEED_TITLE = "CodeStar Blog"
+FEED_DESCRIPTION = "The latest posts on CodeStar Blog."
+FEED_SIZE = 50
+# the sitemap protocol allows up to 50,000 URLs per file
+SHARD_SIZE = 10000
+# rows fetched per round trip
+CHUNK_SIZE = 1000
+CACHE_TIMEOUT = 24 * 60 * 60
+
+FEED_KEY = 'blog:feed:{}'
+SITEMAP_KEY = 'blog:sitemap:{}'
+
+
+def _key(template, request, *parts):
+    # documents hold absolute URLs, so the host is part of the key
+    raw = '|'.join(str(part) for part in (request.get_host(), request.is_secure(), *parts))
+    return template.format(hashlib.md5(raw.encode()).hexdigest())
+
+
+def _stream(chunks, key):
+    # Passes the chunks on, and caches the whole document once the last one
+    # is out (not if the client went away half way).
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    cache.set(key, ''.join(parts), timeout=CACHE_TIMEOUT)
+
+
+def _respond(request, key, chunks, content_type, last_modified=None):
+    # The cached document if there is one, otherwise the document streamed
+    # from chunks(). The key changes whenever the document does, so it makes
+    # the ETag; crawlers can ask for the document conditionally.
+    etag = '"%s"' % key.rsplit(':', 1)[1]
+    last_modified = last_modified and int(last_modified.timestamp())
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if response is None:
+        cached = cache.get(key)
+        if cached is not None:
+            response = HttpResponse(cached, content_type=content_type)
+        else:
+            response = StreamingHttpResponse(_stream(chunks(), key),
+                                             content_type=content_type)
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+class _Writer:
+    # SimplerXMLGenerator writing to a buffer that is emptied every time
+    # drain() is called, so the document can be yielded piece by piece
+
+    def __init__(self):
+        self.buffer = StringIO()
+        self.xml = SimplerXMLGenerator(self.buffer, 'utf-8', short_empty_elements=True)
+
+    def drain(self):
+        chunk = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return chunk
+
+
+def _post_url(request):
+    # reverse() once; every post's URL is the same with another slug
+    pattern = request.build_absolute_uri(reverse('post_detail', args=['__slug__']))
+    return lambda slug: pattern.replace('__slug__', slug)
+
+
+# Feeds
+
+def _feed_rows(using):
+    return (Post.objects.using(using).filter(status=1).order_by('-created_on', '-id')
+            .values_list('slug', 'title', 'excerpt', 'author__username',
+                         'created_on', 'updated_on')[:FEED_SIZE]
+            .iterator(chunk_size=FEED_SIZE))
+
+
+def _rss(request, updated, using):
+    post_url = _post_url(request)
+    writer = _Writer()
+    xml = writer.xml
+    xml.startDocument()
+    xml.startElement('rss', {'version': '2.0', 'xmlns:atom': 'http://www.w3.org/2005/Atom'})
+    xml.startElement('channel', {})
+    xml.addQuickElement('title', FEED_TITLE)
+    xml.addQuickElement('link', request.build_absolute_uri(reverse('home')))
+    xml.addQuickElement('description', FEED_DESCRIPTION)
+    xml.addQuickElement('atom:link', None, {
+        'rel': 'self', 'href': request.build_absolute_uri(reverse('rss_feed'))})
+    if updated:
+        xml.addQuickElement('lastBuildDate', rfc2822_date(updated))
+    yield writer.drain()
+    for slug, title, excerpt, author, created_on, _ in _feed_rows(using):
+        xml.startElement('item', {})
+        xml.addQuickElement('title', title)
+        xml.addQuickElement('link', post_url(slug))
+        xml.addQuickElement('description', excerpt)
+        xml.addQuickElement('pubDate', rfc2822_date(created_on))
+        xml.addQuickElement('guid', post_url(slug), {'isPermaLink': 'true'})
+        xml.endElement('item')
+        yield writer.drain()
+    xml.endElement('channel')
+    xml.endElement('rss')
+    yield writer.drain()
+
+
+def _atom(request, updated, using):
+    post_url = _post_url(request)
+    home = request.build_absolute_uri(reverse('home'))
+    writer = _Writer()
+    xml = writer.xml
+    xml.startDocument()
+    xml.startElement('feed', {'xmlns': 'http://www.w3.org/2005/Atom'})
+    xml.addQuickElement('title', FEED_TITLE)
+    xml.addQuickElement('link', None, {'rel': 'alternate', 'href': home})
+    xml.addQuickElement('link', None, {
+        'rel': 'self', 'href': request.build_absolute_uri(reverse('atom_feed'))})
+    xml.addQuickElement('id', home)
+    if updated:
+        xml.addQuickElement('updated', rfc3339_date(updated))
+    yield writer.drain()
+    for slug, title, excerpt, author, created_on, updated_on in _feed_rows(using):
+        xml.startElement('entry', {})
+        xml.addQuickElement('title', title)
+        xml.addQuickElement('link', None, {'rel': 'alternate', 'href': post_url(slug)})
+        xml.addQuickElement('id', post_url(slug))
+        xml.addQuickElement('published', rfc3339_date(created_on))
+        xml.addQuickElement('updated', rfc3339_date(updated_on))
+        xml.startElement('author', {})
+        xml.addQuickElement('name', author)
+        xml.endElement('author')
+        xml.addQuickElement('summary', excerpt)
+        xml.endElement('entry')
+        yield writer.drain()
+    xml.endElement('feed')
+    yield writer.drain()
+
+
+def _feed(request, kind, build, content_type):
+    token = current_tokens(['list'])[0]
+    using = router.db_for_read(Post)
+    # the newest change among the feed's posts, for Last-Modified
+    updated = max(Post.objects.using(using).filter(status=1)
+                  .order_by('-created_on', '-id')
+                  .values_list('updated_on', flat=True)[:FEED_SIZE], default=None)
+    return _respond(request, _key(FEED_KEY, request, kind, token, updated),
+                    lambda: build(request, updated, using), content_type, updated)
+
+
+@require_safe
+def rss_feed(request):
+    return _feed(request, 'rss', _rss, 'application/rss+xml; charset=utf-8')
+
+
+@require_safe
+def atom_feed(request):
+    return _feed(request, 'atom', _atom, 'application/atom+xml; charset=utf-8')
+
+
+# Sitemap
+
+def _shard_range(shard):
+    # the ids in a shard
+    return (shard * SHARD_SIZE + 1, (shard + 1) * SHARD_SIZE)
+
+
+def _shards():
+    # [(shard, newest updated_on)] of the shards holding published posts:
+    # one GROUP BY, with at most (highest id / SHARD_SIZE) groups
+    shard = Cast((F('id') - 1) / SHARD_SIZE, IntegerField())
+    return list(Post.objects.filter(status=1).order_by()
+                .annotate(shard=shard).values('shard')
+                .annotate(lastmod=Max('updated_on')).order_by('shard')
+                .values_list('shard', 'lastmod'))
+
+
+def _sitemap_index(request, shards):
+    writer = _Writer()
+    xml = writer.xml
+    xml.startDocument()
+    xml.startElement('sitemapindex', {'xmlns': 'http://www.sitemaps.org/schemas/sitemap/0.9'})
+    for shard, lastmod in shards:
+        xml.startElement('sitemap', {})
+        xml.addQuickElement('loc', request.build_absolute_uri(
+            reverse('sitemap_shard', args=[shard])))
+        xml.addQuickElement('lastmod', rfc3339_date(lastmod))
+        xml.endElement('sitemap')
+        yield writer.drain()
+    xml.endElement('sitemapindex')
+    yield writer.drain()
+
+
+def _sitemap_shard(request, shard, using):
+    post_url = _post_url(request)
+    rows = (Post.objects.using(using).filter(status=1, id__range=_shard_range(shard))
+            .order_by('id').values_list('slug', 'updated_on')
+            .iterator(chunk_size=CHUNK_SIZE))
+    writer = _Writer()
+    xml = writer.xml
+    xml.startDocument()
+    xml.startElement('urlset', {'xmlns': 'http://www.sitemaps.org/schemas/sitemap/0.9'})
+    for index, (slug, updated_on) in enumerate(rows, 1):
+        xml.startElement('url', {})
+        xml.addQuickElement('loc', post_url(slug))
+        xml.addQuickElement('lastmod', rfc3339_date(updated_on))
+        xml.endElement('url')
+        if index % 100 == 0:
+            yield writer.drain()
+    xml.endElement('urlset')
+    yield writer.drain()
+
+
+@require_safe
+def sitemap_index(request):
+    # the shard list is only worked out when the cached index is outdated
+    token = current_tokens(['list'])[0]
+    return _respond(request, _key(SITEMAP_KEY, request, 'index', token),
+                    lambda: _sitemap_index(request, _shards()), 'application/xml')
+
+
+@require_safe
+def sitemap_shard(request, shard):
+    using = router.db_for_read(Post)
+    signature = (Post.objects.using(using)
+                 .filter(status=1, id__range=_shard_range(shard))
+                 .aggregate(lastmod=Max('updated_on'), count=Count('id')))
+    if not signature['count']:
+        raise Http404("No such sitemap.")
+    key = _key(SITEMAP_KEY, request, shard, signature['lastmod'], signature['count'])
+    return _respond(request, key, lambda: _sitemap_shard(request, shard, using),
+                    'application/xml', signature['lastmod'])
+
+
+@require_safe
+def robots_txt(request):
+    lines = ['User-agent: *', 'Disallow: /admin/',
+             f"Sitemap: {request.build_absolute_uri(reverse('sitemap'))}"]
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain')
@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .content import DEFAULT_IMAGE_WIDTH, IMAGE_WIDTHS
+
+# Featured image URLs.
+
+# Building a Cloudinary URL goes through the cloudinary SDK each time, and the
+# plain post.featured_image.url is the full-size original whatever the
+# device. So when a post is saved (see blog/signals.py) we work out, once, the
+# URLs the templates need and store them in Post.featured_image_urls:
+
+#   src, srcset                  - the post page's image, resized to
+#                                  IMAGE_WIDTHS with automatic format and
+#                                  quality (the same widths as the images in
+#                                  the post's content, see blog/content.py)
+#   thumbnail, thumbnail_srcset  - the smaller card image on the home page
+
+# How the URLs are built is up to settings.BLOG_IMAGE_URL_BUILDER, a function
+# taking the stored image and a width (None for the original) and returning
+# a URL. cloudinary_image_url is the real one; local_image_url serves files
+# from MEDIA_URL unchanged, for tests and CLOUDINARY_OFFLINE.
+
+# the post page's image fills half of the masthead (which phones don't show)
+MASTHEAD_SIZES = '(min-width: 768px) 50vw, 100vw'
+THUMBNAIL_WIDTHS = (400, 800)
+DEFAULT_THUMBNAIL_WIDTH = 400
+# cards are a third of the row on desktop, the full width on phones
+THUMBNAIL_SIZES = '(min-width: 768px) 33vw, 100vw'
+PLACEHOLDER = 'placeholder'
+
+
+def public_id(image):
+    # the field holds a CloudinaryResource, or a plain string before upload
+    return getattr(image, 'public_id', image) or ''
+
+
+def is_placeholder(image):
+    return public_id(image) in ('', PLACEHOLDER)
+
+
+def cloudinary_image_url(image, width=None):
+    if width is None:
+        return image.build_url(secure=True)
+    return image.build_url(secure=True, width=width, crop='limit',
+                           fetch_format='auto', quality='auto')
+
+
+def local_image_url(image, width=None):
+    name = public_id(image)
+    if getattr(image, 'format', None):
+        name = f"{name}.{image.format}"
+    return f"{settings.MEDIA_URL}{name}"
+
+
+def featured_image_urls(image):
+    # The URLs to store for a featured image; empty for the placeholder,
+    # which the templates replace with the default picture.
+    if is_placeholder(image):
+        return {}
+    build = import_string(settings.BLOG_IMAGE_URL_BUILDER)
+
+    def srcset(widths):
+        return ', '.join(f"{build(image, width)} {width}w" for width in widths)
+
+    return {
+        'src': build(image, DEFAULT_IMAGE_WIDTH),
+        'srcset': srcset(IMAGE_WIDTHS),
+        'sizes': MASTHEAD_SIZES,
+        'thumbnail': build(image, DEFAULT_THUMBNAIL_WIDTH),
+        'thumbnail_srcset': srcset(THUMBNAIL_WIDTHS),
+        'thumbnail_sizes': THUMBNAIL_SIZES,
+    }
+
+
+def render_featured_image(post):
+    # Fills post.featured_image_urls. Doesn't save the post.
+    post.featured_image_urls = featured_image_urls(post.featured_image)
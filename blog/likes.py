@@ -0,0 +1,66 @@
+from django.db import connection, transaction
+from django.db.models import F
+
+from .models import Post
+from .cache import invalidate_post
+
+# Liking and unliking a post.
+
+# The old toggle read the post, asked "does this user like it?", then added or
+# removed the like: four queries, and two quick clicks could both see "not
+# liked" and both try to add. Here the database decides instead. We first try
+# to DELETE the like; if a row was deleted the post is now unliked. Otherwise
+# we INSERT it, skipping the insert if the row already exists (a concurrent
+# click got there first). The number of rows each statement touched tells us
+# exactly what happened, so the stored like_count always moves by the real
+# change, and nothing has to be read beforehand.
+
+Like = Post.likes.through
+
+
+def _insert_like(slug, user_id):
+    # INSERT ... SELECT from blog_post, so the post is looked up by slug in the
+    # same statement. The ignore-conflicts syntax differs per database
+    # (ON CONFLICT DO NOTHING / INSERT OR IGNORE), so ask Django for it.
+    ops = connection.ops
+    qn = ops.quote_name
+    sql = (
+        f"{ops.insert_statement(ignore_conflicts=True)} "
+        f"{qn(Like._meta.db_table)} ({qn('post_id')}, {qn('user_id')}) "
+        f"SELECT {qn('id')}, %s FROM {qn(Post._meta.db_table)} "
+        f"WHERE {qn('slug')} = %s "
+        f"{ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user_id, slug])
+        return cursor.rowcount
+
+
+def toggle_like(slug, user_id):
+    # Returns True if the post is now liked by the user, False if unliked.
+    # Raises Post.DoesNotExist if there is no post with this slug.
+    with transaction.atomic():
+        deleted, _ = Like.objects.filter(
+            post__slug=slug, user_id=user_id).delete()
+        if deleted:
+            Post.objects.filter(slug=slug).update(
+                like_count=F('like_count') - deleted)
+            liked = False
+        elif _insert_like(slug, user_id):
+            Post.objects.filter(slug=slug).update(
+                like_count=F('like_count') + 1)
+            liked = True
+        else:
+            liked = None
+
+    if liked is not None:
+        # these queries bypass the model signals, so refresh the cached pages
+        # showing the like count here
+        invalidate_post(slug)
+        return liked
+
+    # Nothing deleted and nothing inserted: either the post doesn't exist, or a
+    # concurrent request liked it between our two statements.
+    if not Post.objects.filter(slug=slug).exists():
+        raise Post.DoesNotExist(slug)
+    return True
@@ -0,0 +1,51 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Compares the sync and the async views (blog/async_views.py) under the same
+# concurrent load, by running load_test three times:
+
+#   sync views under WSGI   - the current gunicorn deployment
+#   sync views under ASGI   - the same views behind uvicorn workers
+#   async views under ASGI  - BLOG_ASYNC_VIEWS=True behind uvicorn workers
+
+# Each run is a separate process, since BLOG_ASYNC_VIEWS decides the URL
+# routes when the project starts. The async views only pay off when requests
+# wait on the database, so the default adds 2 ms per query (--db-latency),
+# roughly a database in the same data centre. Seed the database first (see
+# blog/benchmarks.py).
+
+# Usage: python manage.py bench_async_views [--requests 1000] [--concurrency 32]
+#                                           [--db-latency 2]
+
+RUNS = (
+    ('wsgi', 'False'),
+    ('asgi', 'False'),
+    ('asgi', 'True'),
+)
+
+
+class Command(BaseCommand):
+    help = "Compare the throughput of the sync and async views under load."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--db-latency', type=float, default=2)
+
+    def handle(self, *args, **options):
+        manage = os.path.join(settings.BASE_DIR, 'manage.py')
+        for server, async_views in RUNS:
+            result = subprocess.run(
+                [sys.executable, manage, 'load_test', '--server', server,
+                 '--requests', str(options['requests']),
+                 '--concurrency', str(options['concurrency']),
+                 '--db-latency', str(options['db_latency'])],
+                env={**os.environ, 'BLOG_ASYNC_VIEWS': async_views},
+                capture_output=True, text=True)
+            if result.returncode:
+                raise CommandError(result.stderr or result.stdout)
+            self.stdout.write(result.stdout)
@@ -0,0 +1,61 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from django.test import Client
+from django.urls import reverse
+
+# Measures how much of a cheap request's latency is spent connecting to the
+# database, by requesting the same page with a new connection per request
+# (CONN_MAX_AGE = 0) and with a persistent one (CONN_MAX_AGE > 0).
+
+# Under gunicorn, close_old_connections runs on the request_started and
+# request_finished signals and closes the connection once CONN_MAX_AGE is
+# up. The test client disconnects it from both signals (so tests keep their
+# connection), which is why run() calls it around every request itself.
+# Point DATABASE_URL at a local PostgreSQL to get meaningful numbers; with
+# SQLite connecting is almost free.
+
+# Usage: python manage.py bench_db_connections [--requests 200] [--path /]
+
+
+class Command(BaseCommand):
+    help = "Compare request latency with and without persistent DB connections."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--path', default=None,
+                            help="Page to request (default: the home page).")
+
+    def run(self, client, path, count, max_age):
+        connection.close()
+        connection.settings_dict['CONN_MAX_AGE'] = max_age
+        timings = []
+        for _ in range(count):
+            start = time.perf_counter()
+            # what the request_started/request_finished handlers would do
+            close_old_connections()
+            response = client.get(path)
+            close_old_connections()
+            timings.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} answered {response.status_code}")
+        timings.sort()
+        return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
+
+    def handle(self, *args, **options):
+        path = options['path'] or reverse('home')
+        client = Client(HTTP_HOST='127.0.0.1')
+        original = connection.settings_dict['CONN_MAX_AGE']
+        self.stdout.write(f"{options['requests']} requests to {path} "
+                          f"({connection.vendor}, engine {connection.settings_dict['ENGINE']})")
+        try:
+            # warm up imports and template caches first
+            self.run(client, path, 5, 0)
+            for label, max_age in (("new connection per request", 0),
+                                   ("persistent connection", 600)):
+                p50, p99 = self.run(client, path, options['requests'], max_age)
+                self.stdout.write(f"{label:<30} p50 {p50:7.2f} ms   p99 {p99:7.2f} ms")
+        finally:
+            connection.settings_dict['CONN_MAX_AGE'] = original
@@ -0,0 +1,71 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from blog.models import Post, Comment
+
+# Runs EXPLAIN on the hot blog queries and reports whether the database reads
+# them through an index or has to scan the whole table and sort it.
+
+# Usage (seeds data first, best run against a scratch database):
+#   python manage.py bench_explain --seed-posts 100000 --seed-comments 500000
+
+# The words each database uses in its plan for "read the table in index order"
+# and for "scan everything and sort it afterwards".
+INDEX_MARKERS = {
+    'postgresql': ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan'),
+    'sqlite': ('USING INDEX', 'USING COVERING INDEX'),
+}
+SORT_MARKERS = {
+    'postgresql': ('Sort', 'Seq Scan'),
+    'sqlite': ('USE TEMP B-TREE',),
+}
+
+
+def hot_queries():
+    post = Post.objects.filter(status=1).order_by('-created_on').first()
+    queries = {
+        'published posts, newest first':
+            Post.objects.filter(status=1).order_by('-created_on', '-id')[:6],
+    }
+    if post is not None:
+        queries['approved comments of a post'] = (
+            Comment.objects.filter(post=post, approved=True)
+            .order_by('created_on'))
+    return queries
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the hot blog queries and check they use an index."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed-posts', type=int, default=0,
+                            help="Seed this many posts before explaining.")
+        parser.add_argument('--seed-comments', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['seed_posts']:
+            call_command(
+                'seed_blog', posts=options['seed_posts'],
+                comments=options['seed_comments'], stdout=self.stdout)
+        # refresh the planner statistics, otherwise the freshly seeded tables
+        # look empty and a sequential scan seems cheapest
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        vendor = connection.vendor
+        failures = 0
+        for name, queryset in hot_queries().items():
+            plan = queryset.explain()
+            uses_index = any(m in plan for m in INDEX_MARKERS.get(vendor, ()))
+            sorts = any(m in plan for m in SORT_MARKERS.get(vendor, ()))
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(plan)
+            if uses_index and not sorts:
+                self.stdout.write(self.style.SUCCESS("-> index scan\n"))
+            else:
+                failures += 1
+                self.stdout.write(self.style.ERROR("-> scan and sort\n"))
+
+        if failures:
+            self.stderr.write(f"{failures} hot queries are not index-backed.")
@@ -0,0 +1,76 @@
+import statistics
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+
+from blog.models import Post
+from blog.search import full_text_search_available, search_posts
+
+# Times post searches: the old admin-style ILIKE '%term%' over title and
+# content against the full-text search of blog/search.py.
+
+# Usage (seeds data first, best run against a scratch PostgreSQL database):
+#   python manage.py bench_search --seed-posts 300000
+
+SEARCHES = ('database', 'cache worker', 'mountain bicycle', 'brotli', 'async queue')
+
+
+def ilike_search(terms):
+    match = Q()
+    for word in terms.split():
+        match &= Q(title__icontains=word) | Q(content__icontains=word)
+    return Post.objects.filter(status=1).filter(match).order_by('-created_on')
+
+
+def timed(run, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+class Command(BaseCommand):
+    help = "Compare ILIKE and full-text post search times."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed-posts', type=int, default=0,
+                            help="Seed this many posts before searching.")
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        if options['seed_posts']:
+            call_command('seed_blog', posts=options['seed_posts'],
+                         comments=0, likes=0, stdout=self.stdout)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        published = Post.objects.filter(status=1).defer('content', 'content_html')
+        self.stdout.write(f"{published.count()} published posts, "
+                          f"{connection.vendor} database\n")
+        if not full_text_search_available():
+            self.stdout.write(self.style.WARNING(
+                "Not PostgreSQL: 'search' is the icontains fallback on title "
+                "and excerpt, not the full-text index.\n"))
+
+        self.stdout.write(f"{'terms':<20}{'ILIKE ms':>12}{'search ms':>12}{'hits':>10}")
+        for terms in SEARCHES:
+            # first page of results plus the total, like the search page shows
+            def run_ilike():
+                queryset = ilike_search(terms)
+                list(queryset[:10])
+                return queryset.count()
+
+            def run_search():
+                queryset = search_posts(published, terms)
+                list(queryset[:10])
+                return queryset.count()
+
+            ilike_ms = timed(run_ilike, options['repeat'])
+            search_ms = timed(run_search, options['repeat'])
+            self.stdout.write(
+                f"{terms:<20}{ilike_ms:>12.1f}{search_ms:>12.1f}{run_search():>10}")
@@ -0,0 +1,101 @@
+import shutil
+import tempfile
+import time
+
+from django.contrib.staticfiles.management.commands.collectstatic import (
+    Command as CollectStatic)
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from codestar.middleware import StaticFilesMiddleware
+from codestar.staticfiles import brotli
+
+# Compares the ways of deploying and serving the static files (STATIC_FILES in
+# codestar/settings.py):
+
+#   1. cold deploy: collectstatic into an empty STATIC_ROOT with plain,
+#      hashed (manifest) and hashed + precompressed storage, then once more
+#      into the same STATIC_ROOT, as a redeploy with unchanged files would.
+#      With --cloudinary also the current StaticHashedCloudinaryStorage,
+#      which really uploads to the account in CLOUDINARY_URL;
+#   2. bytes on the wire: what StaticFilesMiddleware sends for every hashed
+#      file, and for the stylesheet every page links (css/style.css), to a
+#      client accepting nothing, gzip, and gzip + brotli. Repeat visits cost
+#      nothing at all: the files are cached as immutable.
+
+# Usage: python manage.py bench_static [--cloudinary]
+
+LOCAL_STORAGES = (
+    ('plain', 'django.contrib.staticfiles.storage.StaticFilesStorage'),
+    ('manifest', 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage'),
+    ('compressed', 'codestar.staticfiles.CompressedManifestStaticFilesStorage'),
+)
+CLOUDINARY_STORAGE = 'cloudinary_storage.storage.StaticHashedCloudinaryStorage'
+
+ACCEPT = (
+    ('identity', ''),
+    ('gzip', 'gzip, deflate'),
+    ('br', 'gzip, deflate, br'),
+)
+
+
+def collect(storage, root, command=None):
+    # seconds taken by collectstatic
+    with override_settings(STATIC_ROOT=root, STATICFILES_STORAGE=storage):
+        start = time.perf_counter()
+        call_command(command or CollectStatic(), interactive=False, verbosity=0)
+        return time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = "Benchmark collectstatic time and static bytes on the wire."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--cloudinary', action='store_true',
+            help="Also time a collectstatic that uploads to Cloudinary.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'collectstatic':<14}{'cold s':>9}{'redeploy s':>12}")
+        roots = {}
+        for label, storage in LOCAL_STORAGES:
+            roots[label] = tempfile.mkdtemp()
+            cold = collect(storage, roots[label])
+            warm = collect(storage, roots[label])
+            self.stdout.write(f"{label:<14}{cold:>9.2f}{warm:>12.2f}")
+        if options['cloudinary']:
+            # the project's collectstatic is cloudinary_storage's
+            root = tempfile.mkdtemp()
+            cold = collect(CLOUDINARY_STORAGE, root, 'collectstatic')
+            warm = collect(CLOUDINARY_STORAGE, root, 'collectstatic')
+            shutil.rmtree(root)
+            self.stdout.write(f"{'cloudinary':<14}{cold:>9.2f}{warm:>12.2f}")
+
+        try:
+            self.bytes_on_the_wire(roots['compressed'])
+        finally:
+            for root in roots.values():
+                shutil.rmtree(root)
+
+    def bytes_on_the_wire(self, root):
+        with override_settings(STATIC_ROOT=root, STATICFILES_STORAGE=LOCAL_STORAGES[-1][1]):
+            middleware = StaticFilesMiddleware(lambda request: HttpResponse(status=404))
+            names = sorted(middleware.hashed)
+            stylesheet = staticfiles_storage.stored_name('css/style.css')
+        factory = RequestFactory()
+
+        def sent(name, accept):
+            response = middleware(factory.get(f'/static/{name}', HTTP_ACCEPT_ENCODING=accept))
+            response.close()
+            return int(response['Content-Length'])
+
+        self.stdout.write(f"\n{len(names)} hashed files"
+                          f"{'' if brotli else ' (Brotli not installed: no .br copies)'}")
+        self.stdout.write(f"{'accepts':<14}{'all files':>12}{'style.css':>12}")
+        for label, accept in ACCEPT:
+            total = sum(sent(name, accept) for name in names)
+            self.stdout.write(f"{label:<14}{total:>12}{sent(stylesheet, accept):>12}")
@@ -0,0 +1,93 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+
+from blog.benchmarks import QUERY_BUDGETS, scenarios, summarize
+from blog.models import Post
+from codestar.timing import RequestTimer
+
+# Micro-benchmarks for the blog's hot endpoints: the post list, a post's page
+# (logged out and logged in) and the like toggle. Each is requested
+# --requests times in-process through the test client; the command prints the
+# latency percentiles and the number of queries per request next to its
+# budget (blog/benchmarks.py). With --check it fails when a budget is
+# exceeded, so it can run in CI.
+
+# Requests go through the whole middleware stack, so run it with the
+# settings you want to measure (e.g. BLOG_PAGE_CACHE on or off). The like
+# toggle really writes; an even number of requests leaves the likes as they
+# were. It is also requested far faster than the like rate limit allows
+# (blog/ratelimit.py), so the limit is off while the command runs.
+
+# Usage: python manage.py bench_views [--requests 200] [--slug SLUG] [--check]
+
+BENCH_USER = 'bench-user'
+
+
+class Command(BaseCommand):
+    help = "Benchmark PostList, PostDetail and PostLike and check their query budgets."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--slug', help="Post to use (default: the newest published one).")
+        parser.add_argument('--check', action='store_true',
+                            help="Exit with an error if a query budget is exceeded.")
+
+    @override_settings(BLOG_RATE_LIMIT=False)
+    def handle(self, *args, **options):
+        slug = options['slug'] or (Post.objects.filter(status=1)
+                                   .values_list('slug', flat=True).first())
+        if slug is None:
+            raise CommandError("No published posts; run seed_blog first.")
+        # an even count, so the like toggle ends where it started
+        count = options['requests'] + options['requests'] % 2
+
+        anonymous = Client(HTTP_HOST='127.0.0.1')
+        member = Client(HTTP_HOST='127.0.0.1')
+        user, _ = User.objects.get_or_create(username=BENCH_USER)
+        member.force_login(user)
+
+        self.stdout.write(f"{count} requests per endpoint, post {slug!r} ({connection.vendor})")
+        self.stdout.write(f"{'endpoint':<28}{'p50 ms':>9}{'p99 ms':>9}{'mean ms':>9}"
+                          f"{'queries':>9}{'budget':>8}")
+        over_budget = []
+        for scenario in scenarios(slug):
+            client = member if scenario.authenticated else anonymous
+            request = getattr(client, scenario.method)
+
+            # one request to warm up and count the queries, outside the timing
+            # (the test client clears connection.queries at every request, so
+            # they are counted with RequestTimer's execute wrapper)
+            counter = RequestTimer()
+            self.check_response(scenario, counter.measure(request, scenario.path))
+            queries = counter.query_count
+            timings = []
+            for _ in range(count):
+                start = time.perf_counter()
+                response = request(scenario.path)
+                timings.append((time.perf_counter() - start) * 1000)
+                self.check_response(scenario, response)
+            # the warm-up toggled the like once more; toggle it back
+            if scenario.method == 'post':
+                request(scenario.path)
+
+            stats = summarize(timings)
+            budget = QUERY_BUDGETS[scenario.name]
+            flag = '' if queries <= budget else '  OVER BUDGET'
+            if flag:
+                over_budget.append(scenario.name)
+            self.stdout.write(
+                f"{scenario.name:<28}{stats['p50']:>9.2f}{stats['p99']:>9.2f}"
+                f"{stats['mean']:>9.2f}{queries:>9}{budget:>8}{flag}")
+
+        if options['check'] and over_budget:
+            raise CommandError(f"Over the query budget: {', '.join(over_budget)}")
+
+    def check_response(self, scenario, response):
+        if response.status_code >= 400:
+            raise CommandError(
+                f"{scenario.name}: {scenario.path} answered {response.status_code}")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from blog.related import BATCH_SIZE, build_related_posts
+
+# Rebuilds the related posts of every published post (blog/related.py). Run
+# it once after deploying, and after importing posts with bulk_create (which
+# queues no indexing tasks); day to day the run_tasks worker keeps the lists
+# up to date as posts are saved.
+
+# Usage: python manage.py build_related_posts [--batch-size 500]
+
+
+class Command(BaseCommand):
+    help = "Recompute the related posts shown under every post."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        posts, rows = build_related_posts(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Found {rows} related posts for {posts} posts."))
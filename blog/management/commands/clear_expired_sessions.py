@@ -0,0 +1,63 @@
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore as DatabaseSessionStore
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+# Deletes expired sessions from the django_session table (the "db" and
+# "cached_db" session backends, see SESSION_BACKEND in codestar/settings.py).
+# Unlike Django's own clearsessions, which removes them all in one DELETE,
+# this goes BATCH_SIZE rows at a time, so a large backlog never holds long
+# locks on the table that every logged-in request reads. Sessions in the
+# cache expire on their own, and signed-cookie sessions aren't stored
+# anywhere.
+
+# Usage: python manage.py clear_expired_sessions [--batch-size 1000] [--sleep 0]
+
+BATCH_SIZE = 1000
+
+
+def delete_expired_sessions(model, batch_size=BATCH_SIZE, sleep=0):
+    # Returns the number of sessions deleted. Only sessions that had expired
+    # when it started are deleted, so it always finishes.
+    now = timezone.now()
+    total = 0
+    while True:
+        # expire_date is indexed
+        keys = list(model.objects.filter(expire_date__lt=now)
+                    .values_list('session_key', flat=True)[:batch_size])
+        if not keys:
+            return total
+        deleted, _ = model.objects.filter(session_key__in=keys).delete()
+        total += deleted
+        if sleep:
+            time.sleep(sleep)
+
+
+class Command(BaseCommand):
+    help = "Delete expired sessions in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument(
+            '--sleep', type=float, default=0,
+            help="Seconds to pause between batches, to spread the load.")
+
+    def handle(self, *args, **options):
+        engine = import_module(settings.SESSION_ENGINE)
+        store = engine.SessionStore
+        if issubclass(store, DatabaseSessionStore):
+            deleted = delete_expired_sessions(
+                store.get_model_class(), options['batch_size'], options['sleep'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Deleted {deleted} expired sessions."))
+            return
+        try:
+            store.clear_expired()
+        except NotImplementedError:
+            self.stdout.write(f"{settings.SESSION_ENGINE} doesn't store sessions "
+                              "on the server; nothing to delete.")
+        else:
+            self.stdout.write(self.style.SUCCESS("Expired sessions deleted."))
@@ -0,0 +1,173 @@
+import asyncio
+import io
+import itertools
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.conf import settings
+from django.urls import reverse
+
+from blog.benchmarks import summarize
+from blog.models import Post
+
+# A local load test: fires --requests GET requests, --concurrency at a time,
+# at the project's real WSGI (codestar.wsgi) or ASGI (codestar.asgi)
+# application, called in-process - so it measures Django and the database,
+# not a web server or the network - and reports latency percentiles and
+# throughput.
+
+# WSGI requests run on a pool of threads, like gunicorn's gthread workers.
+# ASGI requests run as tasks on one event loop, like a uvicorn worker.
+
+# By default the requests cycle through the home page, its second page and
+# the newest published posts. Seed the database first (see
+# blog/benchmarks.py).
+
+# --db-latency adds a delay to every query, to stand in for a database
+# across a network (a local SQLite answers in microseconds, which hides what
+# waiting on the database does to a server).
+
+# Usage: python manage.py load_test [--server wsgi|asgi] [--requests 2000]
+#                                   [--concurrency 16] [--db-latency 2]
+#                                   [--path /some/page/ ...]
+
+HOST = '127.0.0.1'
+
+
+def wsgi_environ(path):
+    path, _, query = path.partition('?')
+    return {
+        'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '', 'PATH_INFO': path,
+        'QUERY_STRING': query, 'SERVER_NAME': HOST, 'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': HOST,
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True, 'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+
+
+def asgi_scope(path):
+    path, _, query = path.partition('?')
+    return {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path,
+        'raw_path': path.encode(), 'query_string': query.encode(),
+        'root_path': '', 'headers': [(b'host', HOST.encode())],
+        'client': ('127.0.0.1', 50000), 'server': (HOST, 80),
+    }
+
+
+def add_db_latency(milliseconds):
+    def slow(execute, sql, params, many, context):
+        time.sleep(milliseconds / 1000)
+        return execute(sql, params, many, context)
+
+    def install(connection, **kwargs):
+        if slow not in connection.execute_wrappers:
+            connection.execute_wrappers.append(slow)
+
+    # every thread gets its own connections, so catch them as they connect
+    connection_created.connect(install, weak=False)
+    for connection in connections.all():
+        install(connection)
+
+
+class Command(BaseCommand):
+    help = "Load test the WSGI or ASGI application in-process."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--db-latency', type=float, default=0,
+                            help="Milliseconds to add to every query.")
+        parser.add_argument('--path', action='append', dest='paths',
+                            help="Page to request; repeat for several.")
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or self.default_paths()
+        if options['db_latency']:
+            add_db_latency(options['db_latency'])
+        count = options['requests']
+        self.stdout.write(
+            f"{count} requests, {options['concurrency']} at a time, "
+            f"{options['server'].upper()}, over {len(paths)} pages"
+            f"{', async views' if settings.BLOG_ASYNC_VIEWS else ''}"
+            f"{', +%g ms per query' % options['db_latency'] if options['db_latency'] else ''}")
+
+        run = self.run_wsgi if options['server'] == 'wsgi' else self.run_asgi
+        # a few requests first, so imports and template loading aren't timed
+        run(paths, len(paths), 1)
+        start = time.perf_counter()
+        timings, errors = run(paths, count, options['concurrency'])
+        elapsed = time.perf_counter() - start
+
+        stats = summarize(timings)
+        self.stdout.write(
+            f"p50 {stats['p50']:.2f} ms   p99 {stats['p99']:.2f} ms   "
+            f"mean {stats['mean']:.2f} ms")
+        self.stdout.write(f"throughput {count / elapsed:.1f} requests/s "
+                          f"({elapsed:.2f} s), {errors} errors")
+        if errors:
+            raise CommandError(f"{errors} requests did not answer 200")
+
+    def default_paths(self):
+        slugs = list(Post.objects.filter(status=1)
+                     .values_list('slug', flat=True)[:20])
+        if not slugs:
+            raise CommandError("No published posts; run seed_blog first.")
+        return ([reverse('home'), reverse('home') + '?page=2'] +
+                [reverse('post_detail', args=[slug]) for slug in slugs])
+
+    def run_wsgi(self, paths, count, concurrency):
+        from codestar.wsgi import application
+
+        requests = itertools.islice(itertools.cycle(paths), count)
+
+        def one(path):
+            status = []
+            start = time.perf_counter()
+            body = application(wsgi_environ(path),
+                               lambda s, headers, exc_info=None: status.append(s))
+            try:
+                for _ in body:
+                    pass
+            finally:
+                # closing the body fires request_finished, as a server would
+                body.close()
+            return (time.perf_counter() - start) * 1000, status[0].startswith('200')
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(one, requests))
+        return [ms for ms, _ in results], sum(not ok for _, ok in results)
+
+    def run_asgi(self, paths, count, concurrency):
+        from codestar.asgi import application
+
+        async def one(path, semaphore):
+            async with semaphore:
+                status = []
+
+                async def receive():
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+                async def send(message):
+                    if message['type'] == 'http.response.start':
+                        status.append(message['status'])
+
+                start = time.perf_counter()
+                await application(asgi_scope(path), receive, send)
+                return (time.perf_counter() - start) * 1000, status[0] == 200
+
+        async def main():
+            semaphore = asyncio.Semaphore(concurrency)
+            requests = itertools.islice(itertools.cycle(paths), count)
+            return await asyncio.gather(*(one(path, semaphore) for path in requests))
+
+        results = asyncio.run(main())
+        return [ms for ms, _ in results], sum(not ok for _, ok in results)
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from blog.ratelimit import rejected_counts, reset_rejected_counts
+
+# Shows how many likes and comments the rate limits (blog/ratelimit.py) have
+# turned away, per action and per scope (user or IP), with the limits in force. The
+# counters are kept in the cache; --reset starts them again from zero.
+
+# Usage: python manage.py rate_limit_stats [--reset]
+
+
+class Command(BaseCommand):
+    help = "Show the requests rejected by the like and comment rate limits."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help="Set the counters back to zero afterwards.")
+
+    def handle(self, *args, **options):
+        if not settings.BLOG_RATE_LIMIT:
+            self.stdout.write("Rate limiting is off (BLOG_RATE_LIMIT).")
+        self.stdout.write(f"{'action':<10}{'scope':<8}{'limit':>10}{'rejected':>10}")
+        for (action, scope), rejected in rejected_counts().items():
+            limit = settings.BLOG_RATE_LIMITS[action][scope]
+            self.stdout.write(f"{action:<10}{scope:<8}{limit:>10}{rejected:>10}")
+        if options['reset']:
+            reset_rejected_counts()
+            self.stdout.write(self.style.SUCCESS("Counters reset."))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from blog.counters import recount
+
+# Rebuilds Post.like_count and Post.approved_comment_count from the likes and
+# comments tables, to repair any drift in the stored counters.
+
+# Usage: python manage.py recount_post_counters [--batch-size 1000]
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored like and approved comment counts of every post."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = recount(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Recounted {total} posts."))
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from blog.content import render_post
+from blog.images import PLACEHOLDER, render_featured_image
+from blog.models import Post
+
+# Fills Post.content_html (and blank or generated excerpts) and Post.featured_image_urls
+# for posts that don't have them yet, e.g. posts written before the content
+# pipeline existed or created with bulk_create. With --all every post is
+# re-rendered, which is needed after changing the pipeline in blog/content.py
+# or the image URLs in blog/images.py.
+
+# Usage: python manage.py render_post_content [--all] [--batch-size 500]
+
+
+class Command(BaseCommand):
+    help = "Pre-render the sanitized HTML of the posts' content."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help="Re-render every post, not just the missing ones.")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        queryset = Post.objects.order_by('pk').only(
+            'id', 'content', 'excerpt', 'excerpt_generated', 'featured_image')
+        if not options['all']:
+            queryset = queryset.filter(
+                Q(content_html='') |
+                Q(featured_image_urls={}) & ~Q(featured_image=PLACEHOLDER))
+
+        # walk the table in primary key order, one batch at a time, so only a
+        # batch of posts is ever held in memory
+        done, last_pk = 0, 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            for post in batch:
+                render_post(post)
+                render_featured_image(post)
+            # bulk_update doesn't send pre_save/post_save, so this neither
+            # re-renders nor touches updated_on
+            Post.objects.bulk_update(batch, ['content_html', 'excerpt', 'excerpt_generated',
+                                             'featured_image_urls'])
+            done += len(batch)
+            last_pk = batch[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f"Rendered {done} posts."))
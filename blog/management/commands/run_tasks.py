@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from blog.tasks import BATCH_SIZE, run_due_tasks
+
+# The background worker: runs the tasks queued with blog.tasks.enqueue()
+# (comment moderation and author notifications) until stopped. Run one or more
+# next to the web process, e.g. a "worker: python manage.py run_tasks" line in
+# the Procfile. On PostgreSQL several workers can run side by side; on SQLite
+# run just one.
+
+# Usage: python manage.py run_tasks [--batch-size 100] [--sleep 1] [--once]
+
+
+class Command(BaseCommand):
+    help = "Run queued background tasks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument(
+            '--sleep', type=float, default=1.0,
+            help="Seconds to wait before looking again when the queue is empty.")
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit when no more tasks are due instead of waiting for more.")
+
+    def handle(self, *args, **options):
+        total = 0
+        try:
+            while True:
+                # the worker is long-lived: drop connections that went stale
+                close_old_connections()
+                done = run_due_tasks(options['batch_size'])
+                total += done
+                if done:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Ran {total} tasks."))
@@ -0,0 +1,139 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from blog.counters import recount
+from blog.models import Post, Comment
+from blog.search import update_search_vectors
+
+# Fills the database with fake users, posts, comments and likes so the
+# benchmarks have realistic amounts of data to work on. Everything is written
+# with bulk_create in batches, so seeding hundreds of thousands of rows takes
+# seconds rather than hours.
+
+# Usage: python manage.py seed_blog --posts 100000 --comments 500000 --likes 300000
+
+BATCH_SIZE = 5000
+
+# post titles and bodies are random picks from these words, so searches and
+# text indexes see realistic, varied text rather than one repeated sentence
+WORDS = (
+    "django python database index query cache page template view model "
+    "server latency request response cloud image upload deploy heroku "
+    "postgres sqlite migration signal comment like author post draft "
+    "publish search vector rank token session cookie static brotli gzip "
+    "worker thread async queue batch stream feed sitemap benchmark profile "
+    "memory disk network socket router replica primary pool connection "
+    "coffee travel garden recipe mountain river winter summer music guitar "
+    "camera photo story weekend family friend city forest ocean bicycle"
+).split()
+
+
+@contextmanager
+def spread_timestamps(*models_):
+    # created_on is auto_now_add, which would stamp every seeded row with the
+    # same "now". Switching it off for the duration of the seed lets us give
+    # each row its own date, so the ORDER BY created_on queries behave like
+    # they would on a real archive.
+    fields = [model._meta.get_field('created_on') for model in models_]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = "Seed the blog with fake users, posts, comments and likes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--comments', type=int, default=5000)
+        parser.add_argument('--likes', type=int, default=5000)
+        parser.add_argument(
+            '--draft-ratio', type=float, default=0.1,
+            help="Fraction of the posts that are left as drafts.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        # seeded rows are prefixed with a per-run tag, so running the command
+        # twice doesn't collide on the unique title/slug/username columns
+        tag = f"seed{timezone.now():%Y%m%d%H%M%S%f}"
+        now = timezone.now()
+
+        with transaction.atomic(), spread_timestamps(Post, Comment):
+            users = self.seed_users(tag, options['users'])
+            posts = self.seed_posts(tag, rng, now, users, options)
+            self.seed_comments(rng, now, posts, options['comments'])
+            self.seed_likes(rng, posts, users, options['likes'])
+            # bulk_create skips the signals that normally maintain these
+            seeded = Post.objects.filter(slug__startswith=f"{tag}-")
+            recount(seeded, batch_size=BATCH_SIZE)
+            update_search_vectors(seeded)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(users)} users, {len(posts)} posts, "
+            f"{options['comments']} comments and up to {options['likes']} likes."))
+
+    def seed_users(self, tag, count):
+        User.objects.bulk_create(
+            (User(username=f"{tag}-user{i}") for i in range(count)),
+            batch_size=BATCH_SIZE)
+        return list(User.objects.filter(
+            username__startswith=f"{tag}-").values_list('id', flat=True))
+
+    def seed_posts(self, tag, rng, now, users, options):
+        count = options['posts']
+
+        def posts():
+            for i in range(count):
+                content = ''.join(
+                    f"<p>{' '.join(rng.choices(WORDS, k=rng.randint(40, 120)))}.</p>"
+                    for _ in range(rng.randint(2, 8)))
+                yield Post(
+                    title=f"{' '.join(rng.choices(WORDS, k=4)).capitalize()} {tag} {i}",
+                    slug=f"{tag}-post-{i}",
+                    author_id=rng.choice(users),
+                    content=content,
+                    # generated from plain words, so already safe to show
+                    content_html=content,
+                    excerpt=' '.join(rng.choices(WORDS, k=20)),
+                    status=0 if rng.random() < options['draft_ratio'] else 1,
+                    # one post roughly every hour, going back in time
+                    created_on=now - timedelta(hours=count - i),
+                )
+        Post.objects.bulk_create(posts(), batch_size=BATCH_SIZE)
+        return list(Post.objects.filter(
+            slug__startswith=f"{tag}-").values_list('id', 'created_on'))
+
+    def seed_comments(self, rng, now, posts, count):
+        def comments():
+            for i in range(count):
+                post_id, post_created = rng.choice(posts)
+                age = max((now - post_created).total_seconds(), 1)
+                yield Comment(
+                    post_id=post_id,
+                    name=f"reader{i}",
+                    email=f"reader{i}@example.com",
+                    body="Great post!",
+                    approved=rng.random() < 0.8,
+                    created_on=post_created + timedelta(
+                        seconds=rng.uniform(0, age)),
+                )
+        Comment.objects.bulk_create(comments(), batch_size=BATCH_SIZE)
+
+    def seed_likes(self, rng, posts, users, count):
+        Like = Post.likes.through
+        pairs = {(rng.choice(posts)[0], rng.choice(users)) for _ in range(count)}
+        Like.objects.bulk_create(
+            (Like(post_id=post_id, user_id=user_id) for post_id, user_id in pairs),
+            batch_size=BATCH_SIZE, ignore_conflicts=True)
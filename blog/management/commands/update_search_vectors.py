@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.models import Post
+from blog.search import full_text_search_available, update_search_vectors
+
+# Fills Post.search_vector for posts that don't have one yet (e.g. created
+# before search existed, or with bulk_create). With --all every post is
+# re-indexed. PostgreSQL only.
+
+# Usage: python manage.py update_search_vectors [--all] [--batch-size 5000]
+
+
+class Command(BaseCommand):
+    help = "Build the full-text search entries of the posts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help="Re-index every post, not just the missing ones.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if not full_text_search_available():
+            raise CommandError("Full-text search needs a PostgreSQL database.")
+
+        queryset = Post.objects.order_by('pk')
+        if not options['all']:
+            queryset = queryset.filter(search_vector__isnull=True)
+        ids = queryset.values_list('pk', flat=True)
+
+        # one UPDATE per batch of primary keys, so no single statement holds
+        # locks on the whole table
+        done, last_pk = 0, 0
+        while True:
+            batch = list(ids.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            done += update_search_vectors(Post.objects.filter(pk__in=batch))
+            last_pk = batch[-1]
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {done} posts."))
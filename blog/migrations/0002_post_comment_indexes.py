@@ -0,0 +1,26 @@
+# Generated by Django 3.2.3 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='status',
+            field=models.IntegerField(choices=[(0, 'Draft'), (1, 'Published')], default=0),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('approved', True)), fields=['post', 'created_on'], name='comment_post_approved_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('status', 1)), fields=['-created_on', '-id'], name='post_published_created_idx'),
+        ),
+    ]
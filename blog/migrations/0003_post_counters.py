@@ -0,0 +1,41 @@
+# Generated by Django 3.2.3 on 2026-10-18 14:01
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    Comment = apps.get_model('blog', 'Comment')
+    Like = Post.likes.through
+
+    def count(queryset):
+        counts = (queryset.filter(post_id=OuterRef('pk')).order_by()
+                  .values('post_id').annotate(n=Count('*')).values('n'))
+        return Coalesce(Subquery(counts), Value(0))
+
+    Post.objects.update(
+        like_count=count(Like.objects.all()),
+        approved_comment_count=count(Comment.objects.filter(approved=True)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0002_post_comment_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='approved_comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
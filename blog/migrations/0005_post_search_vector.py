@@ -0,0 +1,34 @@
+# Generated by Django 3.2.3 on 2026-10-18 14:09
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# The GIN index only exists on PostgreSQL (SQLite has no tsvector type or GIN
+# indexes), so it is created here instead of in Post.Meta.indexes.
+def create_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS post_search_vector_idx '
+            'ON blog_post USING gin (search_vector)')
+
+
+def drop_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS post_search_vector_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0004_post_content_html'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_gin_index, drop_gin_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.3 on 2026-10-18 14:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_task_queue'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['created_on', 'id'], name='comment_created_idx'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 3.2.3 on 2026-10-18 14:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+# A frozen copy of blog/images.py as it was when this migration was written,
+# so later changes there can't change (or break) what the migration does.
+PLACEHOLDER = 'placeholder'
+IMAGE_WIDTHS = (480, 800, 1200)
+DEFAULT_IMAGE_WIDTH = 800
+MASTHEAD_SIZES = '(min-width: 768px) 50vw, 100vw'
+THUMBNAIL_WIDTHS = (400, 800)
+DEFAULT_THUMBNAIL_WIDTH = 400
+THUMBNAIL_SIZES = '(min-width: 768px) 33vw, 100vw'
+BATCH_SIZE = 500
+
+
+def image_url(image, width):
+    # cloudinary_image_url, or local_image_url under CLOUDINARY_OFFLINE
+    if getattr(settings, 'CLOUDINARY_OFFLINE', False):
+        name = getattr(image, 'public_id', image)
+        if getattr(image, 'format', None):
+            name = f"{name}.{image.format}"
+        return f"{settings.MEDIA_URL}{name}"
+    return image.build_url(secure=True, width=width, crop='limit',
+                           fetch_format='auto', quality='auto')
+
+
+def featured_image_urls(image):
+    def srcset(widths):
+        return ', '.join(f"{image_url(image, width)} {width}w" for width in widths)
+
+    return {
+        'src': image_url(image, DEFAULT_IMAGE_WIDTH),
+        'srcset': srcset(IMAGE_WIDTHS),
+        'sizes': MASTHEAD_SIZES,
+        'thumbnail': image_url(image, DEFAULT_THUMBNAIL_WIDTH),
+        'thumbnail_srcset': srcset(THUMBNAIL_WIDTHS),
+        'thumbnail_sizes': THUMBNAIL_SIZES,
+    }
+
+
+def fill_featured_image_urls(apps, schema_editor):
+    # posts without an uploaded image keep the empty default
+    Post = apps.get_model('blog', 'Post')
+    queryset = (Post.objects.exclude(featured_image=PLACEHOLDER)
+                .exclude(featured_image='').order_by('pk')
+                .only('id', 'featured_image'))
+    # a batch of primary keys at a time, so only one batch is in memory
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        if not batch:
+            break
+        for post in batch:
+            post.featured_image_urls = featured_image_urls(post.featured_image)
+        Post.objects.bulk_update(batch, ['featured_image_urls'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0007_comment_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='featured_image_urls',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(fill_featured_image_urls, migrations.RunPython.noop),
+    ]
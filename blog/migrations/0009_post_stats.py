@@ -0,0 +1,34 @@
+# Generated by Django 3.2.3 on 2026-10-18 14:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_post_featured_image_urls'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='blog.post')),
+            ],
+            options={
+                'verbose_name_plural': 'post stats',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='poststats',
+            index=models.Index(fields=['day'], name='poststats_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='poststats',
+            constraint=models.UniqueConstraint(fields=('post', 'day'), name='poststats_post_day_uniq'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 3.2.3 on 2026-10-18 15:00
+
+import html
+
+import bleach
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+# A frozen copy of the sanitizer in blog/content.py as it was when this
+# migration was written, so later changes to the pipeline can't change what
+# the migration does. It leaves out the lazy-loading and responsive image
+# attributes; `python manage.py render_post_content --all` adds those.
+ALLOWED_TAGS = [
+    'a', 'abbr', 'b', 'blockquote', 'br', 'code', 'div', 'em', 'figcaption',
+    'figure', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'li', 'ol',
+    'p', 'pre', 's', 'span', 'strike', 'strong', 'sub', 'sup', 'table',
+    'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'u', 'ul',
+]
+ALLOWED_ATTRIBUTES = {
+    'a': ['href', 'title', 'target', 'rel'],
+    'abbr': ['title'],
+    'img': ['src', 'alt', 'title', 'width', 'height'],
+    'td': ['colspan', 'rowspan'],
+    'th': ['colspan', 'rowspan'],
+}
+EXCERPT_WORDS = 30
+BATCH_SIZE = 500
+
+
+def render_missing_content(apps, schema_editor):
+    # Posts saved before content_html existed (0004) have none, and the post
+    # page never falls back to the raw content; blank excerpts are written
+    # from the content, as saving a post does now.
+    Post = apps.get_model('blog', 'Post')
+    queryset = (Post.objects.filter(content_html='').order_by('pk')
+                .only('id', 'content', 'excerpt'))
+    # a batch of primary keys at a time, so only one batch is in memory
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        if not batch:
+            break
+        for post in batch:
+            post.content_html = bleach.clean(
+                post.content or '', tags=ALLOWED_TAGS,
+                attributes=ALLOWED_ATTRIBUTES, strip=True)
+            if not post.excerpt.strip():
+                text = html.unescape(bleach.clean(post.content or '', tags=[], strip=True))
+                post.excerpt = Truncator(' '.join(text.split())).words(EXCERPT_WORDS)
+                post.excerpt_generated = True
+        Post.objects.bulk_update(batch, ['content_html', 'excerpt', 'excerpt_generated'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_related_posts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='excerpt_generated',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(render_missing_content, migrations.RunPython.noop),
+    ]
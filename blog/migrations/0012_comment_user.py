@@ -0,0 +1,26 @@
+# Generated by Django 3.2.3 on 2026-10-18 15:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('blog', '0011_post_excerpt_generated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='author_notified',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='blog_comments', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
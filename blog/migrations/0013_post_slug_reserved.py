@@ -0,0 +1,19 @@
+# Generated by Django 3.2.3 on 2026-10-18 15:08
+
+import blog.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_comment_user'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='slug',
+            field=models.SlugField(max_length=200, unique=True, validators=[blog.models.validate_slug_not_reserved]),
+        ),
+    ]
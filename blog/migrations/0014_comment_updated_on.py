@@ -0,0 +1,18 @@
+# Generated by Django 3.2.3 on 2026-10-18 15:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0013_post_slug_reserved'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='updated_on',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
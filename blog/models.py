@@ -1,4 +1,6 @@
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
 
 # In Django, the User model is a pre-built model that represents a user account.
 # It contains fields such as username, email, password, and more, which are commonly
@@ -10,9 +12,25 @@ from django.contrib.auth.models import User
 # transformations, and optimizations without the need for additional server-side code.
 from cloudinary.models import CloudinaryField
 
+# SearchVectorField stores a PostgreSQL tsvector (a pre-processed full-text
+# index entry); see blog/search.py.
+from django.contrib.postgres.search import SearchVectorField
+
+from .images import is_placeholder
+
 # Create your models here.
 STATUS = ((0, "Draft"), (1, "Published"))
 
+# Top-level pages in blog/urls.py that come before <slug:slug>/ and so would
+# hide a post with the same slug.
+RESERVED_SLUGS = ('search',)
+
+
+def validate_slug_not_reserved(value):
+    if value in RESERVED_SLUGS:
+        raise ValidationError(
+            f'"{value}" is the address of another page; choose another slug.')
+
 
 class Post(models.Model):
     title = models.CharField(max_length=200, unique=True)
@@ -31,7 +49,8 @@ class Post(models.Model):
     # By using slugs, you make your URLs more descriptive and easy to remember,
     # and they can also improve the SEO of your website by including relevant
     # keywords in the URLs.
-    slug = models.SlugField(max_length=200, unique=True)
+    slug = models.SlugField(
+        max_length=200, unique=True, validators=[validate_slug_not_reserved])
     author = models.ForeignKey(
         #   User: The User model is imported from django.contrib.auth.models, and it
         #   represents a registered user in the application. It is part of Django's
@@ -50,21 +69,65 @@ class Post(models.Model):
    #  automatically, so you don't need to assign a value to it explicitly in your code.
     updated_on = models.DateTimeField(auto_now=True)
     content = models.TextField()
+    # content after sanitizing and image rewriting (see blog/content.py); this
+    # is what post_detail.html shows. Filled in automatically on save.
+    content_html = models.TextField(blank=True, editable=False)
     featured_image = CloudinaryField('image', default="placeholder")
+    # resized URLs of the featured image for the templates, worked out on
+    # save (see blog/images.py); empty for the placeholder
+    featured_image_urls = models.JSONField(default=dict, blank=True, editable=False)
    #  blank=True: This attribute is set to True, which means that the excerpt field is not
    #  required and can be left empty (blank) when creating or updating the model instance.
    #  If this attribute was set to False (which is the default if not specified), the field
    #  would be required and the model instance would not be saved without a value for excerpt.
     excerpt = models.TextField(blank=True)
+    # True while the excerpt is one blog/content.py wrote from the content
+    # because the author left it blank; it then follows the content as it's
+    # edited, until someone writes an excerpt of their own.
+    excerpt_generated = models.BooleanField(default=False, editable=False)
     created_on = models.DateTimeField(auto_now_add=True)
     status = models.IntegerField(choices=STATUS, default=0)
     likes = models.ManyToManyField(User, related_name='blog_likes', blank=True)
+    # Stored copies of likes.count() and the number of approved comments, so
+    # pages can show them without counting rows on every render. They are
+    # maintained by blog/counters.py; don't assign to them directly.
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    approved_comment_count = models.PositiveIntegerField(default=0, editable=False)
+    # Full-text search entry for title, excerpt and content, kept up to date on
+    # save (blog/search.py). Only filled in on PostgreSQL.
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         ordering = ['-created_on']
+        # The home page (and its cursor pagination) asks for published posts
+        # newest first: WHERE status = 1 ORDER BY created_on DESC, id DESC.
+        # A partial index over just the published rows, already in that order,
+        # lets the database read the page straight off the index instead of
+        # scanning the table and sorting it.
+        indexes = [
+            models.Index(
+                fields=['-created_on', '-id'],
+                condition=models.Q(status=1),
+                name='post_published_created_idx'),
+        ]
 
     def __str__(self):
         return self.title
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # the excerpt as loaded, so saving can tell whether it was edited
+        # since (see render_post in blog/content.py)
+        if 'excerpt' in instance.__dict__:
+            instance._loaded_excerpt = instance.excerpt
+        return instance
+
+    # True while the post still has the default "placeholder" image, which
+    # the templates swap for the default picture.
+    @property
+    def is_placeholder(self):
+        return is_placeholder(self.featured_image)
 # self.likes is the ManyToManyField that holds the related User instances who have liked
 # this post. It represents a set of User objects related to this particular post through
 # the likes relationship. self.likes.count() calculates the total number of likes associated
@@ -90,12 +153,108 @@ class Comment(models.Model):
     email = models.EmailField()
     body = models.TextField()
     created_on = models.DateTimeField(auto_now_add=True)
+    # bumped by edits, so the post page's ETag changes (blog/conditional.py)
+    updated_on = models.DateTimeField(auto_now=True)
     approved = models.BooleanField(default=False)
+    # The account that wrote the comment. name is only its username at the
+    # time, so moderation (blog/moderation.py) goes by the account instead.
+    # Empty for comments written before the field existed.
+    user = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name="blog_comments")
+    # the post's author has been emailed about it (blog/moderation.py)
+    author_notified = models.BooleanField(default=False, editable=False)
 
     class Meta:
         ordering = ['created_on']
+        # Serves post.comments.filter(approved=True).order_by('created_on')
+        # on the post detail page without a sort step. It is partial on
+        # approved (rather than having approved as a middle column) because
+        # Django writes the filter as a bare "WHERE approved", which some
+        # databases (SQLite) can't match against an "approved = 1" index key.
+        indexes = [
+            models.Index(
+                fields=['post', 'created_on'],
+                condition=models.Q(approved=True),
+                name='comment_post_approved_idx'),
+            # the admin's newest-first changelist and its date hierarchy
+            models.Index(fields=['created_on', 'id'], name='comment_created_idx'),
+        ]
 
     def __str__(self):
         return f"Comment{self.body} by {self.name}"
         post = get_object_or_404(Post, slug=slug)
 
+
+class Task(models.Model):
+    # A unit of background work waiting for `python manage.py run_tasks`
+    # (see blog/tasks.py). The queue lives in the database, so it needs no
+    # separate broker and a task is only queued if the request that queued it
+    # succeeded.
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    # when the task may run next: now for new tasks, later for retries, and
+    # the end of the lease while a worker is running it
+    run_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # gave up after too many attempts; kept for inspection in the admin
+    failed = models.BooleanField(default=False)
+    last_error = models.TextField(blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['run_after', 'id']
+        # the worker's "WHERE NOT failed AND run_after <= now ORDER BY run_after"
+        indexes = [
+            models.Index(
+                fields=['run_after', 'id'],
+                condition=models.Q(failed=False),
+                name='task_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk}"
+
+
+class PostStats(models.Model):
+    # How many times a post was viewed, one row per post per day. Views are
+    # counted in memory and written here in batches (see blog/stats.py), so
+    # readers never wait on, or lock, the hot Post rows.
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="stats")
+    day = models.DateField()
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "post stats"
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'day'], name='poststats_post_day_uniq'),
+        ]
+        # the popular posts ranking reads the last few days of every post
+        indexes = [
+            models.Index(fields=['day'], name='poststats_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.post_id} on {self.day}: {self.views} views"
+
+
+class RelatedPost(models.Model):
+    # One of a post's most similar posts, as shown under it on its page.
+    # Worked out in the background from the posts' words (see
+    # blog/related.py): rank 0 is the closest match.
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="related_entries")
+    related = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="+")
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+    # when the post's list was last rewritten; part of the page's ETag
+    computed_on = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['post', 'rank']
+        # the post page reads "WHERE post_id = %s ORDER BY rank" off this
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'rank'], name='relatedpost_post_rank_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.post_id} -> {self.related_id} ({self.score:.3f})"
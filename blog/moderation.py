@@ -0,0 +1,116 @@
+import re
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Comment
+from .counters import approve_comments
+from .tasks import enqueue_many, handler
+
+# Comment moderation, run in the background by the task worker (blog/tasks.py).
+
+# PostDetail.post saves a new comment unapproved, queues a "moderate_comments"
+# task and redirects straight away. The worker then, for a batch of new
+# comments at a time:
+
+#   1. scores each comment with some cheap spam heuristics;
+#   2. approves the comments that look fine and come from an account that
+#      has had comments approved before - everything else waits for a human
+#      in the admin, as before. This goes by the comment's user, not its
+#      name: the name is a copy of a username, and usernames can change
+#      hands;
+#   3. queues a "notify_post_authors" task, which emails each post's author
+#      about the new (non-spam) comments on their posts. Each comment is
+#      marked author_notified once its email has gone out, so when sending
+#      fails half way through a batch, the retry only sends the rest.
+
+# links in a comment; more than this looks like spam
+MAX_LINKS = 2
+# comments by the same account in FLOOD_WINDOW; more than this looks like spam
+FLOOD_LIMIT = 5
+FLOOD_WINDOW = timedelta(minutes=10)
+SPAM_WORDS = ('casino', 'viagra', 'crypto giveaway', 'free money', 'loan offer')
+# approved comments needed before someone's comments are approved automatically
+AUTO_APPROVE_AFTER = 1
+
+LINK = re.compile(r'https?://|www\.', re.IGNORECASE)
+
+
+def is_spam(comment, recent_count):
+    body = comment.body.lower()
+    letters = [c for c in comment.body if c.isalpha()]
+    return (len(LINK.findall(comment.body)) > MAX_LINKS
+            or any(word in body for word in SPAM_WORDS)
+            # SHOUTING
+            or (len(letters) >= 20 and all(c.isupper() for c in letters))
+            or recent_count > FLOOD_LIMIT)
+
+
+def _count_by_user(queryset, user_ids):
+    rows = (queryset.filter(user__in=user_ids).order_by()
+            .values('user').annotate(n=Count('id')))
+    return {row['user']: row['n'] for row in rows}
+
+
+@handler('moderate_comments')
+def moderate_comments(payloads):
+    comments = list(Comment.objects.filter(
+        pk__in=[payload['comment_id'] for payload in payloads], approved=False))
+    if not comments:
+        return
+    user_ids = {comment.user_id for comment in comments if comment.user_id}
+    # two GROUP BY queries for the whole batch, however many comments it has
+    approved_before = _count_by_user(Comment.objects.filter(approved=True), user_ids)
+    recent = _count_by_user(Comment.objects.filter(
+        created_on__gte=timezone.now() - FLOOD_WINDOW), user_ids)
+
+    to_approve, to_notify = [], []
+    for comment in comments:
+        if is_spam(comment, recent.get(comment.user_id, 0)):
+            continue
+        to_notify.append(comment.pk)
+        # comments without an account are never approved automatically
+        if (comment.user_id is not None
+                and approved_before.get(comment.user_id, 0) >= AUTO_APPROVE_AFTER):
+            to_approve.append(comment.pk)
+
+    if to_approve:
+        approve_comments(Comment.objects.filter(pk__in=to_approve))
+    if to_notify:
+        enqueue_many('notify_post_authors',
+                     [{'comment_id': pk} for pk in to_notify])
+
+
+@handler('notify_post_authors', atomic=False)
+def notify_post_authors(payloads):
+    comments = (Comment.objects
+                .filter(pk__in=[payload['comment_id'] for payload in payloads],
+                        author_notified=False)
+                .select_related('post__author')
+                .order_by('post__author', 'created_on'))
+    # one email per author, however many comments arrived on their posts
+    by_author = defaultdict(list)
+    for comment in comments:
+        if comment.post.author.email:
+            by_author[comment.post.author.email].append(comment)
+
+    # one connection for every email. Not atomic: each author's comments are
+    # marked (and committed) as soon as their email is sent, so a retry
+    # after a failure doesn't send it again.
+    with get_connection(fail_silently=False) as connection:
+        for email, comments in by_author.items():
+            lines = [
+                f'{comment.name} on "{comment.post.title}"'
+                f'{"" if comment.approved else " (awaiting approval)"}:\n'
+                f'{comment.body}\n'
+                for comment in comments]
+            subject = (f"New comment on {comments[0].post.title}" if len(comments) == 1
+                       else f"{len(comments)} new comments on your posts")
+            EmailMessage(subject, '\n'.join(lines), settings.DEFAULT_FROM_EMAIL,
+                         [email], connection=connection).send()
+            Comment.objects.filter(pk__in=[comment.pk for comment in comments]).update(
+                author_notified=True)
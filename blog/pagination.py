@@ -0,0 +1,176 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+# Keyset (a.k.a. cursor) pagination.
+
+# Django's Paginator runs a COUNT(*) over the whole queryset and then fetches
+# the page with LIMIT/OFFSET, so the database has to walk past every row
+# before the requested page. Here instead each page remembers the
+# (created_on, id) of its first and last post, and the next page simply asks
+# for the rows that come after that key: "WHERE (created_on, id) < (...)
+# ORDER BY created_on DESC, id DESC LIMIT n". No count is needed and page
+# 10,000 costs the same as page 1.
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(post, direction):
+    # direction is 'n' (posts after this one) or 'p' (posts before this one)
+    return encode_key(direction, post.created_on, post.pk)
+
+
+def encode_key(direction, created_on, pk):
+    # the same, for rows from .values() (see blog/api.py)
+    raw = f"{direction}|{created_on.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        direction, created_on, pk = raw.split('|')
+        if direction not in ('n', 'p'):
+            raise ValueError(direction)
+        return direction, datetime.fromisoformat(created_on), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+class CursorPage:
+    # Mimics the parts of django.core.paginator.Page that ListView and
+    # index.html use, with cursors in place of page numbers.
+
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return encode_cursor(self.object_list[-1], 'n')
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return encode_cursor(self.object_list[0], 'p')
+        return None
+
+
+class CursorPaginator:
+    # Pages a queryset newest-first on (created_on, id). The id breaks ties
+    # between posts created in the same instant, so no post is skipped or
+    # shown twice.
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    def page(self, cursor=None):
+        if not cursor:
+            rows = list(
+                self.queryset.order_by('-created_on', '-id')[:self.per_page + 1])
+            return CursorPage(rows[:self.per_page],
+                              has_next=len(rows) > self.per_page,
+                              has_previous=False)
+
+        direction, created_on, pk = decode_cursor(cursor)
+        if direction == 'n':
+            # older posts than the cursor, newest first
+            rows = list(
+                self.queryset.filter(
+                    Q(created_on__lt=created_on) |
+                    Q(created_on=created_on, id__lt=pk))
+                .order_by('-created_on', '-id')[:self.per_page + 1])
+            return CursorPage(rows[:self.per_page],
+                              has_next=len(rows) > self.per_page,
+                              has_previous=True)
+
+        # newer posts than the cursor: fetch them oldest first so LIMIT keeps
+        # the ones closest to the cursor, then flip them back into display order
+        rows = list(
+            self.queryset.filter(
+                Q(created_on__gt=created_on) |
+                Q(created_on=created_on, id__gt=pk))
+            .order_by('created_on', 'id')[:self.per_page + 1])
+        page_rows = rows[:self.per_page]
+        page_rows.reverse()
+        return CursorPage(page_rows,
+                          has_next=True,
+                          has_previous=len(rows) > self.per_page)
+
+
+def paginate_by_cursor(queryset, per_page, cursor):
+    # Same return value as MultipleObjectMixin.paginate_queryset, so a ListView
+    # can hand off to it directly.
+    paginator = CursorPaginator(queryset, per_page)
+    try:
+        page = paginator.page(cursor)
+    except InvalidCursor:
+        raise Http404("Invalid cursor")
+    return (paginator, page, page.object_list, page.has_other_pages())
+
+
+# Estimated counts for the admin changelists.
+
+# The admin's Paginator runs an exact COUNT(*) to number the pages, and on
+# PostgreSQL that means reading every row of the table. For an unfiltered
+# changelist of a big table, the planner's own estimate of the table's size
+# (pg_class.reltuples, kept up to date by autovacuum/ANALYZE) is good enough
+# to draw the page links, and costs nothing. Filtered lists, small tables and
+# other databases still get the exact count.
+
+# Tables smaller than this are cheap enough to count exactly.
+ESTIMATED_COUNT_THRESHOLD = 100000
+
+
+def estimated_row_count(model, using='default'):
+    # The planner's estimate of the model's table size, or None if there is
+    # none (not PostgreSQL, or the table hasn't been analyzed yet).
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+            [model._meta.db_table])
+        row = cursor.fetchone()
+    return row[0] if row and row[0] > 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return Paginator.count.func(self)
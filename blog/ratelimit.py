@@ -0,0 +1,175 @@
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, JsonResponse
+
+# Rate limits for the write paths: liking a post and posting a comment.
+
+# Each action is limited per logged-in user and per IP address
+# (settings.BLOG_RATE_LIMITS), with a sliding-window counter. A limit of
+# "30/60" allows 30 requests in any 60 seconds: a client may click 30 times
+# in a row, and after that about once every 2 seconds, as the earlier clicks
+# slide out of the window. A request over the limit gets a 429 Too Many
+# Requests with a Retry-After header.
+
+# The check runs before the view, so a rejected request costs no query: the
+# IP limit needs nothing but the request, and the user's id is read from the
+# session rather than by loading the user (with the "db" session backend
+# that is the one query a rejected request can cost; with "cached_db" or
+# "signed_cookies" it costs none).
+
+# The counters live in the cache, shared by every worker when it's Redis.
+# Time is cut into fixed windows of the limit's length, and each window has
+# a counter of the requests in it. The requests of the sliding window - the
+# last 60 seconds - are estimated from the current window's count plus the
+# part of the previous window's count that still falls inside it (previous
+# * the share of the current window still to come). Counting a request is a
+# single atomic incr(), so concurrent requests can't both squeeze in under
+# the limit, and a rejected request is taken off the count again, so a
+# client retrying in a loop still gets through at the allowed rate.
+
+# Every rejection is also counted, per action and scope, so the rejected
+# traffic can be watched: see rejected_counts() and
+# `python manage.py rate_limit_stats`.
+
+WINDOW_KEY = 'blog:ratelimit:{}:{}:{}:{}'
+REJECTED_KEY = 'blog:ratelimit:rejected:{}:{}'
+SCOPES = ('user', 'ip')
+
+
+def parse_rate(rate):
+    # "30/60" -> (30 requests, 60 seconds)
+    try:
+        requests, seconds = (int(part) for part in rate.split('/'))
+    except ValueError:
+        requests = seconds = 0
+    if requests < 1 or seconds < 1:
+        raise ImproperlyConfigured(
+            f"Invalid rate limit {rate!r}: expected \"requests/seconds\", e.g. \"30/60\".")
+    return requests, seconds
+
+
+def client_ip(request):
+    # REMOTE_ADDR, unless BLOG_RATE_LIMIT_PROXIES proxies (e.g. Heroku's
+    # router) sit in front of the app: each appends the address it got the
+    # request from to X-Forwarded-For, so the client's is that many entries
+    # from the end. Anything before it was sent by the client and can't be
+    # trusted.
+    proxies = settings.BLOG_RATE_LIMIT_PROXIES
+    if proxies:
+        forwarded = [ip.strip() for ip in
+                     request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')]
+        if len(forwarded) >= proxies and forwarded[-proxies]:
+            return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _incr(key, timeout):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # first request of the window; if another request created the key in
+        # the meantime add() fails and we count on top of theirs
+        if cache.add(key, 1, timeout=timeout):
+            return 1
+        return cache.incr(key)
+
+
+def count_request(action, scope, ident, rate, now=None):
+    # Returns (the key the request was counted under, 0) if it is within the
+    # limit, otherwise (None, the seconds until one more request will be).
+    limit, seconds = parse_rate(rate)
+    now = time.time() if now is None else now
+    window, into = divmod(now, seconds)
+    remaining = 1 - into / seconds
+    key = WINDOW_KEY.format(action, scope, ident, int(window))
+    previous = cache.get(WINDOW_KEY.format(action, scope, ident, int(window) - 1), 0)
+    # kept for the next window too, which reads it as its "previous"
+    current = _incr(key, timeout=2 * seconds)
+    if previous * remaining + current <= limit:
+        return key, 0
+
+    cache.decr(key)
+    current -= 1
+    if current >= limit:
+        # this window alone has reached the limit
+        wait = remaining * seconds
+    else:
+        # wait for enough of the previous window to slide out
+        wait = (remaining - (limit - current) / previous) * seconds
+    return None, max(1, math.ceil(wait))
+
+
+def count_rejection(action, scope):
+    key = REJECTED_KEY.format(action, scope)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def rejected_counts():
+    # {(action, scope): requests rejected} since the counters were reset
+    keys = {REJECTED_KEY.format(action, scope): (action, scope)
+            for action in settings.BLOG_RATE_LIMITS for scope in SCOPES}
+    counts = cache.get_many(keys)
+    return {keys[key]: counts.get(key, 0) for key in keys}
+
+
+def reset_rejected_counts():
+    cache.delete_many([REJECTED_KEY.format(action, scope)
+                       for action in settings.BLOG_RATE_LIMITS for scope in SCOPES])
+
+
+def check_rate_limit(request, action):
+    # Returns the seconds the client has to wait, or 0 if the request may go
+    # ahead.
+    if not settings.BLOG_RATE_LIMIT:
+        return 0
+    rates = settings.BLOG_RATE_LIMITS[action]
+
+    # the IP limit first: it needs nothing but the request
+    ip_key, wait = count_request(action, 'ip', client_ip(request), rates['ip'])
+    if wait:
+        count_rejection(action, 'ip')
+        return wait
+
+    user_id = request.session.get(SESSION_KEY) if hasattr(request, 'session') else None
+    if user_id is not None:
+        _, wait = count_request(action, 'user', user_id, rates['user'])
+        if wait:
+            # the request doesn't go ahead, so it doesn't count against the
+            # IP limit either
+            cache.decr(ip_key)
+            count_rejection(action, 'user')
+            return wait
+    return 0
+
+
+def too_many_requests(request, wait):
+    message = f"Too many requests. Please try again in {wait} seconds."
+    if request.accepts('application/json') and not request.accepts('text/html'):
+        response = JsonResponse({'error': message}, status=429)
+    else:
+        response = HttpResponse(message, status=429, content_type='text/plain')
+    response['Retry-After'] = str(wait)
+    return response
+
+
+def rate_limit(action):
+    # view decorator; use with method_decorator on class-based views
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            wait = check_rate_limit(request, action)
+            if wait:
+                return too_many_requests(request, wait)
+            return view(request, *args, **kwargs)
+        return wrapped
+    return decorator
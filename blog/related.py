@@ -0,0 +1,219 @@
+import html
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from .models import Post, RelatedPost
+from .cache import invalidate, post_scope
+from .tasks import handler
+
+# "Related posts" under each post on its page.
+
+# Comparing a post with every other post while the page is requested would
+# be far too slow, so the comparison is done ahead of time and its result -
+# the TOP_K most similar published posts of each post - is stored in the
+# RelatedPost table. The page then reads its list with one indexed query.
+
+# Similarity is the cosine of the posts' TF-IDF vectors: each post becomes
+# {term: weight}, where a term weighs more the more often the post uses it
+# (1 + log(count)) and the fewer posts use it at all (the idf). Title words
+# count TITLE_WEIGHT times. Terms found in a single post can't make two posts
+# similar and are dropped, as are terms used by more than MAX_DF of the posts,
+# and each post keeps only its MAX_TERMS heaviest terms. The vectors are
+# sparse, so rather than comparing every pair of posts the scores are summed
+# over an inverted index (term -> [(post, weight)]): a post is only ever
+# compared with the posts that share one of its terms.
+
+# Two ways to fill the table:
+
+#   * `python manage.py build_related_posts` rebuilds every list, for the
+#     first run and after bulk imports (bulk_create sends no signals);
+#   * saving a post queues an "index_related_posts" task (blog/signals.py)
+#     when it is published, unpublished or its words change. The worker
+#     rewrites that post's list and those of the posts it now belongs in, or
+#     no longer belongs in, rather than the whole table.
+
+# Both read the whole corpus, since adding a post shifts every term's idf.
+# Lists untouched by an update keep their slightly older scores until the
+# next rebuild, which is fine for "you might also like".
+
+TOP_K = 5
+# scores below this aren't worth showing
+MIN_SCORE = 0.05
+TITLE_WEIGHT = 3
+MAX_TERMS = 100
+MAX_DF = 0.5
+# MAX_DF only applies from this many posts on; in a tiny blog every word is
+# in half the posts
+MAX_DF_FROM = 20
+# rows fetched per round trip while reading the posts
+CHUNK_SIZE = 500
+# lists rewritten per transaction
+BATCH_SIZE = 500
+
+TOKEN = re.compile(r'[a-z0-9]+')
+STOPWORDS = frozenset("""
+    about above after again against all also and any are because been before
+    being below between both but can could did does doing down during each
+    few for from further had has have having her here hers herself him
+    himself his how into its itself just more most myself nor not now off
+    once only other our ours ourselves out over own same she should some
+    such than that the their theirs them themselves then there these they
+    this those through too under until very was were what when where which
+    while who whom why will with would you your yours yourself yourselves
+""".split())
+
+
+def tokens(text):
+    return [token for token in TOKEN.findall(text.lower())
+            if len(token) > 2 and token not in STOPWORDS]
+
+
+def term_counts(title, excerpt, content):
+    counts = Counter(tokens(excerpt))
+    counts.update(tokens(html.unescape(strip_tags(content))))
+    for token in tokens(title):
+        counts[token] += TITLE_WEIGHT
+    return counts
+
+
+class Corpus:
+    # The TF-IDF vectors of the published posts and their inverted index.
+
+    def __init__(self, rows):
+        # rows: (id, slug, title, excerpt, content)
+        self.slugs = {}
+        counts = {}
+        document_frequency = Counter()
+        for pk, slug, title, excerpt, content in rows:
+            self.slugs[pk] = slug
+            counts[pk] = term_counts(title, excerpt, content)
+            document_frequency.update(counts[pk].keys())
+
+        total = len(counts)
+        max_df = total * MAX_DF if total >= MAX_DF_FROM else total
+        idf = {term: math.log((1 + total) / (1 + df)) + 1
+               for term, df in document_frequency.items() if 1 < df <= max_df}
+
+        self.vectors = {}
+        self.index = defaultdict(list)
+        for pk, post_counts in counts.items():
+            weights = {term: (1 + math.log(count)) * idf[term]
+                       for term, count in post_counts.items() if term in idf}
+            if len(weights) > MAX_TERMS:
+                weights = dict(heapq.nlargest(MAX_TERMS, weights.items(),
+                                              key=lambda item: item[1]))
+            norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+            vector = {term: weight / norm for term, weight in weights.items()}
+            self.vectors[pk] = vector
+            for term, weight in vector.items():
+                self.index[term].append((pk, weight))
+
+    def __contains__(self, pk):
+        return pk in self.vectors
+
+    def similarities(self, pk):
+        # {other post: cosine similarity} for the posts sharing a term with pk
+        scores = defaultdict(float)
+        for term, weight in self.vectors.get(pk, {}).items():
+            for other, other_weight in self.index[term]:
+                scores[other] += weight * other_weight
+        scores.pop(pk, None)
+        return scores
+
+    def most_similar(self, pk):
+        # [(other post, score)], best first; ties go to the older post
+        scores = self.similarities(pk)
+        best = heapq.nsmallest(
+            TOP_K, ((-score, other) for other, score in scores.items()
+                    if score >= MIN_SCORE))
+        return [(other, -score) for score, other in best]
+
+
+def load_corpus():
+    rows = (Post.objects.filter(status=1).order_by('pk')
+            .values_list('id', 'slug', 'title', 'excerpt', 'content')
+            .iterator(chunk_size=CHUNK_SIZE))
+    return Corpus(rows)
+
+
+def write_related(corpus, post_ids):
+    # Replaces the lists of post_ids with their current best matches, in one
+    # transaction. Returns the number of rows written.
+    now = timezone.now()
+    rows = [RelatedPost(post_id=pk, related_id=other, score=score, rank=rank,
+                        computed_on=now)
+            for pk in post_ids
+            for rank, (other, score) in enumerate(corpus.most_similar(pk))]
+    with transaction.atomic():
+        RelatedPost.objects.filter(post_id__in=post_ids).delete()
+        RelatedPost.objects.bulk_create(rows)
+    # the pages show the lists
+    invalidate(*(post_scope(corpus.slugs[pk]) for pk in post_ids))
+    return len(rows)
+
+
+def build_related_posts(batch_size=BATCH_SIZE):
+    # Rebuilds every list. Returns (posts, rows written).
+    corpus = load_corpus()
+    RelatedPost.objects.exclude(post__status=1).delete()
+    post_ids = sorted(corpus.vectors)
+    written = 0
+    for start in range(0, len(post_ids), batch_size):
+        written += write_related(corpus, post_ids[start:start + batch_size])
+    return len(post_ids), written
+
+
+def update_related_posts(post_ids):
+    # Brings the table up to date after the posts in post_ids were saved,
+    # (un)published or deleted. Returns the number of lists rewritten.
+    corpus = load_corpus()
+    changed = set(post_ids)
+    present = {pk for pk in changed if pk in corpus}
+
+    # the changed posts' own lists, and every list showing one of them, whose
+    # score has moved or which must now leave it out
+    targets = present | set(RelatedPost.objects.filter(
+        related_id__in=changed).values_list('post_id', flat=True))
+
+    # and the lists a changed post now beats the last entry of. One GROUP BY
+    # over the table gives every list's length and lowest score.
+    if present:
+        lists = {row['post_id']: (row['entries'], row['lowest'])
+                 for row in RelatedPost.objects.order_by().values('post_id')
+                 .annotate(entries=Count('id'), lowest=Min('score'))}
+        for pk in present:
+            for other, score in corpus.similarities(pk).items():
+                entries, lowest = lists.get(other, (0, 0))
+                if score >= MIN_SCORE and (entries < TOP_K or score > lowest):
+                    targets.add(other)
+
+    # unpublished and deleted posts have no list
+    RelatedPost.objects.filter(post_id__in=changed - present).delete()
+    targets = sorted(pk for pk in targets if pk in corpus)
+    for start in range(0, len(targets), BATCH_SIZE):
+        write_related(corpus, targets[start:start + BATCH_SIZE])
+    return len(targets)
+
+
+@handler('index_related_posts')
+def index_related_posts(payloads):
+    # one corpus load for the whole batch of saved posts
+    update_related_posts({payload['post_id'] for payload in payloads})
+
+
+def related_posts(**lookups):
+    # The published related posts of the post matching lookups (post_id=...
+    # or post__slug=...), best first: one query off the (post, rank) index,
+    # with the posts joined in.
+    entries = (RelatedPost.objects.filter(related__status=1, **lookups)
+               .select_related('related')
+               .only('related__slug', 'related__title')
+               .order_by('rank'))
+    return [entry.related for entry in entries]
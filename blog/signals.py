@@ -0,0 +1,168 @@
+from django.core.signals import request_finished
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete, pre_save)
+from django.dispatch import receiver
+
+from .models import Post, Comment, RelatedPost
+from .counters import adjust_approved_comment_count, adjust_like_count, recount
+from .cache import invalidate, invalidate_post, post_scope
+from .content import render_post
+from .images import render_featured_image
+from .search import update_search_vectors
+from .stats import flush_views_if_due
+from .tasks import enqueue, enqueue_many
+
+# Signal handlers are connected in BlogConfig.ready() (blog/apps.py).
+
+# Note that queryset.update() and the raw like toggle in blog/likes.py don't
+# send these signals; those code paths invalidate the page cache themselves.
+
+
+@receiver(post_save, sender=Comment)
+def count_new_approved_comment(sender, instance, created, **kwargs):
+    # comments normally arrive unapproved, but one created already approved
+    # (e.g. from the admin) still has to be counted
+    if created and instance.approved:
+        adjust_approved_comment_count(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_deleted_comment(sender, instance, **kwargs):
+    # queryset.delete() (including the admin's "delete selected" action)
+    # still sends post_delete once per comment
+    if instance.approved:
+        adjust_approved_comment_count(instance.post_id, -1)
+
+
+@receiver(m2m_changed, sender=Post.likes.through)
+def count_likes(sender, instance, action, reverse, pk_set, **kwargs):
+    # Likes changed through the relation: post.likes.add(), the admin's likes
+    # field, user.blog_likes.clear()... (the like button keeps like_count
+    # right itself, in blog/likes.py).
+    if action == 'pre_clear' and reverse:
+        # the posts a user unlikes are gone from the relation afterwards
+        instance._cleared_likes = list(
+            instance.blog_likes.values_list('pk', 'slug'))
+    elif action == 'post_add' and pk_set:
+        # pk_set holds only the likes that were actually added
+        if reverse:
+            adjust_like_count(pk_set, 1)
+        else:
+            adjust_like_count([instance.pk], len(pk_set))
+    elif action in ('post_remove', 'post_clear'):
+        # remove() reports every pk it was given, liked or not, and clear()
+        # none, so count these posts' likes again
+        if not reverse:
+            post_ids = [instance.pk]
+        elif action == 'post_remove':
+            post_ids = pk_set
+        else:
+            post_ids = [pk for pk, slug in getattr(instance, '_cleared_likes', [])]
+        recount(Post.objects.filter(pk__in=post_ids))
+
+
+@receiver(pre_save, sender=Post)
+def render_post_content(sender, instance, **kwargs):
+    # sanitize the content and pre-render content_html (blog/content.py)
+    render_post(instance)
+
+
+@receiver(pre_save, sender=Post)
+def precompute_featured_image_urls(sender, instance, **kwargs):
+    # the resized featured image URLs the templates use (blog/images.py)
+    render_featured_image(instance)
+
+
+@receiver(post_save, sender=Post)
+def index_post_for_search(sender, instance, **kwargs):
+    # an UPDATE after the save, since the vector is computed by the database
+    # from the saved columns (blog/search.py)
+    update_search_vectors(Post.objects.filter(pk=instance.pk))
+
+
+# the fields the related posts are worked out from
+INDEXED_FIELDS = ('status', 'title', 'excerpt', 'content')
+
+
+@receiver(pre_save, sender=Post)
+def remember_old_values(sender, instance, **kwargs):
+    # What the post looked like before this save, in one query:
+    # - if the slug is edited, the page cached under the old slug must go too
+    # - the related posts are only re-indexed when the words or the status
+    #   change (see queue_related_posts_update)
+    instance._old_slug = instance._old_indexed = None
+    if instance.pk:
+        old = Post.objects.filter(pk=instance.pk).values_list(
+            'slug', *INDEXED_FIELDS).first()
+        if old:
+            instance._old_slug, instance._old_indexed = old[0], old[1:]
+
+
+# Related posts (blog/related.py)
+
+@receiver(post_save, sender=Post)
+def queue_related_posts_update(sender, instance, **kwargs):
+    old = getattr(instance, '_old_indexed', None)
+    if old is None:
+        # a new post only matters once it's published
+        changed = instance.status == 1
+    else:
+        new = tuple(getattr(instance, field) for field in INDEXED_FIELDS)
+        # editing a draft changes no list
+        changed = new != old and 1 in (instance.status, old[0])
+    if changed:
+        enqueue('index_related_posts', post_id=instance.pk)
+
+
+@receiver(pre_delete, sender=Post)
+def queue_related_posts_refresh(sender, instance, **kwargs):
+    # the deletion takes this post out of other posts' lists, which then
+    # have a place to fill
+    post_ids = RelatedPost.objects.filter(
+        related=instance).values_list('post_id', flat=True)
+    enqueue_many('index_related_posts',
+                 [{'post_id': post_id} for post_id in post_ids])
+
+
+# Page cache invalidation (see blog/cache.py)
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_pages(sender, instance, **kwargs):
+    invalidate_post(instance.slug)
+    old_slug = getattr(instance, '_old_slug', None)
+    if old_slug and old_slug != instance.slug:
+        invalidate(post_scope(old_slug))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_post_page(sender, instance, created=False, **kwargs):
+    # a new comment awaiting approval doesn't show up on the page yet
+    if created and not instance.approved:
+        return
+    invalidate(post_scope(instance.post.slug))
+
+
+@receiver(m2m_changed, sender=Post.likes.through)
+def invalidate_liked_post_pages(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_post(instance.slug)
+        return
+
+    # user.blog_likes.add(...) etc.: the posts are in pk_set, except for
+    # clear(), where count_likes looked them up before they were unliked
+    if action in ('post_add', 'post_remove'):
+        slugs = Post.objects.filter(pk__in=pk_set).values_list('slug', flat=True)
+        invalidate('list', *(post_scope(slug) for slug in slugs))
+    elif action == 'post_clear':
+        slugs = [slug for pk, slug in getattr(instance, '_cleared_likes', [])]
+        invalidate('list', *(post_scope(slug) for slug in slugs))
+
+
+@receiver(request_finished)
+def flush_post_views(sender, **kwargs):
+    # after the response has gone out: write the buffered view counts, when
+    # a batch is due (blog/stats.py)
+    flush_views_if_due()
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import Post, PostStats
+from .cache import invalidate
+
+logger = logging.getLogger(__name__)
+
+# Post view counts and the "popular this week" list on the home page.
+
+# Counting a view with an UPDATE of the post's row would make every reader of
+# a popular post queue for the same row lock. Instead record_view() only bumps
+# a counter in this process's memory. Every BLOG_VIEW_FLUSH_INTERVAL seconds
+# (or after BLOG_VIEW_FLUSH_SIZE views) the counts are written to PostStats in
+# one short transaction - one row per post per day - after the response that
+# made the batch due has been sent (see blog/signals.py). Views counted by a
+# worker that dies before its next flush are lost; that's fine for a
+# popularity ranking.
+
+# The same flush keeps the popular list fresh: at most every
+# BLOG_POPULAR_REFRESH seconds it ranks the posts viewed in the last
+# POPULAR_DAYS days and stores the top POPULAR_COUNT in the cache, ready for
+# index.html. Showing it costs one cache read, never a query.
+
+POPULAR_KEY = 'blog:popular'
+POPULAR_DAYS = 7
+POPULAR_COUNT = 5
+# a like counts for this many views
+LIKE_WEIGHT = 10
+# how quickly older posts sink, as in Hacker News' ranking
+GRAVITY = 1.5
+
+_lock = threading.Lock()
+_pending = Counter()
+_last_flush = time.monotonic()
+
+
+def record_view(slug):
+    if settings.BLOG_VIEW_COUNTER:
+        with _lock:
+            _pending[slug] += 1
+
+
+def flush_views_if_due():
+    # Never from inside a transaction: if it were rolled back, so would be
+    # the views.
+    if not _pending or connection.in_atomic_block:
+        return
+    if (sum(_pending.values()) < settings.BLOG_VIEW_FLUSH_SIZE
+            and time.monotonic() - _last_flush < settings.BLOG_VIEW_FLUSH_INTERVAL):
+        return
+    flush_views()
+
+
+def flush_views():
+    # Writes the views counted so far to PostStats and refreshes the popular
+    # list if it's due. Returns the number of views written.
+    global _last_flush
+    with _lock:
+        pending = _pending.copy()
+        _pending.clear()
+        _last_flush = time.monotonic()
+    if pending:
+        try:
+            _write_views(pending)
+        except DatabaseError:
+            # keep them for the next flush
+            logger.exception("Couldn't save %d post views", sum(pending.values()))
+            with _lock:
+                _pending.update(pending)
+            return 0
+    refresh_popular_posts(max_age=settings.BLOG_POPULAR_REFRESH)
+    return sum(pending.values())
+
+
+def _write_views(pending):
+    today = timezone.localdate()
+    # views of slugs that don't exist (404s) are dropped here
+    ids = dict(Post.objects.filter(slug__in=list(pending))
+               .values_list('slug', 'id'))
+    # one UPDATE per distinct count rather than per post: most posts were
+    # viewed only a few times in a batch
+    by_count = defaultdict(list)
+    for slug, views in pending.items():
+        if slug in ids:
+            by_count[views].append(ids[slug])
+    if not by_count:
+        return
+    with transaction.atomic():
+        PostStats.objects.bulk_create(
+            [PostStats(post_id=pk, day=today)
+             for pks in by_count.values() for pk in pks],
+            ignore_conflicts=True)
+        for views, pks in by_count.items():
+            PostStats.objects.filter(post_id__in=sorted(pks), day=today).update(
+                views=F('views') + views)
+
+
+def popularity(views, likes, age):
+    hours = age.total_seconds() / 3600
+    return (views + LIKE_WEIGHT * likes) / (hours + 2) ** GRAVITY
+
+
+def refresh_popular_posts(max_age=0):
+    # Recomputes the popular list unless the stored one is younger than
+    # max_age seconds. Returns the cache entry.
+    entry = cache.get(POPULAR_KEY)
+    if entry and time.time() - entry['computed'] < max_age:
+        return entry
+    now = timezone.now()
+    since = timezone.localdate() - timedelta(days=POPULAR_DAYS - 1)
+    rows = (PostStats.objects.filter(day__gte=since, post__status=1)
+            .order_by()
+            .values('post__slug', 'post__title', 'post__created_on', 'post__like_count')
+            .annotate(views=Sum('views')))
+    ranked = sorted(
+        rows, reverse=True,
+        key=lambda row: popularity(row['views'], row['post__like_count'],
+                                   now - row['post__created_on']))
+    posts = [{'slug': row['post__slug'], 'title': row['post__title']}
+             for row in ranked[:POPULAR_COUNT]]
+
+    version = hashlib.md5(json.dumps(posts).encode()).hexdigest()
+    changed = entry is None or entry['version'] != version
+    entry = {
+        'posts': posts,
+        'version': version,
+        'computed': time.time(),
+        # for the home page's Last-Modified
+        'changed_on': now if changed else entry['changed_on'],
+    }
+    cache.set(POPULAR_KEY, entry, timeout=None)
+    if changed:
+        # the home page shows the list
+        invalidate('list')
+    return entry
+
+
+def popular_posts():
+    # [{'slug': ..., 'title': ...}, ...], most popular first; empty until the
+    # first flush has ranked them
+    entry = cache.get(POPULAR_KEY)
+    return entry['posts'] if entry else []
+
+
+def popular_version():
+    # (version, changed_on) of the popular list, for the home page's ETag
+    entry = cache.get(POPULAR_KEY)
+    return (entry['version'], entry['changed_on']) if entry else (None, None)
@@ -0,0 +1,112 @@
+import contextlib
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Task
+
+# A small background work queue kept in the database (the Task model).
+
+# Requests call enqueue() to leave work for later - that costs them one
+# INSERT - and `python manage.py run_tasks` does it in the background. Task
+# handlers are registered with @handler and are always given a *list* of
+# payloads: the worker claims up to BATCH_SIZE due tasks at a time and hands
+# all tasks of one name to their handler together, so a flood of comments
+# becomes a few batched queries instead of a few queries per comment.
+
+# A handler that raises has its whole batch retried later, with an
+# exponentially growing delay, until MAX_ATTEMPTS is reached and the tasks are
+# marked failed. Handlers should therefore be safe to run twice on the same
+# payload.
+
+# Each batch runs in a transaction, so a handler that fails leaves nothing
+# half done in the database. Handlers with side effects outside it (sending
+# email) register with atomic=False instead, and record what they have done
+# as they go, so that a retry can skip it.
+
+# A claimed task's run_after is pushed LEASE into the future while it runs.
+# If the worker dies mid-batch the tasks simply become due again once the
+# lease runs out, and another worker picks them up.
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+RETRY_DELAY = timedelta(seconds=30)
+LEASE = timedelta(minutes=5)
+
+HANDLERS = {}
+
+
+def handler(name, atomic=True):
+    def register(func):
+        func.atomic = atomic
+        HANDLERS[name] = func
+        return func
+    return register
+
+
+def enqueue(name, **payload):
+    if name not in HANDLERS:
+        raise ValueError(f"No task handler named {name!r}")
+    return Task.objects.create(name=name, payload=payload)
+
+
+def enqueue_many(name, payloads):
+    if name not in HANDLERS:
+        raise ValueError(f"No task handler named {name!r}")
+    return Task.objects.bulk_create(
+        [Task(name=name, payload=payload) for payload in payloads])
+
+
+def claim_tasks(batch_size=BATCH_SIZE):
+    # Takes up to batch_size due tasks off the queue for this worker.
+    now = timezone.now()
+    with transaction.atomic():
+        due = Task.objects.filter(failed=False, run_after__lte=now)
+        if connection.features.has_select_for_update_skip_locked:
+            # several workers can claim at once without waiting for each other
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list('id', flat=True)[:batch_size])
+        Task.objects.filter(id__in=ids).update(
+            run_after=now + LEASE, attempts=F('attempts') + 1)
+    return list(Task.objects.filter(id__in=ids))
+
+
+def _retry(tasks, error):
+    now = timezone.now()
+    for task in tasks:
+        task.failed = task.attempts >= MAX_ATTEMPTS
+        task.run_after = now + RETRY_DELAY * 2 ** (task.attempts - 1)
+        task.last_error = error
+    Task.objects.bulk_update(tasks, ['failed', 'run_after', 'last_error'])
+
+
+def run_due_tasks(batch_size=BATCH_SIZE):
+    # Runs one batch of due tasks. Returns how many tasks were claimed.
+    tasks = claim_tasks(batch_size)
+    by_name = defaultdict(list)
+    for task in tasks:
+        by_name[task.name].append(task)
+
+    for name, group in by_name.items():
+        try:
+            # A name without a handler (a task from a newer deploy that this
+            # worker doesn't know yet, or a removed one) fails like any other
+            # batch: retried, in case a newer worker takes it, then marked
+            # failed. It must not stop the worker.
+            func = HANDLERS.get(name)
+            if func is None:
+                raise LookupError(f"No task handler named {name!r}")
+            with transaction.atomic() if func.atomic else contextlib.nullcontext():
+                func([task.payload for task in group])
+        except Exception as error:
+            logger.exception("Task %s failed for %d tasks", name, len(group))
+            _retry(group, f"{type(error).__name__}: {error}")
+        else:
+            Task.objects.filter(id__in=[task.id for task in group]).delete()
+    return len(tasks)
@@ -1,3 +1,1922 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import contextvars
+import gzip
+import hashlib
+import importlib
+import json
+import os
+import shutil
+import smtplib
+import tempfile
+import threading
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync, sync_to_async
+from io import StringIO
+from unittest import mock
+from xml.etree import ElementTree
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.contrib.staticfiles.management.commands.collectstatic import (
+    Command as CollectStatic)
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import Sum
+from django.http import Http404, HttpResponse
+from django.contrib.auth.models import AnonymousUser
+from django.test import (
+    AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase,
+    TransactionTestCase, modify_settings, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.templatetags.static import static
+from django.urls import ResolverMatch, reverse
+from django.utils import timezone
+from django.contrib.auth.models import User
+from django.contrib.admin.sites import site
+
+from .admin import is_changelist
+from .models import Post, Comment, PostStats, RelatedPost, Task
+from .tasks import HANDLERS, MAX_ATTEMPTS, enqueue, handler, run_due_tasks
+from .counters import approve_comments, recount
+from .likes import _insert_like
+from .cache import (
+    LOCK_KEY, LOCK_POLL_INTERVAL, LOCK_WAIT, PAGE_KEY, invalidate_post,
+    is_cacheable_response)
+from .pagination import EstimatedCountPaginator
+from .benchmarks import QUERY_BUDGETS, scenarios
+from . import async_views, ratelimit, related, stats
+import psycopg2
+import psycopg2.extensions
+from cloudinary import CloudinaryResource
+from codestar.middleware import (
+    DatabaseHealthCheckMiddleware, ReplicaPinningMiddleware,
+    RequestTimingMiddleware, StaticFilesMiddleware)
+from codestar import staticfiles
+from codestar.postgresql_pool.base import (
+    ConnectionPool, DatabaseWrapper as PooledDatabaseWrapper)
+from codestar.routers import PrimaryReplicaRouter, end_request, start_request
 
 # Create your tests here.
+
+
+class PostListQueryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='password')
+        cls.readers = [
+            User.objects.create_user(f'reader{i}', password='password')
+            for i in range(3)
+        ]
+
+    def create_posts(self, count):
+        start = Post.objects.count()
+        for i in range(start, start + count):
+            post = Post.objects.create(
+                title=f'Post {i}', slug=f'post-{i}', author=self.author,
+                content='Lorem ipsum ' * 50, status=1)
+            post.likes.set(self.readers[:i % 4])
+        # likes.set() bypasses the like counter, so rebuild it
+        recount()
+
+    def test_home_page_query_count_is_constant(self):
+        # One COUNT for the paginator and one query for the page of posts,
+        # however many posts (and likes) there are.
+        self.create_posts(1)
+        with self.assertNumQueries(2):
+            self.client.get(reverse('home'))
+
+        self.create_posts(6)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('home'))
+        self.assertEqual(len(response.context['post_list']), 6)
+
+    def test_home_page_shows_like_counts(self):
+        self.create_posts(4)
+        response = self.client.get(reverse('home'))
+        likes = {post.slug: post.like_count
+                 for post in response.context['post_list']}
+        self.assertEqual(likes['post-3'], 3)
+        self.assertEqual(likes['post-0'], 0)
+
+
+@override_settings(BLOG_CURSOR_PAGINATION=True)
+class CursorPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author', password='password')
+        for i in range(14):
+            Post.objects.create(
+                title=f'Post {i}', slug=f'post-{i}', author=author,
+                content='content', status=1)
+        # a draft must never show up in the feed
+        Post.objects.create(
+            title='Draft', slug='draft', author=author, content='content')
+
+    def walk_forward(self):
+        slugs, cursor = [], None
+        while True:
+            url = reverse('home')
+            if cursor:
+                url += f'?cursor={cursor}'
+            page = self.client.get(url).context['page_obj']
+            slugs.append([post.slug for post in page.object_list])
+            cursor = page.next_cursor
+            if not cursor:
+                return slugs
+
+    def test_walks_every_published_post_once(self):
+        pages = self.walk_forward()
+        self.assertEqual([len(page) for page in pages], [6, 6, 2])
+        slugs = [slug for page in pages for slug in page]
+        expected = list(Post.objects.filter(status=1)
+                        .order_by('-created_on', '-id')
+                        .values_list('slug', flat=True))
+        self.assertEqual(slugs, expected)
+
+    def test_previous_links_return_to_the_same_pages(self):
+        first = self.client.get(reverse('home')).context['page_obj']
+        second = self.client.get(
+            reverse('home') + f'?cursor={first.next_cursor}').context['page_obj']
+        back = self.client.get(
+            reverse('home') + f'?cursor={second.previous_cursor}').context['page_obj']
+        self.assertEqual(list(back.object_list), list(first.object_list))
+        self.assertFalse(back.has_previous())
+        self.assertTrue(back.has_next())
+
+    def test_deep_page_skips_the_count_query(self):
+        first = self.client.get(reverse('home')).context['page_obj']
+        # the ETag query and the page itself, no COUNT
+        with self.assertNumQueries(2):
+            self.client.get(reverse('home') + f'?cursor={first.next_cursor}')
+
+    def test_invalid_cursor_is_a_404(self):
+        response = self.client.get(reverse('home') + '?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+
+class PostCounterTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='password')
+        self.post = Post.objects.create(
+            title='Post', slug='post', author=self.user,
+            content='content', status=1)
+
+    def add_comments(self, approved, count):
+        for i in range(count):
+            Comment.objects.create(
+                post=self.post, name='reader', email='reader@example.com',
+                body=f'comment {i}', approved=approved)
+
+    def test_like_toggle_updates_like_count(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('post_like', args=['post']))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+
+        self.client.post(reverse('post_like', args=['post']))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+
+    def test_approving_and_deleting_comments(self):
+        self.add_comments(approved=False, count=3)
+        self.add_comments(approved=True, count=1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.approved_comment_count, 1)
+
+        # approving the whole lot only counts the three pending ones
+        site._registry[Comment].approve_comments(None, Comment.objects.all())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.approved_comment_count, 4)
+
+        Comment.objects.filter(
+            pk__in=Comment.objects.values_list('pk', flat=True)[:2]).delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.approved_comment_count, 2)
+
+    def test_likes_changed_through_the_relation_are_counted(self):
+        readers = [User.objects.create_user(f'fan{i}') for i in range(3)]
+        other = Post.objects.create(
+            title='Other', slug='other', author=self.user, content='content')
+
+        def like_counts():
+            return list(Post.objects.order_by('pk').values_list('like_count', flat=True))
+
+        self.post.likes.add(*readers)
+        self.post.likes.add(readers[0])
+        self.assertEqual(like_counts(), [3, 0])
+        # the admin's likes field sets the relation as a whole
+        self.post.likes.set(readers[:1])
+        self.assertEqual(like_counts(), [1, 0])
+        readers[1].blog_likes.add(self.post, other)
+        self.assertEqual(like_counts(), [2, 1])
+        readers[2].blog_likes.remove(self.post, other)
+        self.assertEqual(like_counts(), [2, 1])
+        readers[1].blog_likes.clear()
+        self.assertEqual(like_counts(), [1, 0])
+        self.post.likes.clear()
+        self.assertEqual(like_counts(), [0, 0])
+
+    def test_recount_repairs_drift(self):
+        self.add_comments(approved=True, count=2)
+        self.post.likes.add(self.user)
+        Post.objects.update(like_count=7, approved_comment_count=0)
+
+        self.assertEqual(recount(batch_size=1), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+        self.assertEqual(self.post.approved_comment_count, 2)
+
+
+class PostLikeTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='password')
+        self.post = Post.objects.create(
+            title='Post', slug='post', author=self.user,
+            content='content', status=1)
+        self.client.force_login(self.user)
+        self.url = reverse('post_like', args=['post'])
+
+    def test_json_mode_returns_state_and_count(self):
+        response = self.client.post(self.url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json(), {'liked': True, 'like_count': 1})
+        response = self.client.post(self.url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json(), {'liked': False, 'like_count': 0})
+        self.assertFalse(self.post.likes.exists())
+
+    def test_browser_post_still_redirects(self):
+        response = self.client.post(self.url)
+        self.assertRedirects(response, reverse('post_detail', args=['post']))
+        self.assertTrue(self.post.likes.filter(pk=self.user.pk).exists())
+
+    def test_like_and_unlike_write_without_reading_first(self):
+        # session and user lookups for the logged-in user, then the delete,
+        # the insert and the counter update (inside a savepoint)
+        with self.assertNumQueries(7):
+            self.client.post(self.url)
+        # unliking stops after the delete and the counter update
+        with self.assertNumQueries(6):
+            self.client.post(self.url)
+
+    def test_like_already_present_is_not_counted_twice(self):
+        # simulate a concurrent request that inserted the like behind our back
+        Post.likes.through.objects.create(post=self.post, user=self.user)
+        self.assertEqual(_insert_like('post', self.user.pk), 0)
+
+    def test_unknown_post_is_a_404(self):
+        response = self.client.post(reverse('post_like', args=['nope']))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(BLOG_PAGE_CACHE=True)
+class PageCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('reader', password='password')
+        self.post = Post.objects.create(
+            title='Post', slug='post', author=self.user,
+            content='content', status=1)
+        self.detail_url = reverse('post_detail', args=['post'])
+
+    def test_anonymous_pages_are_cached(self):
+        for url in (reverse('home'), self.detail_url):
+            self.assertEqual(self.client.get(url)['X-Page-Cache'], 'MISS')
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertEqual(response['X-Page-Cache'], 'HIT')
+            self.assertContains(response, 'Post')
+
+    def test_logged_in_users_bypass_the_cache(self):
+        self.client.get(self.detail_url)
+        self.client.force_login(self.user)
+        response = self.client.get(self.detail_url)
+        self.assertFalse(response.has_header('X-Page-Cache'))
+        self.assertContains(response, 'Leave a comment')
+
+    def test_saving_a_post_refreshes_its_pages(self):
+        self.client.get(reverse('home'))
+        self.client.get(self.detail_url)
+        self.post.title = 'Renamed post'
+        self.post.save()
+        for url in (reverse('home'), self.detail_url):
+            response = self.client.get(url)
+            self.assertEqual(response['X-Page-Cache'], 'MISS')
+            self.assertContains(response, 'Renamed post')
+
+    def test_comments_and_likes_refresh_the_post_page(self):
+        self.client.get(self.detail_url)
+        # a comment awaiting approval isn't shown, so the page stays cached
+        comment = Comment.objects.create(
+            post=self.post, name='reader', email='reader@example.com',
+            body='First!')
+        self.assertEqual(self.client.get(self.detail_url)['X-Page-Cache'], 'HIT')
+
+        site._registry[Comment].approve_comments(None, Comment.objects.all())
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        self.assertContains(response, 'First!')
+
+        comment.delete()
+        self.assertEqual(self.client.get(self.detail_url)['X-Page-Cache'], 'MISS')
+
+        self.post.likes.add(self.user)
+        self.assertEqual(self.client.get(self.detail_url)['X-Page-Cache'], 'MISS')
+
+    def test_outdated_page_is_served_while_another_request_renders(self):
+        self.client.get(self.detail_url)
+        invalidate_post('post')
+        # pretend another worker is already rendering the fresh copy
+        path_hash = hashlib.md5(self.detail_url.encode()).hexdigest()
+        cache.add(LOCK_KEY.format(path_hash), 1)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.detail_url)
+        self.assertEqual(response['X-Page-Cache'], 'STALE')
+
+        cache.delete(LOCK_KEY.format(path_hash))
+        self.assertEqual(self.client.get(self.detail_url)['X-Page-Cache'], 'MISS')
+
+    def test_cold_miss_waits_for_the_lock_holders_copy(self):
+        self.client.get(self.detail_url)
+        path_hash = hashlib.md5(self.detail_url.encode()).hexdigest()
+        page_key = PAGE_KEY.format(path_hash)
+        entry = cache.get(page_key)
+        cache.delete(page_key)
+        # another worker holds the lock and stores its copy while we wait
+        cache.add(LOCK_KEY.format(path_hash), 'other')
+        with mock.patch('blog.cache.time.sleep',
+                        side_effect=lambda seconds: cache.set(page_key, entry)), \
+                self.assertNumQueries(0):
+            response = self.client.get(self.detail_url)
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+
+    def test_cold_miss_renders_itself_when_no_copy_comes(self):
+        path_hash = hashlib.md5(self.detail_url.encode()).hexdigest()
+        cache.add(LOCK_KEY.format(path_hash), 'other')
+        with mock.patch('blog.cache.time.sleep') as sleep:
+            response = self.client.get(self.detail_url)
+        self.assertEqual(sleep.call_count, LOCK_WAIT / LOCK_POLL_INTERVAL)
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        # the other request's lock is left for it to release
+        self.assertEqual(cache.get(LOCK_KEY.format(path_hash)), 'other')
+
+    def test_the_lock_holder_releases_only_its_own_lock(self):
+        lock_key = LOCK_KEY.format(hashlib.md5(self.detail_url.encode()).hexdigest())
+        self.client.get(self.detail_url)
+        self.assertIsNone(cache.get(lock_key))
+
+        def slow_render(response):
+            # our lock expires while rendering, and another request takes it
+            cache.set(lock_key, 'other')
+            return is_cacheable_response(response)
+
+        invalidate_post('post')
+        with mock.patch('blog.cache.is_cacheable_response', slow_render):
+            self.assertEqual(self.client.get(self.detail_url)['X-Page-Cache'], 'MISS')
+        self.assertEqual(cache.get(lock_key), 'other')
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='password')
+        self.post = Post.objects.create(
+            title='Post', slug='post', author=self.user,
+            content='content', status=1)
+        self.detail_url = reverse('post_detail', args=['post'])
+
+    def assertNotModified(self, url, etag, queries=1):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_unchanged_pages_answer_304(self):
+        # the list's validator comes from the page cache's "list" token
+        # rather than a query
+        for url, queries in ((reverse('home'), 0), (self.detail_url, 1)):
+            etag = self.client.get(url)['ETag']
+            self.assertNotModified(url, etag, queries)
+
+    @override_settings(BLOG_CURSOR_PAGINATION=True)
+    def test_unchanged_cursor_pages_answer_304(self):
+        etag = self.client.get(reverse('home'))['ETag']
+        self.assertNotModified(reverse('home'), etag)
+
+    def test_likes_change_the_list_etag(self):
+        etag = self.client.get(reverse('home'))['ETag']
+        self.client.force_login(self.user)
+        self.client.post(reverse('post_like', args=['post']))
+        self.client.logout()
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_likes_and_comments_change_the_detail_etag(self):
+        etag = self.client.get(self.detail_url)['ETag']
+        self.post.likes.add(self.user)
+        recount()
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        Comment.objects.create(
+            post=self.post, name='reader', email='reader@example.com',
+            body='First!', approved=True)
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'First!')
+
+    def test_comment_edits_change_the_detail_etag(self):
+        comment = Comment.objects.create(
+            post=self.post, name='reader', email='reader@example.com',
+            body='First!', approved=True)
+        for page_cache in (False, True):
+            with self.subTest(page_cache=page_cache), \
+                    override_settings(BLOG_PAGE_CACHE=page_cache):
+                cache.clear()
+                etag = self.client.get(self.detail_url)['ETag']
+                comment.body = f'Edited {page_cache}'
+                comment.save()
+                response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, f'Edited {page_cache}')
+
+    def test_new_post_changes_the_list_etag(self):
+        etag = self.client.get(reverse('home'))['ETag']
+        Post.objects.create(
+            title='Another', slug='another', author=self.user,
+            content='content', status=1)
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_users_get_their_own_etag(self):
+        etag = self.client.get(self.detail_url)['ETag']
+        self.client.force_login(self.user)
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(BLOG_PAGE_CACHE=True)
+    def test_page_cache_hits_answer_304_without_queries(self):
+        cache.clear()
+        etag = self.client.get(self.detail_url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class ContentPipelineTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('author', password='password')
+
+    def create_post(self, content, excerpt=''):
+        return Post.objects.create(
+            title='Post', slug='post', author=self.user, content=content,
+            excerpt=excerpt, status=1)
+
+    def test_content_is_sanitized_on_save(self):
+        post = self.create_post(
+            '<p onclick="steal()">Hello <b>there</b></p><script>alert(1)</script>')
+        self.assertNotIn('onclick', post.content_html)
+        self.assertNotIn('<script', post.content_html)
+        self.assertIn('<b>there</b>', post.content_html)
+
+        response = self.client.get(reverse('post_detail', args=['post']))
+        self.assertContains(response, '<b>there</b>')
+        self.assertNotContains(response, '<script>alert(1)')
+
+    def test_images_are_lazy_and_responsive(self):
+        src = 'https://res.cloudinary.com/demo/image/upload/v1/media/cat.jpg'
+        post = self.create_post(f'<img src="{src}" alt="cat">'
+                                '<img src="https://example.com/dog.png">')
+        self.assertEqual(post.content_html.count('loading="lazy"'), 2)
+        self.assertIn('https://res.cloudinary.com/demo/image/upload/'
+                      'f_auto,q_auto,c_limit,w_480/v1/media/cat.jpg 480w',
+                      post.content_html)
+        self.assertIn('src="https://example.com/dog.png"', post.content_html)
+
+    def test_blank_excerpt_is_written_from_the_content(self):
+        post = self.create_post('<p>Fish &amp; chips ' + 'word ' * 50 + '</p>')
+        self.assertTrue(post.excerpt.startswith('Fish & chips word'))
+        self.assertTrue(post.excerpt.endswith('…'))
+        post.excerpt = 'Hand written'
+        post.save()
+        self.assertEqual(post.excerpt, 'Hand written')
+
+    def test_excerpt_leaves_out_scripts_and_styles(self):
+        post = self.create_post(
+            '<style>p { color: red }</style><p>Visible <b>text</b> '
+            '<script>if (1 < 2) steal();</script>and more</p>')
+        self.assertEqual(post.excerpt, 'Visible text and more')
+
+    def test_generated_excerpt_follows_the_content_until_edited(self):
+        self.create_post('<p>First version</p>')
+        post = Post.objects.get(slug='post')
+        post.content = '<p>Second version</p>'
+        post.save()
+        self.assertEqual(post.excerpt, 'Second version')
+
+        post = Post.objects.get(slug='post')
+        post.excerpt = 'Hand written'
+        post.save()
+        post = Post.objects.get(slug='post')
+        post.content = '<p>Third version</p>'
+        post.save()
+        post.refresh_from_db()
+        self.assertEqual(post.excerpt, 'Hand written')
+        self.assertFalse(post.excerpt_generated)
+
+    def test_migration_renders_older_posts(self):
+        post = self.create_post('<p onclick="x()">Old</p><script>y()</script>')
+        Post.objects.update(content_html='', excerpt='', excerpt_generated=False)
+        migration = importlib.import_module('blog.migrations.0011_post_excerpt_generated')
+        migration.render_missing_content(django_apps, None)
+        post.refresh_from_db()
+        self.assertEqual(post.content_html, '<p>Old</p>y()')
+        self.assertEqual(post.excerpt, 'Oldy()')
+        self.assertTrue(post.excerpt_generated)
+
+    def test_post_list_skips_the_large_columns(self):
+        self.create_post('<p>Hello</p>')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('home'))
+        page_query = queries.captured_queries[-1]['sql']
+        self.assertIn('"excerpt"', page_query)
+        for column in ('"content"', '"content_html"', '"search_vector"'):
+            self.assertNotIn(column, page_query)
+
+    def test_backfill_command(self):
+        post = self.create_post('<p>Hello</p><iframe src="x"></iframe>')
+        Post.objects.update(content_html='')
+        call_command('render_post_content', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.content_html, '<p>Hello</p>')
+
+
+class PostSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author', password='password')
+        for slug, title, excerpt, status in (
+                ('django-caching', 'Django caching', 'Pages from memory', 1),
+                ('fast-pages', 'Fast pages', 'All about django caching', 1),
+                ('draft-caching', 'Draft caching', 'django', 0),
+                ('gardening', 'Gardening', 'Tomatoes', 1)):
+            Post.objects.create(title=title, slug=slug, author=author,
+                                content='<p>content</p>', excerpt=excerpt,
+                                status=status)
+
+    def test_search_finds_published_posts_titles_first(self):
+        response = self.client.get(reverse('post_search'), {'q': 'django caching'})
+        slugs = [post.slug for post in response.context['post_list']]
+        self.assertEqual(slugs, ['django-caching', 'fast-pages'])
+
+    def test_empty_search_has_no_results(self):
+        response = self.client.get(reverse('post_search'))
+        self.assertEqual(list(response.context['post_list']), [])
+
+    def test_admin_search(self):
+        admin_user = User.objects.create_superuser('admin', password='password')
+        self.client.force_login(admin_user)
+        response = self.client.get(
+            reverse('admin:blog_post_changelist'), {'q': 'gardening'})
+        self.assertContains(response, 'Gardening')
+        self.assertNotContains(response, 'Fast pages')
+
+    def test_admin_search_lists_the_best_matches_first(self):
+        admin_user = User.objects.create_superuser('admin', password='password')
+        self.client.force_login(admin_user)
+        url = reverse('admin:blog_post_changelist')
+        response = self.client.get(url, {'q': 'django caching'})
+        slugs = [post.slug for post in response.context['cl'].result_list]
+        # the title match first, then the rest newest first
+        self.assertEqual(slugs, ['django-caching', 'draft-caching', 'fast-pages'])
+        # a clicked column header still sorts the results (title, Z to A)
+        response = self.client.get(url, {'q': 'django caching', 'o': '-1'})
+        slugs = [post.slug for post in response.context['cl'].result_list]
+        self.assertEqual(slugs, ['fast-pages', 'draft-caching', 'django-caching'])
+
+    def test_search_is_not_a_post_slug(self):
+        post = Post(title='Search', slug='search', author=User.objects.first(),
+                    content='<p>content</p>')
+        with self.assertRaises(ValidationError) as raised:
+            post.full_clean()
+        self.assertIn('slug', raised.exception.message_dict)
+
+
+class PostDetailTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            'reader', email='reader@example.com', password='password')
+        self.post = Post.objects.create(
+            title='Post', slug='post', author=self.user,
+            content='content', status=1)
+        for i in range(3):
+            Comment.objects.create(
+                post=self.post, name='reader', email='reader@example.com',
+                body=f'Comment {i}', approved=True)
+        self.url = reverse('post_detail', args=['post'])
+
+    def test_read_path_query_count(self):
+        # the ETag query, the post (with author), the approved comments and
+        # the related posts
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertContains(response, 'Comment 2')
+
+        # logged in: plus the session and user, and the like state rides
+        # along with the post query
+        self.post.likes.add(self.user)
+        self.client.force_login(self.user)
+        with self.assertNumQueries(6):
+            response = self.client.get(self.url)
+        self.assertTrue(response.context['liked'])
+
+    def test_comment_post_redirects_with_a_message(self):
+        self.client.force_login(self.user)
+        # session, user, the post's id, the insert and queueing its moderation
+        with self.assertNumQueries(5):
+            response = self.client.post(self.url, {'body': 'Nice one'})
+        self.assertRedirects(response, self.url, fetch_redirect_response=False)
+
+        comment = Comment.objects.get(body='Nice one')
+        self.assertEqual(comment.name, 'reader')
+        self.assertFalse(comment.approved)
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Your comment is awaiting approval')
+
+    def test_invalid_comment_shows_the_form_errors(self):
+        self.client.force_login(self.user)
+        response = self.client.post(self.url, {'body': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['comment_form'].errors)
+
+
+class DatabaseHealthCheckTests(TestCase):
+
+    def test_dead_connection_is_closed_before_the_request(self):
+        middleware = DatabaseHealthCheckMiddleware(lambda request: 'response')
+        connection.ensure_connection()
+        with mock.patch.object(connection, 'is_usable', return_value=False), \
+                mock.patch.object(connection, 'in_atomic_block', False), \
+                mock.patch.object(connection, 'close') as close:
+            self.assertEqual(middleware(None), 'response')
+        close.assert_called_once()
+
+    def test_working_connection_is_kept(self):
+        middleware = DatabaseHealthCheckMiddleware(lambda request: 'response')
+        connection.ensure_connection()
+        with mock.patch.object(connection, 'in_atomic_block', False), \
+                mock.patch.object(connection, 'close') as close:
+            middleware(None)
+        close.assert_not_called()
+
+    def test_async_stack_stays_async(self):
+        # Under ASGI the middleware must not push async views onto the
+        # thread sync code shares.
+        async def get_response(request):
+            return 'response'
+        middleware = DatabaseHealthCheckMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        connection.ensure_connection()
+        with mock.patch.object(connection, 'is_usable', return_value=False), \
+                mock.patch.object(connection, 'in_atomic_block', False), \
+                mock.patch.object(connection, 'close') as close:
+            self.assertEqual(async_to_sync(middleware)(None), 'response')
+        close.assert_called_once()
+
+
+class FakePgConnection:
+    # just enough of a psycopg2 connection for the pool; broken ones fail
+    # every statement, like one the server has dropped
+
+    def __init__(self, **params):
+        self.closed = 0
+        self.autocommit = True
+        self.broken = False
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+
+    @contextlib.contextmanager
+    def cursor(self):
+        cursor = mock.Mock()
+        if self.broken:
+            cursor.execute.side_effect = psycopg2.OperationalError("server closed the connection")
+        yield cursor
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        if self.broken:
+            raise psycopg2.OperationalError("server closed the connection")
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+@mock.patch('psycopg2.connect', FakePgConnection)
+class ConnectionPoolTests(SimpleTestCase):
+
+    def test_full_pool_waits_for_a_connection_then_times_out(self):
+        pool = ConnectionPool({}, min_size=0, max_size=1, timeout=0.05)
+        first = pool.getconn()
+        with self.assertRaises(psycopg2.OperationalError):
+            pool.getconn()
+
+        # a connection handed back meanwhile goes to the waiting thread
+        pool.timeout = 5
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(pool.getconn()))
+        waiter.start()
+        pool.putconn(first)
+        waiter.join()
+        self.assertEqual(got, [first])
+
+    def test_connections_are_kept_for_reuse(self):
+        pool = ConnectionPool({}, min_size=0, max_size=3)
+        connections = [pool.getconn() for _ in range(3)]
+        for connection in connections:
+            pool.putconn(connection)
+        self.assertEqual({pool.getconn() for _ in range(3)}, set(connections))
+
+    def test_connection_handed_back_after_an_error(self):
+        pool = ConnectionPool({}, min_size=0, max_size=1, timeout=0.05)
+        # an open transaction is rolled back before reuse
+        connection = pool.getconn()
+        connection.status = psycopg2.extensions.TRANSACTION_STATUS_INERROR
+        pool.putconn(connection)
+        self.assertEqual(connection.rollbacks, 1)
+        self.assertIs(pool.getconn(), connection)
+
+        # one that can't be rolled back is closed, and its slot freed
+        connection.status = psycopg2.extensions.TRANSACTION_STATUS_INERROR
+        connection.broken = True
+        pool.putconn(connection)
+        self.assertTrue(connection.closed)
+        self.assertIsNot(pool.getconn(), connection)
+
+    def test_backend_closes_connections_that_no_longer_answer(self):
+        pool = ConnectionPool({}, min_size=0, max_size=1, timeout=0.05)
+        wrapper = PooledDatabaseWrapper({}, alias='pool_test')
+        wrapper._pools = {'pool_test': pool}
+        wrapper.connection = pool.getconn()
+        wrapper.connection.broken = True
+        wrapper.errors_occurred = True
+        broken = wrapper.connection
+        wrapper._close()
+        self.assertTrue(broken.closed)
+        self.assertIsNot(pool.getconn(), broken)
+
+    def test_dropped_idle_connections_are_replaced(self):
+        pool = ConnectionPool({}, min_size=2, max_size=2)
+        dropped, closed = pool._idle
+        dropped.broken = True
+        closed.closed = 1
+        fresh = pool.getconn()
+        self.assertNotIn(fresh, (dropped, closed))
+        self.assertTrue(dropped.closed)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'])
+class ReplicaRouterTests(TestCase):
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        # every request starts unpinned
+        self.tokens = start_request(False)
+        self.addCleanup(end_request, self.tokens)
+
+    def test_blog_reads_go_to_a_replica(self):
+        self.assertEqual(self.router.db_for_read(Post), 'replica_0')
+        self.assertEqual(self.router.db_for_read(Comment), 'replica_0')
+        self.assertEqual(self.router.db_for_read(Post.likes.through), 'replica_0')
+        # auth, sessions, the task queue and the rest stay on the primary
+        for model in (User, Task, PostStats, RelatedPost):
+            self.assertEqual(self.router.db_for_read(model), 'default')
+
+    def test_reads_follow_a_write_to_the_primary(self):
+        self.assertEqual(self.router.db_for_write(Comment), 'default')
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_reads_outside_a_request_use_the_primary(self):
+        def worker():
+            # e.g. the task worker, or a signal handler after the response
+            return self.router.db_for_read(Comment)
+        self.assertEqual(contextvars.Context().run(worker), 'default')
+
+    def test_without_replicas_everything_uses_the_primary(self):
+        with self.settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_only_the_primary_is_migrated(self):
+        self.assertTrue(self.router.allow_migrate('default', 'blog'))
+        self.assertFalse(self.router.allow_migrate('replica_0', 'blog'))
+
+
+@override_settings(DATABASE_REPLICAS=['replica_test'],
+                   DATABASE_ROUTERS=['codestar.routers.PrimaryReplicaRouter'])
+class ReplicaDatabaseTests(TransactionTestCase):
+    # replica_test is a second connection to the test database (a MIRROR,
+    # see codestar/settings.py); TransactionTestCase, as it only sees
+    # committed rows
+    databases = {'default', 'replica_test'}
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='pw')
+        self.post = Post.objects.create(title='Replicated', slug='replicated',
+                                        author=self.user, content='<p>Hi</p>', status=1)
+        tokens = start_request(False)
+        self.addCleanup(end_request, tokens)
+
+    def queries_on(self, alias, action):
+        with CaptureQueriesContext(connections[alias]) as queries:
+            action()
+        return [query['sql'] for query in queries.captured_queries]
+
+    def test_post_reads_use_the_replica_connection(self):
+        replica = self.queries_on(
+            'replica_test', lambda: Post.objects.get(slug='replicated'))
+        self.assertEqual(len(replica), 1)
+        self.assertIn('"blog_post"', replica[0])
+
+    def test_task_reads_use_the_primary_connection(self):
+        Task.objects.create(name='test_task')
+        replica = self.queries_on('replica_test', lambda: list(Task.objects.all()))
+        self.assertEqual(replica, [])
+
+    def test_reads_after_a_write_use_the_primary_connection(self):
+        Comment.objects.create(post=self.post, name='a', email='', body='Hi')
+        replica = self.queries_on(
+            'replica_test', lambda: list(self.post.comments.all()))
+        self.assertEqual(replica, [])
+
+    def test_the_worker_never_reads_a_lagging_replica(self):
+        # any read from the replica here could miss the comment just saved
+        User.objects.filter(pk=self.user.pk).update(email='author@example.com')
+        Comment.objects.create(post=self.post, name='reader', user=self.user,
+                               email='', body='Earlier', approved=True)
+        comment = Comment.objects.create(post=self.post, name='reader', user=self.user,
+                                         email='', body='Hello again')
+        enqueue('moderate_comments', comment_id=comment.pk)
+        replica = contextvars.Context().run(
+            self.queries_on, 'replica_test', lambda: (run_due_tasks(), run_due_tasks()))
+        self.assertEqual(replica, [])
+        comment.refresh_from_db()
+        self.assertTrue(comment.approved)
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(BLOG_PAGE_CACHE=True)
+    def test_pages_stored_in_the_page_cache_are_rendered_from_the_primary(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        url = reverse('post_detail', args=['replicated'])
+        replica = self.queries_on('replica_test', lambda: self.client.get(url))
+        self.assertEqual(replica, [])
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'HIT')
+
+    @modify_settings(MIDDLEWARE={'prepend': 'codestar.middleware.ReplicaPinningMiddleware'})
+    def test_streamed_api_pages_are_read_where_the_request_was_routed(self):
+        Comment.objects.create(post=self.post, name='a', email='', body='Hi',
+                               approved=True)
+        url = reverse('api_comment_list', args=['replicated'])
+        # the body is written after the middleware has unpinned the request;
+        # a new context, as the comment written above pinned this one
+        self.client.cookies[ReplicaPinningMiddleware.cookie_name] = '1'
+        replica = contextvars.Context().run(
+            self.queries_on, 'replica_test',
+            lambda: b''.join(self.client.get(url).streaming_content))
+        self.assertEqual(replica, [])
+
+    @modify_settings(MIDDLEWARE={'prepend': 'codestar.middleware.ReplicaPinningMiddleware'})
+    def test_streamed_feeds_are_read_where_the_request_was_routed(self):
+        self.addCleanup(cache.clear)
+
+        def post_queries(url):
+            # on each connection, while the document is requested and then
+            # written out after the view has returned
+            cache.clear()
+            with CaptureQueriesContext(connections['default']) as primary, \
+                    CaptureQueriesContext(connections['replica_test']) as replica:
+                response = self.client.get(url)
+                self.assertIn(b'/replicated/', b''.join(response.streaming_content))
+            return [len([query for query in queries.captured_queries
+                         if '"blog_post"' in query['sql']])
+                    for queries in (primary, replica)]
+
+        for url in (reverse('rss_feed'), reverse('sitemap_shard', args=[0])):
+            with self.subTest(url=url):
+                # a new context, as the writes in setUp pinned this one
+                self.client.cookies.clear()
+                self.assertEqual(contextvars.Context().run(post_queries, url), [0, 2])
+                self.client.cookies[ReplicaPinningMiddleware.cookie_name] = '1'
+                self.assertEqual(contextvars.Context().run(post_queries, url), [2, 0])
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'], DATABASE_REPLICA_PIN_SECONDS=10)
+class ReplicaPinningTests(TestCase):
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+
+    def read_db_during(self, request, write=False):
+        seen = {}
+
+        def view(request):
+            if write:
+                self.router.db_for_write(Comment)
+            seen['db'] = self.router.db_for_read(Post)
+            return HttpResponse()
+
+        response = ReplicaPinningMiddleware(view)(request)
+        return seen['db'], response
+
+    def test_writing_request_pins_the_client(self):
+        db, response = self.read_db_during(self.factory.post('/'), write=True)
+        self.assertEqual(db, 'default')
+        cookie = response.cookies[ReplicaPinningMiddleware.cookie_name]
+        self.assertEqual(cookie['max-age'], 10)
+
+        # the next request from the same client still reads the primary
+        request = self.factory.get('/')
+        request.COOKIES[ReplicaPinningMiddleware.cookie_name] = '1'
+        db, response = self.read_db_during(request)
+        self.assertEqual(db, 'default')
+
+    def test_reading_request_uses_a_replica_and_sets_no_cookie(self):
+        db, response = self.read_db_during(self.factory.get('/'))
+        self.assertEqual(db, 'replica_0')
+        self.assertFalse(response.cookies)
+
+
+class TaskQueueTests(TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+        @handler('test_task')
+        def test_task(payloads):
+            self.calls.append(payloads)
+            if any(payload.get('fail') for payload in payloads):
+                raise RuntimeError("boom")
+        self.addCleanup(HANDLERS.pop, 'test_task')
+
+    def test_tasks_of_one_name_run_as_a_batch(self):
+        for i in range(3):
+            enqueue('test_task', n=i)
+        self.assertEqual(run_due_tasks(), 3)
+        self.assertEqual(self.calls, [[{'n': 0}, {'n': 1}, {'n': 2}]])
+        self.assertFalse(Task.objects.exists())
+
+    def test_failing_batch_is_retried_later_then_marked_failed(self):
+        task = enqueue('test_task', fail=True)
+        with self.assertLogs('blog.tasks', 'ERROR') as logs:
+            self.assertEqual(run_due_tasks(), 1)
+            task.refresh_from_db()
+            self.assertEqual(task.attempts, 1)
+            self.assertIn('boom', task.last_error)
+            self.assertFalse(task.failed)
+            # not due again until the retry delay has passed
+            self.assertEqual(run_due_tasks(), 0)
+
+            for attempt in range(2, MAX_ATTEMPTS + 1):
+                Task.objects.update(run_after=task.created_on)
+                run_due_tasks()
+            task.refresh_from_db()
+            self.assertEqual(task.attempts, MAX_ATTEMPTS)
+            self.assertTrue(task.failed)
+            Task.objects.update(run_after=task.created_on)
+            self.assertEqual(run_due_tasks(), 0)
+        # every attempt is logged with its traceback
+        self.assertEqual(len(logs.output), MAX_ATTEMPTS)
+        self.assertIn('RuntimeError: boom', logs.output[0])
+
+    def test_tasks_without_a_handler_fail_without_stopping_the_worker(self):
+        gone = Task.objects.create(name='removed_task', payload={})
+        enqueue('test_task', n=1)
+        with self.assertLogs('blog.tasks', 'ERROR'):
+            self.assertEqual(run_due_tasks(), 2)
+            # the other tasks still ran
+            self.assertEqual(self.calls, [[{'n': 1}]])
+            for attempt in range(2, MAX_ATTEMPTS + 1):
+                Task.objects.update(run_after=gone.created_on)
+                run_due_tasks()
+        gone.refresh_from_db()
+        self.assertTrue(gone.failed)
+        self.assertIn("No task handler named 'removed_task'", gone.last_error)
+
+    def test_unknown_tasks_are_refused(self):
+        with self.assertRaises(ValueError):
+            enqueue('no_such_task')
+
+
+class CommentModerationTests(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            'author', email='author@example.com', password='pw')
+        self.reader = User.objects.create_user('reader', password='pw')
+        self.post = Post.objects.create(
+            title='Moderated', slug='moderated', author=self.author,
+            content='<p>Hello</p>', status=1)
+        # index the new post's related posts, so only comment tasks are left
+        run_due_tasks()
+        self.client.force_login(self.reader)
+
+    def comment(self, body):
+        self.client.post(reverse('post_detail', args=['moderated']), {'body': body})
+        return Comment.objects.latest('id')
+
+    def run_worker(self):
+        out = StringIO()
+        call_command('run_tasks', '--once', stdout=out)
+        return out.getvalue()
+
+    def test_returning_commenter_is_approved_and_author_notified(self):
+        Comment.objects.create(post=self.post, name='reader', user=self.reader,
+                               email='', body='Earlier', approved=True)
+        comment = self.comment('Thanks for writing this')
+        self.assertFalse(comment.approved)
+        self.assertEqual(Task.objects.count(), 1)
+
+        self.assertIn('Ran 2 tasks', self.run_worker())
+        comment.refresh_from_db()
+        self.assertTrue(comment.approved)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.approved_comment_count, 2)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['author@example.com'])
+        self.assertIn('Thanks for writing this', mail.outbox[0].body)
+
+    def test_first_comment_waits_for_a_human(self):
+        comment = self.comment('First!')
+        self.run_worker()
+        comment.refresh_from_db()
+        self.assertFalse(comment.approved)
+        self.assertIn('awaiting approval', mail.outbox[0].body)
+
+    def test_approval_goes_by_the_account_not_the_name(self):
+        # an approved comment by an earlier account that was called "reader"
+        former = User.objects.create_user('former', password='pw')
+        Comment.objects.create(post=self.post, name='reader', user=former,
+                               email='', body='Earlier', approved=True)
+        comment = self.comment('Same name, different account')
+        self.run_worker()
+        comment.refresh_from_db()
+        self.assertEqual(comment.user, self.reader)
+        self.assertFalse(comment.approved)
+
+    def test_failed_emails_are_retried_without_resending_the_others(self):
+        other = User.objects.create_user('other', email='other@example.com', password='pw')
+        other_post = Post.objects.create(title='Other', slug='other', author=other,
+                                         content='<p>Hi</p>', status=1)
+        run_due_tasks()
+        for post in (self.post, other_post):
+            comment = Comment.objects.create(post=post, name='reader', user=self.reader,
+                                             email='', body='Hello')
+            enqueue('notify_post_authors', comment_id=comment.pk)
+
+        send_messages = locmem.EmailBackend.send_messages
+
+        def other_is_down(backend, messages):
+            if messages[0].to == ['other@example.com']:
+                raise smtplib.SMTPException("unavailable")
+            return send_messages(backend, messages)
+
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', other_is_down), \
+                self.assertLogs('blog.tasks', 'ERROR'):
+            run_due_tasks()
+        self.assertEqual([email.to for email in mail.outbox], [['author@example.com']])
+
+        Task.objects.update(run_after=timezone.now())
+        run_due_tasks()
+        self.assertEqual([email.to for email in mail.outbox],
+                         [['author@example.com'], ['other@example.com']])
+        self.assertFalse(Task.objects.exists())
+
+    def test_spam_is_neither_approved_nor_notified(self):
+        Comment.objects.create(post=self.post, name='reader', user=self.reader,
+                               email='', body='Earlier', approved=True)
+        spam = self.comment('Cheap casino http://a.example http://b.example http://c.example')
+        self.run_worker()
+        spam.refresh_from_db()
+        self.assertFalse(spam.approved)
+        self.assertEqual(mail.outbox, [])
+
+    def test_a_flood_is_moderated_in_a_fixed_number_of_queries(self):
+        for i in range(20):
+            user = User.objects.create_user(f'reader{i}', password='pw')
+            Comment.objects.create(post=self.post, name=f'reader{i}', user=user,
+                                   email='', body='Earlier', approved=True)
+            comment = Comment.objects.create(
+                post=self.post, name=f'reader{i}', user=user, email='',
+                body=f'Comment {i}')
+            enqueue('moderate_comments', comment_id=comment.pk)
+        # the comments, two GROUP BYs, approving them (ids, group, update,
+        # counter and savepoints) and queueing the notifications - not 20
+        # times over
+        payloads = [task.payload for task in Task.objects.all()]
+        with self.assertNumQueries(10):
+            HANDLERS['moderate_comments'](payloads)
+        self.assertEqual(Comment.objects.filter(approved=False).count(), 0)
+
+
+class AdminChangelistTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.force_login(self.admin)
+        self.posts = [
+            Post.objects.create(title=f'Admin {i}', slug=f'admin-{i}',
+                                author=self.admin, content='<p>Text</p>', status=1)
+            for i in range(3)]
+
+    def add_comments(self, count):
+        Comment.objects.bulk_create(
+            Comment(post=self.posts[i % 3], name=f'reader{i}', email='',
+                    body='Hello') for i in range(count))
+
+    def test_comment_changelist_queries_do_not_grow_with_rows(self):
+        self.add_comments(5)
+        url = reverse('admin:blog_comment_changelist')
+        # session, user, the count, the page (posts joined in), and the
+        # date hierarchy's range and years
+        with self.assertNumQueries(6):
+            response = self.client.get(url)
+        self.assertContains(response, 'Admin 2')
+        self.add_comments(20)
+        with self.assertNumQueries(6):
+            self.client.get(url)
+        # a filter doesn't add a second, unfiltered count
+        with self.assertNumQueries(6):
+            self.client.get(url, {'approved__exact': '0'})
+
+    def test_post_changelist_queries_do_not_grow_with_rows(self):
+        url = reverse('admin:blog_post_changelist')
+        with self.assertNumQueries(6):
+            response = self.client.get(url)
+        self.assertContains(response, 'Admin 0')
+        for i in range(3, 10):
+            Post.objects.create(title=f'Admin {i}', slug=f'admin-{i}',
+                                author=self.admin, content='<p>Text</p>')
+        with self.assertNumQueries(6):
+            self.client.get(url)
+
+    def test_requests_to_unnamed_urls_are_not_changelists(self):
+        request = RequestFactory().get('/')
+        request.resolver_match = ResolverMatch(lambda request: None, (), {})
+        self.assertFalse(is_changelist(request))
+
+    def test_large_unfiltered_lists_use_the_estimated_count(self):
+        with mock.patch('blog.pagination.estimated_row_count',
+                        return_value=2000000) as estimate:
+            self.assertEqual(
+                EstimatedCountPaginator(Post.objects.all(), 100).count, 2000000)
+            estimate.assert_called_once()
+            # filtered lists are counted exactly
+            self.assertEqual(EstimatedCountPaginator(
+                Post.objects.filter(status=1), 100).count, 3)
+        # SQLite has no estimate at all
+        self.assertEqual(EstimatedCountPaginator(Post.objects.all(), 100).count, 3)
+
+    def test_approve_comments_works_in_batches(self):
+        self.add_comments(7)
+        # three batches of 3, 3 and 1 comments, each: the ids, savepoint,
+        # GROUP BY, update, one counter update per post and release
+        with self.assertNumQueries(8 + 8 + 6):
+            self.assertEqual(approve_comments(Comment.objects.all(), batch_size=3), 7)
+        self.assertEqual(
+            sum(Post.objects.values_list('approved_comment_count', flat=True)), 7)
+
+
+class RequestTimingTests(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user('author', password='pw')
+        Post.objects.create(title='Timed', slug='timed', author=self.author,
+                            content='<p>Hi</p>', status=1)
+
+    @modify_settings(MIDDLEWARE={'prepend': 'codestar.middleware.RequestTimingMiddleware'})
+    @override_settings(BLOG_REQUEST_TIMING_SLOW_MS=10000)
+    def test_timings_are_sent_and_logged(self):
+        with self.assertLogs('codestar.timing', 'INFO') as logs:
+            response = self.client.get(reverse('post_detail', args=['timed']))
+        header = response['Server-Timing']
+        self.assertRegex(header, r'^sql;dur=[\d.]+;desc="4 queries", '
+                                 r'tpl;dur=[\d.]+, total;dur=[\d.]+$')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['path'], '/timed/')
+        self.assertEqual(record['queries'], 4)
+        self.assertGreater(record['template_ms'], 0)
+        self.assertNotIn('slowest_queries', record)
+
+    @override_settings(BLOG_REQUEST_TIMING_SLOW_MS=0)
+    def test_slow_requests_are_logged_with_their_sql(self):
+        middleware = RequestTimingMiddleware(
+            lambda request: HttpResponse(Post.objects.count()))
+        with self.assertLogs('codestar.timing', 'WARNING') as logs:
+            middleware(RequestFactory().get('/'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['queries'], 1)
+        self.assertIn('COUNT(*)', record['slowest_queries'][0]['sql'])
+
+    def test_off_by_default(self):
+        response = self.client.get(reverse('home'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class QueryBudgetTests(TestCase):
+    # The same requests as `manage.py bench_views`, against seeded data, must
+    # stay within their query budgets (blog/benchmarks.py).
+
+    def test_endpoints_stay_within_their_query_budgets(self):
+        call_command('seed_blog', users=5, posts=20, comments=100, likes=40,
+                     stdout=StringIO())
+        slug = Post.objects.filter(status=1).values_list('slug', flat=True).first()
+        member = self.client_class()
+        member.force_login(User.objects.create_user('bench', password='pw'))
+
+        for scenario in scenarios(slug):
+            client = member if scenario.authenticated else self.client
+            # twice for the like toggle: the like and the unlike
+            for _ in range(2 if scenario.method == 'post' else 1):
+                with self.subTest(scenario.name), \
+                        CaptureQueriesContext(connection) as queries:
+                    response = getattr(client, scenario.method)(scenario.path)
+                self.assertLess(response.status_code, 400)
+                self.assertLessEqual(len(queries), QUERY_BUDGETS[scenario.name],
+                                     scenario.name)
+
+
+class FeaturedImageTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('author', password='pw')
+
+    def create_post(self, **kwargs):
+        return Post.objects.create(title='Pictured', slug='pictured', author=self.user,
+                                   content='<p>Hi</p>', status=1, **kwargs)
+
+    def uploaded_image(self):
+        return CloudinaryResource('cat', format='jpg', version='1',
+                                  type='upload', resource_type='image')
+
+    def test_placeholder_posts_store_no_urls(self):
+        post = self.create_post()
+        self.assertTrue(post.is_placeholder)
+        self.assertEqual(post.featured_image_urls, {})
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'fullstack/blog/default.jpg')
+
+    def test_resized_urls_are_computed_on_save(self):
+        post = self.create_post(featured_image=self.uploaded_image())
+        self.assertFalse(post.is_placeholder)
+        urls = Post.objects.get(pk=post.pk).featured_image_urls
+        self.assertIn('/image/upload/c_limit,f_auto,q_auto,w_800/v1/cat.jpg', urls['src'])
+        self.assertIn('w_1200/v1/cat.jpg 1200w', urls['srcset'])
+        self.assertIn('w_400/v1/cat.jpg', urls['thumbnail'])
+
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, f'src="{urls["thumbnail"]}"')
+        self.assertContains(response, 'loading="lazy"')
+        response = self.client.get(reverse('post_detail', args=['pictured']))
+        self.assertContains(response, f'srcset="{urls["srcset"]}"')
+
+    @override_settings(BLOG_IMAGE_URL_BUILDER='blog.images.local_image_url',
+                       MEDIA_URL='/media/')
+    def test_url_builder_can_be_swapped(self):
+        post = self.create_post(featured_image=self.uploaded_image())
+        self.assertEqual(post.featured_image_urls['src'], '/media/cat.jpg')
+        self.assertEqual(post.featured_image_urls['thumbnail_srcset'],
+                         '/media/cat.jpg 400w, /media/cat.jpg 800w')
+
+    def test_migration_fills_the_same_urls(self):
+        post = self.create_post(featured_image=self.uploaded_image())
+        placeholder = Post.objects.create(title='Plain', slug='plain', author=self.user,
+                                          content='<p>Hi</p>', status=1)
+        saved = Post.objects.get(pk=post.pk).featured_image_urls
+        Post.objects.update(featured_image_urls={})
+        migration = importlib.import_module('blog.migrations.0008_post_featured_image_urls')
+        migration.fill_featured_image_urls(django_apps, None)
+        self.assertEqual(Post.objects.get(pk=post.pk).featured_image_urls, saved)
+        self.assertEqual(Post.objects.get(pk=placeholder.pk).featured_image_urls, {})
+
+
+class AsyncViewTests(TransactionTestCase):
+    # TransactionTestCase: the async views query from other threads, which
+    # only see committed rows
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='pw')
+        self.post = Post.objects.create(title='Async', slug='async', author=self.user,
+                                        content='<p>Hi</p>', status=1)
+        Comment.objects.create(post=self.post, name='a', email='', body='Shown',
+                               approved=True)
+        Comment.objects.create(post=self.post, name='b', email='', body='Hidden')
+        self.factory = AsyncRequestFactory()
+
+    def request(self, path, user=None, **headers):
+        request = self.factory.get(path)
+        request.META.update(headers)
+        request.user = user or AnonymousUser()
+        return request
+
+    async def test_post_detail(self):
+        await sync_to_async(self.post.likes.add)(self.user)
+        response = await async_views.post_detail(
+            self.request('/async/', self.user), slug='async')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Shown')
+        self.assertNotContains(response, 'Hidden')
+        self.assertContains(response, 'class="fas fa-heart"')
+        self.assertTrue(response.has_header('ETag'))
+
+        # the same ETag from the sync view, so caches don't care which served it
+        sync_response = await sync_to_async(self.client.get)(
+            reverse('post_detail', args=['async']))
+        etag = sync_response['ETag']
+        response = await async_views.post_detail(
+            self.request('/async/', HTTP_IF_NONE_MATCH=etag), slug='async')
+        self.assertEqual(response.status_code, 304)
+
+    async def test_post_detail_shows_related_posts(self):
+        await sync_to_async(Post.objects.create)(
+            title='Async again', slug='async-again', author=self.user,
+            content='<p>More async</p>', status=1)
+        await sync_to_async(related.build_related_posts)()
+        response = await async_views.post_detail(self.request('/async/'), slug='async')
+        self.assertContains(response, 'href="/async-again/"')
+
+    async def test_missing_post_is_a_404(self):
+        with self.assertRaises(Http404):
+            await async_views.post_detail(self.request('/nope/'), slug='nope')
+
+    async def test_post_list_pages(self):
+        response = await async_views.post_list(self.request('/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Async')
+        with self.assertRaises(Http404):
+            await async_views.post_list(self.request('/?page=2'))
+
+    async def test_concurrent_requests_are_timed_separately(self):
+        async def view(request):
+            # ?n=3 makes three queries, with the other request's in between
+            for _ in range(int(request.GET['n'])):
+                await sync_to_async(Post.objects.count)()
+                await asyncio.sleep(0)
+            return HttpResponse()
+
+        middleware = RequestTimingMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        with self.assertLogs('codestar.timing', 'INFO'):
+            one, three = await asyncio.gather(
+                middleware(self.request('/?n=1')), middleware(self.request('/?n=3')))
+        self.assertIn('desc="1 queries"', one['Server-Timing'])
+        self.assertIn('desc="3 queries"', three['Server-Timing'])
+
+
+class SessionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader', password='pw')
+        Post.objects.create(title='Sessions', slug='sessions', author=cls.user,
+                            content='<p>Hi</p>', status=1)
+
+    def session_queries(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return [q['sql'] for q in queries if 'django_session' in q['sql']]
+
+    def test_anonymous_readers_never_load_a_session(self):
+        self.assertEqual(self.session_queries(reverse('home')), [])
+        self.assertEqual(self.session_queries(reverse('home') + '?page=1'), [])
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, self.client.cookies)
+
+    def test_stale_session_cookie_is_dropped(self):
+        # a cookie for a session that no longer exists costs one lookup,
+        # then it's deleted and the reader is back to no session at all
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = 'x' * 32
+        self.assertEqual(len(self.session_queries(reverse('home'))), 1)
+        self.assertEqual(self.client.cookies[settings.SESSION_COOKIE_NAME].value, '')
+        self.assertEqual(self.session_queries(reverse('home')), [])
+
+    @override_settings(SESSION_ENGINE=settings.SESSION_ENGINES['cached_db'])
+    def test_cached_db_sessions_are_read_from_the_cache(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.assertEqual(self.session_queries(reverse('home')), [])
+        self.assertContains(self.client.get(reverse('home')), 'Logout')
+
+    @override_settings(SESSION_ENGINE=settings.SESSION_ENGINES['signed_cookies'])
+    def test_signed_cookie_sessions_skip_the_database(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.session_queries(reverse('home')), [])
+        self.assertContains(self.client.get(reverse('home')), 'Logout')
+        self.assertFalse(Session.objects.exists())
+
+    def test_clear_expired_sessions_in_batches(self):
+        now = timezone.now()
+        for i in range(5):
+            Session.objects.create(session_key=f'old{i}', session_data='',
+                                   expire_date=now - timedelta(days=1))
+        for i in range(2):
+            Session.objects.create(session_key=f'new{i}', session_data='',
+                                   expire_date=now + timedelta(days=1))
+        out = StringIO()
+        call_command('clear_expired_sessions', batch_size=2, stdout=out)
+        self.assertIn('Deleted 5 expired sessions', out.getvalue())
+        self.assertEqual(
+            sorted(Session.objects.values_list('session_key', flat=True)),
+            ['new0', 'new1'])
+
+
+class PostStatsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('author', password='pw')
+        cls.old = Post.objects.create(title='Old', slug='old', author=cls.user,
+                                      content='<p>Hi</p>', status=1)
+        Post.objects.filter(pk=cls.old.pk).update(
+            created_on=timezone.now() - timedelta(days=5))
+        cls.new = Post.objects.create(title='New', slug='new', author=cls.user,
+                                      content='<p>Hi</p>', status=1)
+
+    def setUp(self):
+        stats._pending.clear()
+        cache.clear()
+        self.addCleanup(stats._pending.clear)
+        self.addCleanup(cache.clear)
+
+    def views(self, post):
+        return PostStats.objects.filter(post=post).aggregate(n=Sum('views'))['n']
+
+    def test_views_are_buffered_then_written_in_one_batch(self):
+        for _ in range(3):
+            self.client.get(reverse('post_detail', args=['old']))
+        self.client.get(reverse('post_detail', args=['new']))
+        self.client.get(reverse('post_detail', args=['missing']))
+        # nothing written yet, and the post rows untouched
+        self.assertFalse(PostStats.objects.exists())
+
+        self.assertEqual(stats.flush_views(), 5)
+        self.assertEqual(self.views(self.old), 3)
+        self.assertEqual(self.views(self.new), 1)
+
+        # the same day's row is incremented, not duplicated
+        stats.record_view('old')
+        stats.flush_views()
+        self.assertEqual(PostStats.objects.filter(post=self.old).count(), 1)
+        self.assertEqual(self.views(self.old), 4)
+
+    @override_settings(BLOG_VIEW_FLUSH_SIZE=1, BLOG_VIEW_FLUSH_INTERVAL=0)
+    def test_no_flush_inside_a_transaction(self):
+        # the test itself runs in one, so a due batch must stay buffered
+        stats.record_view('old')
+        stats.flush_views_if_due()
+        self.assertFalse(PostStats.objects.exists())
+        self.assertEqual(stats._pending['old'], 1)
+
+    def test_popular_posts_decay_with_age(self):
+        for _ in range(3):
+            stats.record_view('old')
+            stats.record_view('new')
+        stats.flush_views()
+        self.assertEqual([post['slug'] for post in stats.popular_posts()],
+                         ['new', 'old'])
+
+        # shown on the home page without any query for it
+        with self.assertNumQueries(QUERY_BUDGETS['post_list']):
+            response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Popular this week')
+        self.assertEqual(response.context['popular_posts'][0]['slug'], 'new')
+
+    def test_new_ranking_changes_the_home_page_etag(self):
+        etag = self.client.get(reverse('home'))['ETag']
+        stats.record_view('old')
+        stats.flush_views()
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Popular this week')
+
+
+class LocalStaticFilesTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.root)
+        cls.settings = override_settings(
+            STATIC_ROOT=cls.root,
+            STATICFILES_STORAGE='codestar.staticfiles.CompressedManifestStaticFilesStorage')
+        cls.settings.enable()
+        cls.addClassCleanup(cls.settings.disable)
+        # Django's collectstatic: cloudinary_storage's only uploads to Cloudinary
+        call_command(CollectStatic(), interactive=False, verbosity=0,
+                     ignore_patterns=['admin', 'summernote', 'django_summernote'])
+        cls.middleware = StaticFilesMiddleware(lambda request: HttpResponse(status=404))
+
+    def get(self, path, **headers):
+        return self.middleware(RequestFactory().get(path, **headers))
+
+    def hashed_css(self):
+        url = static('css/style.css')
+        self.assertRegex(url, r'^/static/css/style\.[0-9a-f]{12}\.css$')
+        return url
+
+    def test_collectstatic_writes_compressed_copies(self):
+        name = self.hashed_css()[len('/static/'):]
+        original = os.path.join(self.root, name)
+        with open(original, 'rb') as f, open(original + '.gz', 'rb') as gz:
+            self.assertEqual(gzip.decompress(gz.read()), f.read())
+
+    def test_hashed_files_are_immutable_and_negotiated(self):
+        url = self.hashed_css()
+        response = self.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('Accept-Encoding', response['Vary'])
+        body = gzip.decompress(b''.join(response.streaming_content))
+        self.assertIn(b'body', body)
+        if staticfiles.brotli:
+            response = self.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+            self.assertEqual(response['Content-Encoding'], 'br')
+            self.assertEqual(staticfiles.brotli.decompress(
+                b''.join(response.streaming_content)), body)
+
+        # no (or a refused) encoding: the file as is
+        for accept in ('', 'gzip;q=0, identity'):
+            response = self.get(url, HTTP_ACCEPT_ENCODING=accept)
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertEqual(b''.join(response.streaming_content), body)
+
+        etag = self.get(url)['ETag']
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_unhashed_names_are_only_briefly_cached(self):
+        response = self.get('/static/css/style.css')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+
+    def test_other_paths_are_passed_on(self):
+        self.assertEqual(self.get('/static/../manage.py').status_code, 404)
+        self.assertEqual(self.get('/static/missing.css').status_code, 404)
+        self.assertEqual(self.get('/').status_code, 404)
+
+
+class ApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        start = timezone.now() - timedelta(days=1)
+        for i in range(5):
+            post = Post.objects.create(
+                title=f'Post {i}', slug=f'post-{i}', author=cls.author,
+                content=f'<p>Body {i}</p>', excerpt=f'Excerpt {i}', status=1)
+            Post.objects.filter(pk=post.pk).update(created_on=start + timedelta(hours=i))
+        Post.objects.create(title='Draft', slug='draft', author=cls.author,
+                            content='<p>Draft</p>', status=0)
+        cls.post = Post.objects.get(slug='post-4')
+        for i in range(3):
+            Comment.objects.create(post=cls.post, name=f'reader{i}', email='r@example.com',
+                                   body=f'Comment {i}', approved=True)
+        Comment.objects.create(post=cls.post, name='spammer', email='s@example.com',
+                               body='Hidden', approved=False)
+
+    def get_json(self, response):
+        content = (b''.join(response.streaming_content) if response.streaming
+                   else response.content)
+        return json.loads(content)
+
+    def test_post_list_pages_with_cursors(self):
+        response = self.client.get(reverse('api_post_list'), {'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        page = self.get_json(response)
+        self.assertEqual([post['slug'] for post in page['results']], ['post-4', 'post-3'])
+        # no content in lists unless asked for
+        self.assertNotIn('content', page['results'][0])
+        self.assertEqual(page['results'][0]['author'], 'author')
+
+        slugs = [post['slug'] for post in page['results']]
+        while page['next']:
+            page = self.get_json(self.client.get(page['next']))
+            slugs += [post['slug'] for post in page['results']]
+        self.assertEqual(slugs, [f'post-{i}' for i in range(4, -1, -1)])
+
+    def test_sparse_fields_and_one_query_per_page(self):
+        with self.assertNumQueries(2):
+            # the ETag's narrow query, then the page
+            page = self.get_json(self.client.get(
+                reverse('api_post_list'), {'fields': 'slug,content', 'limit': 1}))
+        self.assertEqual(page['results'], [{'slug': 'post-4', 'content': '<p>Body 4</p>'}])
+
+        response = self.client.get(reverse('api_post_list'), {'fields': 'slug,password'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', response.json()['error'])
+        self.assertEqual(self.client.get(reverse('api_post_list'),
+                                         {'cursor': 'nope'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_post_list'),
+                                         {'limit': 1000}).status_code, 400)
+
+    def test_list_etag_changes_with_the_page(self):
+        url = reverse('api_post_list')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Post.objects.filter(slug='post-2').update(like_count=7)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_post_detail(self):
+        url = reverse('api_post_detail', args=['post-4'])
+        response = self.client.get(url)
+        data = response.json()
+        self.assertEqual(data['content'], '<p>Body 4</p>')
+        self.assertEqual(data['comment_count'], 3)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+                         304)
+        self.assertEqual(self.client.get(url, {'fields': 'title'}).json(), {'title': 'Post 4'})
+        self.assertEqual(self.client.get(
+            reverse('api_post_detail', args=['draft'])).status_code, 404)
+        self.assertEqual(self.client.post(url).status_code, 405)
+
+    def test_approved_comments_oldest_first(self):
+        url = reverse('api_comment_list', args=['post-4'])
+        page = self.get_json(self.client.get(url, {'limit': 2}))
+        self.assertEqual([c['body'] for c in page['results']], ['Comment 0', 'Comment 1'])
+        self.assertNotIn('email', page['results'][0])
+        page = self.get_json(self.client.get(page['next']))
+        self.assertEqual([c['body'] for c in page['results']], ['Comment 2'])
+        self.assertIsNone(page['next'])
+        self.assertEqual(self.client.get(
+            reverse('api_comment_list', args=['draft'])).status_code, 404)
+
+    def test_comment_etag_changes_when_a_comment_is_edited(self):
+        url = reverse('api_comment_list', args=['post-4'])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Comment.objects.filter(body='Comment 1').update(body='Comment 1 (edited)')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Comment 1 (edited)', str(self.get_json(response)))
+
+
+class FeedAndSitemapTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        for i in range(3):
+            Post.objects.create(title=f'Feed {i} & more', slug=f'feed-{i}', author=cls.author,
+                                content='<p>Hi</p>', excerpt=f'Excerpt {i}', status=1)
+        Post.objects.create(title='Draft', slug='draft', author=cls.author,
+                            content='<p>Draft</p>', status=0)
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def read(self, response):
+        self.assertEqual(response.status_code, 200)
+        content = (b''.join(response.streaming_content) if response.streaming
+                   else response.content)
+        return ElementTree.fromstring(content)
+
+    def test_feeds_list_published_posts_newest_first(self):
+        rss = self.read(self.client.get(reverse('rss_feed')))
+        self.assertEqual([item.findtext('title') for item in rss.iter('item')],
+                         ['Feed 2 & more', 'Feed 1 & more', 'Feed 0 & more'])
+        self.assertEqual(rss.find('channel/item/link').text,
+                         'http://testserver/feed-2/')
+
+        atom = self.read(self.client.get(reverse('atom_feed')))
+        ns = {'atom': 'http://www.w3.org/2005/Atom'}
+        self.assertEqual(len(atom.findall('atom:entry', ns)), 3)
+        self.assertEqual(atom.find('atom:entry/atom:author/atom:name', ns).text, 'author')
+
+    def test_feed_is_streamed_once_then_cached(self):
+        first = self.client.get(reverse('rss_feed'))
+        self.assertTrue(first.streaming)
+        content = b''.join(first.streaming_content)
+        second = self.client.get(reverse('rss_feed'))
+        self.assertFalse(second.streaming)
+        self.assertEqual(second.content, content)
+        self.assertEqual(self.client.get(
+            reverse('rss_feed'), HTTP_IF_NONE_MATCH=second['ETag']).status_code, 304)
+
+        # a post change renews the "list" token, so the feed is rebuilt
+        post = Post.objects.get(slug='feed-0')
+        post.title = 'Renamed'
+        post.save()
+        self.assertIn(b'Renamed', b''.join(
+            self.client.get(reverse('rss_feed')).streaming_content))
+
+    def test_sitemap_shards_by_id_range(self):
+        ns = {'sm': 'http://www.sitemaps.org/schemas/sitemap/0.9'}
+        pks = sorted(Post.objects.filter(status=1).values_list('pk', flat=True))
+        with mock.patch('blog.feeds.SHARD_SIZE', 2):
+            index = self.read(self.client.get(reverse('sitemap')))
+            locations = [loc.text for loc in index.findall('sm:sitemap/sm:loc', ns)]
+            shards = sorted({(pk - 1) // 2 for pk in pks})
+            self.assertEqual(locations, [f'http://testserver/sitemap-{shard}.xml'
+                                         for shard in shards])
+            urls = []
+            for shard in shards:
+                urlset = self.read(self.client.get(reverse('sitemap_shard', args=[shard])))
+                urls += [loc.text for loc in urlset.findall('sm:url/sm:loc', ns)]
+        self.assertEqual(sorted(urls), [f'http://testserver/feed-{i}/' for i in range(3)])
+
+    def test_editing_a_post_rebuilds_only_its_shard(self):
+        url = reverse('sitemap_shard', args=[0])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Post.objects.filter(slug='feed-1').update(updated_on=timezone.now())
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get(reverse('sitemap_shard', args=[5])).status_code, 404)
+        self.assertIn('Sitemap: http://testserver/sitemap.xml',
+                      self.client.get(reverse('robots_txt')).content.decode())
+
+
+class RelatedPostTests(TestCase):
+
+    TOPICS = {
+        'django-views': ('Django class based views',
+                         '<p>Writing django views with generic class based views and templates.</p>'),
+        'django-models': ('Django models and queries',
+                          '<p>Django models, querysets, templates and views in practice.</p>'),
+        'django-forms': ('Django forms',
+                         '<p>Validating django forms and rendering them in templates.</p>'),
+        'sourdough': ('Baking sourdough bread',
+                      '<p>Flour, water, salt and a starter make sourdough bread.</p>'),
+        'rye': ('Rye bread at home',
+                '<p>Rye flour bread needs a starter, water and patience.</p>'),
+    }
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.author = User.objects.create_user('author', password='pw')
+        self.posts = {
+            slug: Post.objects.create(title=title, slug=slug, author=self.author,
+                                      content=content, status=1)
+            for slug, (title, content) in self.TOPICS.items()}
+
+    def related(self, slug):
+        return [post.slug for post in
+                related.related_posts(post__slug=slug)]
+
+    def test_build_command_finds_posts_on_the_same_topic(self):
+        out = StringIO()
+        call_command('build_related_posts', stdout=out)
+        self.assertIn('for 5 posts', out.getvalue())
+        self.assertEqual(self.related('sourdough'), ['rye'])
+        self.assertEqual(set(self.related('django-views')),
+                         {'django-models', 'django-forms'})
+        # best first
+        scores = list(RelatedPost.objects.filter(
+            post=self.posts['django-views']).values_list('score', flat=True))
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_saving_posts_keeps_the_lists_up_to_date(self):
+        # one indexing task per new published post
+        self.assertEqual(run_due_tasks(), 5)
+        self.assertEqual(self.related('rye'), ['sourdough'])
+
+        # a new post joins the lists it belongs in
+        Post.objects.create(title='Spelt bread', slug='spelt', author=self.author,
+                            content='<p>Spelt flour, water and a starter.</p>',
+                            status=1)
+        run_due_tasks()
+        self.assertIn('spelt', self.related('rye'))
+
+        # unpublishing takes it out of them again
+        spelt = Post.objects.get(slug='spelt')
+        spelt.status = 0
+        spelt.save()
+        run_due_tasks()
+        self.assertEqual(self.related('rye'), ['sourdough'])
+        self.assertFalse(RelatedPost.objects.filter(post=spelt).exists())
+
+        # saves that change no words queue nothing, and neither do drafts
+        spelt.excerpt = 'Still a draft'
+        spelt.save()
+        self.posts['rye'].save()
+        self.assertFalse(Task.objects.exists())
+
+        # deleting a post refreshes the lists that showed it
+        self.posts['sourdough'].delete()
+        self.assertEqual(run_due_tasks(), 1)
+        self.assertEqual(self.related('rye'), [])
+
+    def test_post_page_shows_the_related_posts(self):
+        call_command('build_related_posts', stdout=StringIO())
+        url = reverse('post_detail', args=['rye'])
+        # the list and its posts in one query
+        with self.assertNumQueries(QUERY_BUDGETS['post_detail']):
+            response = self.client.get(url)
+        self.assertContains(response, 'Related posts')
+        self.assertContains(response, reverse('post_detail', args=['sourdough']))
+
+        # rewriting the list changes the page's ETag
+        etag = response['ETag']
+        related.update_related_posts([self.posts['rye'].pk])
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(BLOG_RATE_LIMIT=True, BLOG_RATE_LIMIT_PROXIES=0, BLOG_RATE_LIMITS={
+    'like': {'user': '2/60', 'ip': '3/60'},
+    'comment': {'user': '1/60', 'ip': '5/60'},
+})
+class RateLimitTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user('reader', password='pw')
+        self.author = User.objects.create_user('author', password='pw')
+        self.post = Post.objects.create(title='Limited', slug='limited',
+                                        author=self.author, content='<p>Hi</p>',
+                                        status=1)
+        self.like_url = reverse('post_like', args=['limited'])
+        self.post_url = reverse('post_detail', args=['limited'])
+
+    def test_likes_are_limited_per_user_before_any_write(self):
+        self.client.force_login(self.user)
+        for _ in range(2):
+            self.assertEqual(self.client.post(self.like_url).status_code, 302)
+        # only the session is read (the db session backend); no user, no like
+        with self.assertNumQueries(1):
+            response = self.client.post(self.like_url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('error', response.json())
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertEqual(ratelimit.rejected_counts()[('like', 'user')], 1)
+
+        # another user on the same address still has their own limit, until
+        # the address's runs out
+        self.client.force_login(self.author)
+        self.assertEqual(self.client.post(self.like_url).status_code, 302)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.post(self.like_url).status_code, 429)
+        self.assertEqual(ratelimit.rejected_counts()[('like', 'ip')], 1)
+
+        out = StringIO()
+        call_command('rate_limit_stats', '--reset', stdout=out)
+        self.assertRegex(out.getvalue(), r'like\s+user\s+2/60\s+1')
+        self.assertEqual(ratelimit.rejected_counts()[('like', 'user')], 0)
+
+    def test_comments_are_limited(self):
+        self.client.force_login(self.user)
+        self.client.post(self.post_url, {'body': 'First'})
+        response = self.client.post(self.post_url, {'body': 'Second'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(list(Comment.objects.values_list('body', flat=True)), ['First'])
+
+    def test_addresses_behind_a_proxy_get_their_own_limits(self):
+        with self.settings(BLOG_RATE_LIMIT_PROXIES=1):
+            for _ in range(3):
+                self.client.post(self.like_url, HTTP_X_FORWARDED_FOR='spoofed, 10.0.0.1')
+            self.assertEqual(self.client.post(
+                self.like_url, HTTP_X_FORWARDED_FOR='10.0.0.1').status_code, 429)
+            self.assertEqual(self.client.post(
+                self.like_url, HTTP_X_FORWARDED_FOR='10.0.0.1, 10.0.0.2').status_code, 302)
+
+    def test_anonymous_writes_go_to_the_login_page(self):
+        response = self.client.post(self.like_url)
+        self.assertRedirects(response, f"{settings.LOGIN_URL}?next={self.post_url}",
+                             fetch_redirect_response=False)
+        response = self.client.post(self.like_url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 401)
+        response = self.client.post(self.post_url, {'body': 'Hello'})
+        self.assertRedirects(response, f"{settings.LOGIN_URL}?next={self.post_url}",
+                             fetch_redirect_response=False)
+        self.assertFalse(Post.likes.through.objects.exists())
+        self.assertFalse(Comment.objects.exists())
+
+    def test_earlier_requests_slide_out_of_the_window(self):
+        def count(now):
+            return ratelimit.count_request('like', 'user', 1, '2/10', now=now)[1]
+        self.assertEqual([count(now=0), count(now=1), count(now=2)], [0, 0, 8])
+        # half of the previous window still counts
+        self.assertEqual([count(now=15), count(now=15)], [0, 1])
+        self.assertEqual(count(now=25), 0)
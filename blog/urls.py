@@ -1,4 +1,6 @@
-from . import views
+from django.conf import settings
+
+from . import api, feeds, views
 # This line imports the path function from Django's URL handling module.
 from django.urls import path
 
@@ -6,9 +8,37 @@ from django.urls import path
 # you need to establish a clear connection between the project-level urls.py and
 # the app-level urls.py files. This connection is achieved by using the include()
 # function in the project-level urls.py.
+
+# With BLOG_ASYNC_VIEWS on (under ASGI), the post list, post pages and likes
+# are served by the async views in blog/async_views.py.
+if settings.BLOG_ASYNC_VIEWS:
+    from . import async_views
+    post_list = async_views.post_list
+    post_detail = async_views.post_detail
+    post_like = async_views.post_like
+else:
+    post_list = views.PostList.as_view()
+    post_detail = views.PostDetail.as_view()
+    post_like = views.PostLike.as_view()
+
 urlpatterns = [
     # because we're using class-based views we need to add the as_view method
-    path('', views.PostList.as_view(), name="home"),
+    # (done above, where the sync or async views are picked)
+    path('', post_list, name="home"),
+    # search/ has to come before <slug:slug>/, which would otherwise match it;
+    # "search" is therefore not allowed as a post's slug (RESERVED_SLUGS in
+    # blog/models.py)
+    path('search/', views.PostSearch.as_view(), name="post_search"),
+    # the read-only JSON API (blog/api.py)
+    path('api/posts/', api.post_list, name="api_post_list"),
+    path('api/posts/<slug:slug>/', api.post_detail, name="api_post_detail"),
+    path('api/posts/<slug:slug>/comments/', api.comment_list, name="api_comment_list"),
+    # feeds and sitemaps for readers and crawlers (blog/feeds.py)
+    path('feed/rss/', feeds.rss_feed, name="rss_feed"),
+    path('feed/atom/', feeds.atom_feed, name="atom_feed"),
+    path('sitemap.xml', feeds.sitemap_index, name="sitemap"),
+    path('sitemap-<int:shard>.xml', feeds.sitemap_shard, name="sitemap_shard"),
+    path('robots.txt', feeds.robots_txt, name="robots_txt"),
     # In the URL pattern <slug:slug>, the first instance of "slug" is a path converter,
     # and the second instance of "slug" is the name of the parameter that will be passed
     # to the view function.
@@ -25,7 +55,7 @@ urlpatterns = [
     # function.
     # The second slug in these angle brackets is a keyword name that matches the slug parameter
     # in the get method of the PostDetail class
-    path('<slug:slug>/', views.PostDetail.as_view(), name="post_detail"),
-    path('like/<slug:slug>', views.PostLike.as_view(), name='post_like')
+    path('<slug:slug>/', post_detail, name="post_detail"),
+    path('like/<slug:slug>', post_like, name='post_like')
 
 ]
@@ -1,11 +1,30 @@
+from functools import partial
+
 from django.shortcuts import render, get_object_or_404, reverse
 # importing a generic vie library
 # View class provided by Django, gives us more control over handling HTTP
 # methods like GET, POST, etc.
 from django.views import generic, View
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, JsonResponse, Http404
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.db.models import Exists, OuterRef
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from .models import Post
 from .forms import CommentForm
+from .pagination import paginate_by_cursor
+from .likes import toggle_like
+from .cache import AnonymousPageCacheMixin, post_scope
+from .search import search_posts
+from .tasks import enqueue
+from .stats import popular_posts, record_view
+from .related import related_posts
+from .ratelimit import rate_limit
+from .conditional import (
+    post_detail_etag, post_detail_last_modified,
+    post_list_etag, post_list_last_modified)
 
 # Create your views here.
 
@@ -13,7 +32,7 @@ from .forms import CommentForm
 # is a generic class-based view provided by Django for displaying a list of objects.
 
 
-class PostList(generic.ListView):
+class PostList(AnonymousPageCacheMixin, generic.ListView):
     # model = Post: This line specifies the model that the view will be working with.
     # In this case, it's the Post model. By setting the model attribute, you're telling
     # Django that the view is going to work with the Post model's data.
@@ -26,14 +45,65 @@ class PostList(generic.ListView):
     # This line defines the queryset that the view will use to fetch the data from the database.
     # The Post.objects part refers to the manager for the Post model, which provides methods for
     # querying the database.
-    queryset = Post.objects.filter(status=1).order_by('-created_on')
+
+    # select_related('author') joins the author row into the same query, so
+    # {{ post.author }} on each card doesn't cost an extra query. The cards
+    # show the stored post.like_count instead of counting likes, and
+    # defer() skips loading the (large) post body, its rendered HTML and its
+    # search entry, which the cards never show.
+    queryset = (
+        Post.objects.filter(status=1)
+        .select_related('author')
+        .defer('content', 'content_html', 'search_vector')
+        .order_by('-created_on', '-id')
+    )
     # template_name attribute is an attribute of the ListView class
     template_name = 'index.html'
     # paginate_by is also an attribute of the ListView class in Django.
     paginate_by = 6
 
+    # Conditional GET: if the browser's copy of this page is still current,
+    # answer 304 Not Modified without rendering it (see blog/conditional.py).
+    @method_decorator(condition(
+        etag_func=partial(post_list_etag, per_page=paginate_by),
+        last_modified_func=partial(post_list_last_modified, per_page=paginate_by)))
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    # With BLOG_CURSOR_PAGINATION switched on, pages are addressed by a
+    # ?cursor= key instead of ?page=N, which skips the COUNT(*) and the OFFSET
+    # scan (see blog/pagination.py).
+    def paginate_queryset(self, queryset, page_size):
+        if not settings.BLOG_CURSOR_PAGINATION:
+            return super().paginate_queryset(queryset, page_size)
+        return paginate_by_cursor(
+            queryset, page_size, self.request.GET.get('cursor'))
+
+    # Logged-out visitors get the list pages from the page cache (blog/cache.py).
+    # They are refreshed whenever any post, or its likes, change.
+    def get_page_cache_scopes(self):
+        return ['list']
+
+    # "Popular this week", ranked in the background (blog/stats.py)
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['popular_posts'] = popular_posts()
+        return context
+
+
+class PostDetail(AnonymousPageCacheMixin, View):
+    # Logged-out visitors get the page from the page cache (blog/cache.py). It
+    # is refreshed whenever this post, its comments or its likes change.
+    def get_page_cache_scopes(self):
+        return [post_scope(self.kwargs['slug'])]
+
+    # Views are counted in memory and saved in batches (blog/stats.py); this
+    # happens before the page cache, so cached pages are counted too.
+    def dispatch(self, request, *args, **kwargs):
+        if request.method == 'GET':
+            record_view(kwargs['slug'])
+        return super().dispatch(request, *args, **kwargs)
 
-class PostDetail(View):
     # In Django's class-based views, the method that corresponds to a specific HTTP
     # request type (such as GET, POST, etc.) is determined by the name of the method
 
@@ -42,87 +112,84 @@ class PostDetail(View):
     # The self parameter refers to the instance of the PostDetail class, and the request
     # parameter represents the incoming HTTP request.
 
+    # Conditional GET: the post's updated_on, its latest approved comment and
+    # its like count make a cheap ETag/Last-Modified. If the browser's copy is
+    # still current we answer 304 Not Modified and skip everything below
+    # (see blog/conditional.py).
+    @method_decorator(condition(etag_func=post_detail_etag,
+                                last_modified_func=post_detail_last_modified))
     def get(self, request, slug, *args, **kwargs):
-        # queryset is a variable that holds the initial queryset for retrieving posts from
-        # the database. In this line, you're creating a queryset that filters the Post model
-        # to include only those posts with a status value of 1
-        queryset = Post.objects.filter(status=1)
-        # Here we use this queryset to fetch a specific post based on the slug parameter:
-        # This queryset is used to retrieve the specific post using the get_object_or_404
-        # function, which returns a post with the provided slug or raises a 404 error if
-        # the post is not found
-
-        # Here, the post variable holds the instance of the Post model that matches the provided
-        # slug. Once you have this post instance, you can access its attributes (fields) in the
-        # template using the dot notation
-        post = get_object_or_404(queryset, slug=slug)
-        # After obtaining the post, the comments associated with the post are filtered to
-        # include only approved comments (those with approved=True) and ordered by their
-        # creation date
-        comments = post.comments.filter(approved=True).order_by('created_on')
-        # The code checks whether the currently logged-in user (if any) has liked the post.
-        # If the user's ID exists in the post's likes queryset, it means they have liked the
-        # post
-        liked = False
-        if post.likes.filter(id=self.request.user.id).exists():
-            liked = True
-        # The template is rendered with the post object, the filtered comments queryset, and a
+        # The template is rendered with the post object, its approved comments, and a
         # boolean liked variable that indicates whether the logged-in user has liked the post
-        return render(
-            request,
-            "post_detail.html",
-            {
-                "post": post,
-                "comments": comments,
-                # when a user visits the page to view a post, the "commented" context variable is set to False. This is because no comment has been submitted yet; the user is just viewing the post and its comments. This sets up the initial state of the variable when the page loads.
-                "commented": False,
-                "liked": liked,
-                # So with the form imported, we now  need to render it as part of our view.
-                # To do this, we can simply add it to our context:
-                "comment_form": CommentForm()
-            },
-        )
-
+        context = load_post_detail(request, slug)
+        # So with the form imported, we now  need to render it as part of our view.
+        # To do this, we can simply add it to our context:
+        context["comment_form"] = CommentForm()
+        return render(request, "post_detail.html", context)
+
+    # Rate limited per user and per IP before anything is read (blog/ratelimit.py).
+    @method_decorator(rate_limit('comment'))
     def post(self, request, slug, *args, **kwargs):
-        queryset = Post.objects.filter(status=1)
-        # retrieves the post based on the provided slug from the URL.
-        post = get_object_or_404(queryset, slug=slug)
-        # filters and orders the approved comments for the post.
-        comments = post.comments.filter(approved=True).order_by('-created_on')
-        liked = False
-        # checks whether the logged-in user has liked the post.
-        if post.likes.filter(id=self.request.user.id).exists():
-            liked = True
+        # the comment is saved under the user's name and email, so only
+        # logged-in users can comment (the form is only shown to them)
+        if not request.user.is_authenticated:
+            return redirect_to_login(reverse('post_detail', args=[slug]))
         # We need to get the  data from our form and assign it to a variable.
         # So I'm going to create a  new variable here called comment_form.
         comment_form = CommentForm(data=request.POST)
-        if comment_form.is_valid():
-            # checks if the submitted form data is valid. If it is, it sets the email and name
-            # fields of the comment instance to the user's email and username.
-            comment_form.instance.email = request.user.email
-            comment_form.instance.name = request.user.username
-            # It saves the comment instance with the post association.
-            comment = comment_form.save(commit=False)
-            comment.post=post
-            comment.save()
-        else:
-            # If the form data is not valid, it creates an empty comment_form to be rendered.
-            comment_form = CommentForm()
-
-        # renders the post_detail.html template with the updated context, including the comment form.
-        return render(
-            request,
-            "post_detail.html",
-            {
-                "post": post,
-                "comments": comments,
-                # after a user submits a comment, the "commented" context variable is set to True. This change in value indicates that a comment has been successfully submitted, and it allows you to show a message or modify the behavior of the template to reflect this state change.
-                "commented": True,
-                "comment_form": comment_form,
-                "liked": liked,
-
-            },
-        )
+        if not comment_form.is_valid():
+            # show the page again with the form's errors
+            context = load_post_detail(request, slug)
+            context["comment_form"] = comment_form
+            return render(request, "post_detail.html", context)
+
+        # Saving a comment only needs the post's id, not the post itself.
+        post_id = (Post.objects.filter(status=1, slug=slug)
+                   .values_list('id', flat=True).first())
+        if post_id is None:
+            raise Http404("No post matches the given slug.")
+        # it sets the email and name fields of the comment instance to the user's
+        # email and username, and saves it with the post association.
+        comment = comment_form.save(commit=False)
+        comment.email = request.user.email
+        comment.name = request.user.username
+        comment.user = request.user
+        comment.post_id = post_id
+        comment.save()
+        # spam checks, auto-approval and the author's notification happen in
+        # the background (blog/moderation.py), so the reader isn't kept waiting
+        enqueue('moderate_comments', comment_id=comment.pk)
+
+        # Post/Redirect/Get: instead of rendering the page in answer to the POST
+        # (which a browser refresh would submit again), redirect back to the post.
+        # The confirmation is shown on the next page as a flash message.
+        messages.success(request, "Your comment is awaiting approval")
+        return HttpResponseRedirect(reverse('post_detail', args=[slug]))
+
+
+def load_post_detail(request, slug):
+    # Everything post_detail.html shows, in three queries:
+    # 1. the post with its author joined in and, for a logged-in user, whether
+    #    they like it (an EXISTS subquery). The raw content is deferred: the
+    #    page shows the pre-rendered content_html instead.
+    # 2. the approved comments, oldest first, as a list - the template counts
+    #    them with |length instead of running another query.
+    # 3. the related posts, precomputed in the background (blog/related.py).
+    queryset = (Post.objects.filter(status=1)
+                .select_related('author')
+                .defer('content', 'search_vector'))
+    if request.user.is_authenticated:
+        queryset = queryset.annotate(liked=Exists(
+            Post.likes.through.objects.filter(
+                post_id=OuterRef('pk'), user_id=request.user.id)))
+    post = get_object_or_404(queryset, slug=slug)
+    comments = list(post.comments.filter(approved=True).order_by('created_on'))
+    return {
+        "post": post,
+        "comments": comments,
+        "related_posts": related_posts(post_id=post.pk),
+        "liked": getattr(post, 'liked', False),
+    }
 
 
 # This view specifically handles HTTP POST requests. It means that when a user interacts with the page to like or unlike a post, a POST request is sent to the server, and this view is responsible for processing that request.
@@ -131,17 +198,52 @@ class PostDetail(View):
 class PostLike(View):
     # The slug parameter in the post method indicates that the URL for this view includes a slug value,
     # which likely identifies the specific post being liked or unliked.
+    @method_decorator(rate_limit('like'))
     def post(self, request, slug):
-        # The view starts by checking whether the user has already liked the post. It does this by using the likes attribute of the post object and checking if the user's ID exists in the set of likes. This is done using the filter and exists methods.
-        post = get_object_or_404(Post, slug=slug)
-
-        if post.likes.filter(id=request.user.id).exists():
-            # If the user has already liked the post (post.likes.filter(id=request.user.id).exists() returns True), it means they want to unlike it. In that case, the user is removed from the list of likes using the remove method.
-            post.likes.remove(request.user)
-        else:
-            # If the user has not liked the post (post.likes.filter(id=request.user.id).exists() returns False), it means they want to like it. In this case, the user is added to the list of likes using the add method.
-            post.likes.add(request.user)
+        # a like belongs to a user; anonymous clicks get the login page (or a
+        # 401 for JavaScript) instead of a like with no user
+        if not request.user.is_authenticated:
+            if request.accepts('application/json') and not request.accepts('text/html'):
+                return JsonResponse({'error': "Log in to like posts."}, status=401)
+            return redirect_to_login(reverse('post_detail', args=[slug]))
+        # toggle_like (blog/likes.py) likes or unlikes the post in the database
+        # itself: it tries to delete the user's like and, if there was none,
+        # inserts it. The rows each statement touched tell us which happened,
+        # so two quick clicks can't race each other.
+        try:
+            liked = toggle_like(slug, request.user.id)
+        except Post.DoesNotExist:
+            raise Http404("No post matches the given slug.")
+
+        # A like button driven by JavaScript (fetch with Accept: application/json)
+        # gets the new state back as JSON, instead of being redirected to the
+        # whole post_detail page.
+        if request.accepts('application/json') and not request.accepts('text/html'):
+            like_count = Post.objects.filter(slug=slug).values_list(
+                'like_count', flat=True).first()
+            return JsonResponse({'liked': liked, 'like_count': like_count})
+
         # the view redirects the user to the post_detail page for the same post. This is achieved by using the HttpResponseRedirect class and the reverse function to generate the URL for the post_detail view, passing the slug as an argument.
         return HttpResponseRedirect(reverse('post_detail', args=[slug]))
 
 
+# Public search page: /search/?q=...
+class PostSearch(generic.ListView):
+    template_name = 'search.html'
+    paginate_by = 10
+
+    # The matching published posts, best match first. On PostgreSQL this is a
+    # ranked full-text search over the indexed search_vector column; elsewhere
+    # a simpler title/excerpt match (see blog/search.py).
+    def get_queryset(self):
+        posts = (
+            Post.objects.filter(status=1)
+            .select_related('author')
+            .defer('content', 'content_html', 'search_vector')
+        )
+        return search_posts(posts, self.request.GET.get('q', ''))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['q'] = self.request.GET.get('q', '').strip()
+        return context
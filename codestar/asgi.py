@@ -5,6 +5,16 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+
+Under ASGI, requests aren't tied to one thread, so per-thread persistent
+database connections are reused less. Set DATABASE_POOL_MAX_SIZE (see
+codestar/settings.py) to share a pool of PostgreSQL connections across the
+whole process instead.
+
+To serve the async views (BLOG_ASYNC_VIEWS=True, see blog/async_views.py),
+run gunicorn with uvicorn workers instead of the sync ones in the Procfile:
+
+    gunicorn codestar.asgi:application -k uvicorn.workers.UvicornWorker
 """
 
 import os
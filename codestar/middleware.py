@@ -0,0 +1,236 @@
+"""
+Project-wide middleware for codestar.
+"""
+import asyncio
+import json
+import logging
+import mimetypes
+import os
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.db import connections
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from . import routers, staticfiles, timing
+
+timing_logger = logging.getLogger('codestar.timing')
+
+
+class DatabaseHealthCheckMiddleware:
+    """
+    Checks that persistent database connections still work before a request
+    uses them.
+
+    With CONN_MAX_AGE > 0 a connection is reused across requests, and may
+    have been dropped by the server (restart, failover, idle timeout) since
+    the last one. Without a check, the first query of the next request fails
+    with a 500. Here every connection left open by an earlier request is
+    pinged first, and closed if it's dead, so Django opens a fresh one on
+    first use. (Django 4.1+ has this built in as CONN_HEALTH_CHECKS.)
+
+    Only added to MIDDLEWARE when DATABASE_CONN_HEALTH_CHECKS is on.
+
+    It works both ways, like Django's own middleware: a sync-only middleware
+    at the top of the stack would make Django run everything below it,
+    async views included, on the one thread sync code shares under ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        self.check_connections()
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        # the connections sync views use under ASGI live on that shared thread
+        await sync_to_async(self.check_connections)()
+        return await self.get_response(request)
+
+    @staticmethod
+    def check_connections():
+        for connection in connections.all():
+            if (connection.connection is not None
+                    and not connection.in_atomic_block
+                    and not connection.is_usable()):
+                connection.close()
+
+
+class ReplicaPinningMiddleware:
+    """
+    Read-your-writes for the read replica router (codestar/routers.py).
+
+    A request that wrote to the database gets a short-lived cookie, and
+    requests carrying it read from the primary instead of a replica until
+    it expires, by which time the replicas have caught up. Using a cookie
+    rather than the session means anonymous readers never need a session.
+
+    Only added to MIDDLEWARE when read replicas are configured.
+    """
+
+    cookie_name = 'pin_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        tokens = routers.start_request(self.cookie_name in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = routers.end_request(tokens)
+        if wrote:
+            response.set_cookie(
+                self.cookie_name, '1',
+                max_age=settings.DATABASE_REPLICA_PIN_SECONDS,
+                httponly=True, samesite='Lax')
+        return response
+
+
+class RequestTimingMiddleware:
+    """
+    Records how long each request spent in SQL queries, template rendering
+    and overall (see codestar/timing.py).
+
+    The numbers go out as a Server-Timing header and a JSON log line on the
+    "codestar.timing" logger. Requests slower than
+    BLOG_REQUEST_TIMING_SLOW_MS are logged as warnings together with their
+    slowest SQL statements.
+
+    Only added to MIDDLEWARE when BLOG_REQUEST_TIMING is on, so it costs
+    nothing otherwise. It is the outermost middleware, so it works both ways
+    (see DatabaseHealthCheckMiddleware).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        timing.install_template_timing()
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        timer = timing.RequestTimer()
+        response = timer.measure(self.get_response, request)
+        return self.report(request, response, timer)
+
+    async def __acall__(self, request):
+        timer = timing.RequestTimer()
+        response = await timer.ameasure(self.get_response, request)
+        return self.report(request, response, timer)
+
+    @staticmethod
+    def report(request, response, timer):
+        response['Server-Timing'] = timer.server_timing()
+
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(timer.total_time * 1000, 2),
+            'sql_ms': round(timer.sql_time * 1000, 2),
+            'queries': timer.query_count,
+            'template_ms': round(timer.template_time * 1000, 2),
+        }
+        if record['total_ms'] >= settings.BLOG_REQUEST_TIMING_SLOW_MS:
+            record['slowest_queries'] = timer.slowest_queries
+            timing_logger.warning(json.dumps(record))
+        else:
+            timing_logger.info(json.dumps(record))
+        return response
+
+
+class StaticFilesMiddleware:
+    """
+    Serves STATIC_URL from STATIC_ROOT, for STATIC_FILES = "local" (see
+    codestar/staticfiles.py).
+
+    Each file is sent as its brotli or gzip copy when the browser accepts
+    one (Accept-Encoding), as is otherwise. Hashed names from the manifest
+    never change content, so they are cached for a year and marked
+    immutable: browsers don't even revalidate them. Anything else gets a
+    short max-age and a Last-Modified.
+
+    Files are indexed when the process starts, so run collectstatic first
+    (Heroku does it during the build). It sits near the top of MIDDLEWARE:
+    static requests don't need sessions, users or the database.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    immutable = 'public, max-age=31536000, immutable'
+    mutable = 'public, max-age=60'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        self.prefix = settings.STATIC_URL
+        self.files = staticfiles.index_static_root(settings.STATIC_ROOT)
+        self.hashed = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.serve(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.serve(request) or await self.get_response(request)
+
+    def serve(self, request):
+        # The response for a static file, or None to pass the request on.
+        if (request.method not in ('GET', 'HEAD')
+                or not request.path_info.startswith(self.prefix)):
+            return None
+        name = request.path_info[len(self.prefix):]
+        # only names from the index are served, so "../" can't escape it
+        variants = self.files.get(name)
+        if variants is None:
+            return None
+
+        accepted = staticfiles.accepted_encodings(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        encoding = next((encoding for _, encoding in staticfiles.ENCODINGS
+                         if encoding in variants and encoding in accepted), '')
+        path, size = variants[encoding]
+        last_modified = int(os.path.getmtime(path))
+        etag = f'"{last_modified:x}-{size:x}{"-" + encoding if encoding else ""}"'
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            if request.method == 'HEAD':
+                response = HttpResponse()
+            else:
+                response = FileResponse(open(path, 'rb'))
+                # inline, under its own name - not the .br/.gz file's
+                del response['Content-Disposition']
+            # the type of the original, not of the .br/.gz file
+            response['Content-Type'] = (mimetypes.guess_type(name)[0]
+                                        or 'application/octet-stream')
+            response['Content-Length'] = size
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = (self.immutable if name in self.hashed
+                                     else self.mutable)
+        if len(variants) > 1:
+            patch_vary_headers(response, ('Accept-Encoding',))
+        return response
@@ -0,0 +1,152 @@
+"""
+PostgreSQL database backend with an in-process connection pool.
+
+Django's own backend opens a new connection whenever a thread needs one and
+closes it again after the request (or after CONN_MAX_AGE). Under ASGI each
+request can run on a different thread, so persistent connections help little
+there. This backend keeps a ConnectionPool per database alias, shared by all
+threads of the process: "connecting" takes an idle connection out of the pool
+and "closing" hands it back, still open.
+
+Enabled from codestar/settings.py with DATABASE_POOL_MAX_SIZE, e.g.:
+
+    DATABASES['default']['ENGINE'] = 'codestar.postgresql_pool'
+    DATABASES['default']['POOL'] = {'MIN_SIZE': 1, 'MAX_SIZE': 10, 'TIMEOUT': 30}
+
+When all MAX_SIZE connections are in use, a thread that needs one waits up to
+TIMEOUT seconds for another thread to hand one back, and only then fails with
+an OperationalError. (psycopg2's own pools fail straight away, and close every
+connection handed back beyond their MIN_SIZE.)
+"""
+import threading
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+from django.db.backends.postgresql import base
+
+
+class ConnectionPool:
+    """
+    Up to max_size connections to one database, shared between threads.
+
+    Connections are checked when they are taken out of the pool: one the
+    server dropped while it sat idle (restart, failover, idle timeout) fails
+    a "SELECT 1" and is replaced by a new one, so the first query of a
+    request doesn't fail with it. Connections handed back with a transaction
+    still open are rolled back; ones that can't be, or that the caller says
+    are broken, are closed instead of being reused.
+    """
+
+    def __init__(self, conn_params, min_size=1, max_size=10, timeout=30):
+        self.conn_params = conn_params
+        self.timeout = timeout
+        # one slot per connection in use; getconn() waits for a free one
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._idle = [self._connect() for _ in range(min_size)]
+
+    def _connect(self):
+        return psycopg2.connect(**self.conn_params)
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise psycopg2.OperationalError(
+                f"No pooled database connection became free within "
+                f"{self.timeout} seconds; raise DATABASE_POOL_MAX_SIZE.")
+        try:
+            while True:
+                with self._lock:
+                    connection = self._idle.pop() if self._idle else None
+                if connection is None:
+                    return self._connect()
+                if self._is_usable(connection):
+                    return connection
+                self._discard(connection)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, connection, close=False):
+        try:
+            if close or not self._reset(connection):
+                self._discard(connection)
+            else:
+                with self._lock:
+                    self._idle.append(connection)
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _is_usable(connection):
+        if connection.closed:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                # the ping opened a transaction
+                connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    @staticmethod
+    def _reset(connection):
+        # True if the connection is fit to be handed out again
+        if connection.closed:
+            return False
+        status = connection.get_transaction_status()
+        if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    @staticmethod
+    def _discard(connection):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def _get_pool(self, conn_params):
+        with self._pools_lock:
+            if self.alias not in self._pools:
+                options = self.settings_dict.get('POOL', {})
+                self._pools[self.alias] = ConnectionPool(
+                    conn_params, options.get('MIN_SIZE', 1),
+                    options.get('MAX_SIZE', 10), options.get('TIMEOUT', 30))
+            return self._pools[self.alias]
+
+    def get_new_connection(self, conn_params):
+        pool = self._get_pool(conn_params)
+        connection = pool.getconn()
+        try:
+            options = self.settings_dict['OPTIONS']
+            self.isolation_level = options.get(
+                'isolation_level', connection.isolation_level)
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+            psycopg2.extras.register_default_jsonb(
+                conn_or_curs=connection, loads=lambda x: x)
+        except BaseException:
+            pool.putconn(connection, close=True)
+            raise
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        with self.wrap_database_errors:
+            # after an error, only reuse the connection if it still answers
+            broken = self.errors_occurred and not self.is_usable()
+            self._pools[self.alias].putconn(self.connection, close=broken)
@@ -0,0 +1,86 @@
+"""
+Database router sending reads to read replicas.
+
+When DATABASE_REPLICA_URLS is set (see codestar/settings.py), reads of the
+models in DATABASE_REPLICA_MODELS (the blog's posts, comments and likes) are
+spread over the replicas, and everything else - all writes, and reads of
+other models such as the task queue, auth and sessions - goes to the primary
+('default') database. The task worker in particular re-reads the tasks it has
+just claimed, which a lagging replica may not show yet.
+
+Replicas lag slightly behind the primary, so someone who just wrote something
+(a comment, a like) could read the page before their change has arrived
+there. To avoid that, a request that writes is "pinned" to the primary for
+the rest of the request, and ReplicaPinningMiddleware
+(codestar/middleware.py) keeps the same client pinned for
+DATABASE_REPLICA_PIN_SECONDS afterwards with a short-lived cookie.
+
+Only requests read from the replicas. Outside a request (the task worker,
+management commands, signal handlers running after the response) every read
+goes to the primary: that code acts on rows that were just committed (the
+worker moderates a comment saved a moment ago) and writes based on what it
+reads (counter updates), so it can't work from a copy that lags behind.
+A request can also ask for the primary with use_primary(), as the page
+cache does while it renders a page to store (blog/cache.py).
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# per request (and safe for threads and async tasks alike)
+_pinned = ContextVar('pinned_to_primary', default=False)
+_wrote = ContextVar('wrote_to_primary', default=False)
+_in_request = ContextVar('in_request', default=False)
+
+
+def start_request(pinned):
+    # Called at the start of each request. Returns tokens for end_request().
+    return _pinned.set(pinned), _wrote.set(False), _in_request.set(True)
+
+
+def end_request(tokens):
+    # Resets the request's state. Returns whether the request wrote anything.
+    wrote = _wrote.get()
+    _pinned.reset(tokens[0])
+    _wrote.reset(tokens[1])
+    _in_request.reset(tokens[2])
+    return wrote
+
+
+@contextmanager
+def use_primary():
+    # reads inside the block go to the primary
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+        if _wrote.get():
+            # a write inside the block pins the rest of the request
+            _pinned.set(True)
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if (not _in_request.get() or _pinned.get() or not settings.DATABASE_REPLICAS
+                or model._meta.label_lower not in settings.DATABASE_REPLICA_MODELS):
+            return 'default'
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        if _in_request.get():
+            # read our own writes for the rest of this request
+            _pinned.set(True)
+            _wrote.set(True)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # primary and replicas hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get their schema by replication from the primary
+        return db == 'default'
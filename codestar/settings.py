@@ -15,6 +15,7 @@ from pathlib import Path
 # hiding sensitive data:
 import os
 import os.path
+import sys
 from dotenv import load_dotenv
 from django.contrib.messages import constants as messages
 import dj_database_url
@@ -33,6 +34,20 @@ load_dotenv()
 # the email verification step. Users will be able to sign up and use the application
 # immediately without needing to verify their email address.
 ACCOUNT_EMAIL_VERIFICATION = 'none'
+
+# Outgoing email, used for the comment notifications sent to post authors by
+# the background worker (blog/moderation.py). Without EMAIL_HOST the emails
+# are only printed to the worker's console.
+if os.environ.get("EMAIL_HOST"):
+    EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+    EMAIL_HOST = os.environ.get("EMAIL_HOST")
+    EMAIL_PORT = int(os.environ.get("EMAIL_PORT", 587))
+    EMAIL_HOST_USER = os.environ.get("EMAIL_HOST_USER", "")
+    EMAIL_HOST_PASSWORD = os.environ.get("EMAIL_HOST_PASSWORD", "")
+    EMAIL_USE_TLS = True
+else:
+    EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+DEFAULT_FROM_EMAIL = os.environ.get("DEFAULT_FROM_EMAIL", "webmaster@localhost")
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -52,6 +67,9 @@ SECRET_KEY = os.environ.get("SECRET_KEY")
 
 DEBUG = False
 
+# True while `python manage.py test` runs
+TESTING = sys.argv[1:2] == ['test']
+
 X_FRAME_OPTIONS = 'SAMEORIGIN'
 
 ALLOWED_HOSTS = [
@@ -101,6 +119,11 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 SITE_ID = 1
 
+# Opt-in keyset pagination for the home page post list. When "True", the
+# PREV/NEXT links use ?cursor= keys instead of ?page= numbers, so deep pages
+# cost the same as the first one.
+BLOG_CURSOR_PAGINATION = os.environ.get("BLOG_CURSOR_PAGINATION", "False") == "True"
+
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 
@@ -146,9 +169,204 @@ WSGI_APPLICATION = 'codestar.wsgi.application'
 #     }
 # }
 
+# Persistent connections: instead of opening a new database connection for
+# every request and closing it afterwards, each gunicorn worker keeps its
+# connection open for up to DATABASE_CONN_MAX_AGE seconds (0 = close after
+# every request, like before). Reused connections are checked with a cheap
+# ping at the start of each request (codestar/middleware.py), so one dropped
+# by the server is replaced instead of failing the request.
+DATABASE_CONN_MAX_AGE = int(os.environ.get("DATABASE_CONN_MAX_AGE", 600))
+DATABASE_CONN_HEALTH_CHECKS = os.environ.get("DATABASE_CONN_HEALTH_CHECKS", "True") == "True"
+
 DATABASES = {
-    'default': dj_database_url.parse(os.environ.get("DATABASE_URL"))
+    'default': dj_database_url.parse(
+        os.environ.get("DATABASE_URL"), conn_max_age=DATABASE_CONN_MAX_AGE)
+}
+
+# Optional in-process connection pool for PostgreSQL, meant for the ASGI
+# deployment (codestar/asgi.py), where requests don't stick to one thread and
+# per-thread persistent connections don't help much. Set
+# DATABASE_POOL_MAX_SIZE to the number of connections a process may hold.
+# The async views (BLOG_ASYNC_VIEWS) run up to four queries of a request at
+# once, each on its own connection, so allow for about four per request the
+# worker serves concurrently. When every connection is busy a query waits up
+# to DATABASE_POOL_TIMEOUT seconds for one to come back before it fails.
+DATABASE_POOL_MAX_SIZE = int(os.environ.get("DATABASE_POOL_MAX_SIZE", 0))
+if DATABASE_POOL_MAX_SIZE and 'postgresql' in DATABASES['default']['ENGINE']:
+    DATABASES['default'].update({
+        'ENGINE': 'codestar.postgresql_pool',
+        # "closing" a pooled connection returns it to the pool, so do it
+        # after every request
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'MIN_SIZE': int(os.environ.get("DATABASE_POOL_MIN_SIZE", 1)),
+            'MAX_SIZE': DATABASE_POOL_MAX_SIZE,
+            'TIMEOUT': float(os.environ.get("DATABASE_POOL_TIMEOUT", 30)),
+        },
+    })
+
+# Optional read replicas: a comma separated list of database URLs. Reads of
+# the blog's models are spread over them and everything else goes to the
+# primary (see codestar/routers.py). After a client writes something (a
+# comment, a like) it reads from the primary for DATABASE_REPLICA_PIN_SECONDS,
+# so it sees its own change even if the replicas lag behind.
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",")
+    if url.strip()]
+# only what the pages read; the task queue and stats tables stay on the primary
+DATABASE_REPLICA_MODELS = ['blog.post', 'blog.comment', 'blog.post_likes']
+DATABASE_REPLICA_PIN_SECONDS = int(os.environ.get("DATABASE_REPLICA_PIN_SECONDS", 10))
+DATABASE_REPLICAS = []
+for index, url in enumerate(DATABASE_REPLICA_URLS):
+    alias = f'replica_{index}'
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=DATABASE_CONN_MAX_AGE)
+    # in tests a replica would just be a second connection to the test
+    # database, which can't see the test's uncommitted rows - run the test
+    # suite without DATABASE_REPLICA_URLS
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+if TESTING and not DATABASE_REPLICAS:
+    # a mirror of the test database for the router's tests, which turn the
+    # router on themselves (blog/tests.py ReplicaDatabaseTests)
+    DATABASES['replica_test'] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+if DATABASE_REPLICAS:
+    DATABASE_ROUTERS = ['codestar.routers.PrimaryReplicaRouter']
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index('django.contrib.sessions.middleware.SessionMiddleware'),
+        'codestar.middleware.ReplicaPinningMiddleware')
+
+# ping reused database connections before each request
+if DATABASE_CONN_HEALTH_CHECKS and DATABASES['default']['CONN_MAX_AGE']:
+    MIDDLEWARE.insert(0, 'codestar.middleware.DatabaseHealthCheckMiddleware')
+
+# ==================================================
+# Cache
+# Redis when REDIS_URL is set (e.g. by the Heroku Redis add-on), a file based
+# cache when CACHE_DIR is set, and otherwise an in-process memory cache.
+# The memory cache is private to each gunicorn worker, so anything that must be
+# shared between workers (like the page cache invalidation) needs one of the
+# other two in production.
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.environ.get("REDIS_URL"),
+        }
+    }
+elif os.environ.get("CACHE_DIR"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get("CACHE_DIR"),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# ==================================================
+# Sessions
+# SESSION_BACKEND picks where sessions are kept:
+#   "db"             - Django's default, the django_session table, read on
+#                      every request that carries a session cookie.
+#   "cached_db"      - the same table, but read through the cache above; the
+#                      database is only read on a cache miss and written on
+#                      login, logout and other session changes.
+#   "signed_cookies" - in the (signed, not encrypted) cookie itself; the
+#                      database isn't involved at all. A stolen cookie stays
+#                      valid until it expires, even after logout.
+# cached_db is the default when Redis is configured. With the per-worker
+# memory cache one worker could keep serving a session another has already
+# logged out, so there the default stays "db".
+# Whatever the backend, a reader who has never logged in has no session
+# cookie, so the blog pages don't load a session for them at all.
+# Expired sessions are deleted by `python manage.py clear_expired_sessions`
+# (run it daily, e.g. from Heroku Scheduler).
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_BACKEND = os.environ.get(
+    "SESSION_BACKEND", "cached_db" if os.environ.get("REDIS_URL") else "db")
+SESSION_ENGINE = SESSION_ENGINES[SESSION_BACKEND]
+SESSION_CACHE_ALIAS = 'default'
+
+# Full-page cache of PostList and PostDetail for logged-out visitors
+# (see blog/cache.py). Pages are refreshed as soon as a post, comment or like
+# changes; the timeouts below only bound how long an unchanged page is kept
+# and how long an outdated copy may still be served while a fresh one is being
+# rendered.
+BLOG_PAGE_CACHE = os.environ.get("BLOG_PAGE_CACHE", "False") == "True"
+BLOG_PAGE_CACHE_TIMEOUT = int(os.environ.get("BLOG_PAGE_CACHE_TIMEOUT", 600))
+BLOG_PAGE_CACHE_STALE_TIMEOUT = int(os.environ.get("BLOG_PAGE_CACHE_STALE_TIMEOUT", 3600))
+
+# Post view counts (blog/stats.py): each process counts views in memory and
+# writes them to the PostStats table every BLOG_VIEW_FLUSH_INTERVAL seconds
+# or BLOG_VIEW_FLUSH_SIZE views, whichever comes first. The "popular this
+# week" list on the home page is re-ranked at most every
+# BLOG_POPULAR_REFRESH seconds and kept in the cache.
+BLOG_VIEW_COUNTER = os.environ.get("BLOG_VIEW_COUNTER", "True") == "True"
+BLOG_VIEW_FLUSH_INTERVAL = float(os.environ.get("BLOG_VIEW_FLUSH_INTERVAL", 10))
+BLOG_VIEW_FLUSH_SIZE = int(os.environ.get("BLOG_VIEW_FLUSH_SIZE", 1000))
+BLOG_POPULAR_REFRESH = int(os.environ.get("BLOG_POPULAR_REFRESH", 300))
+
+# Rate limits for liking posts and posting comments (blog/ratelimit.py), as
+# "requests/seconds": at most that many requests in any window of that many
+# seconds. Each action is limited per logged-in user and per IP address;
+# excess requests get a 429 before the view runs any query. The counters are
+# kept in the cache, so like the page cache they need Redis to be shared
+# between workers. Off while the tests run, so that counts don't carry over
+# from one test to the next; RateLimitTests turns it on.
+BLOG_RATE_LIMIT = (os.environ.get("BLOG_RATE_LIMIT", "True") == "True"
+                   and not TESTING)
+BLOG_RATE_LIMITS = {
+    'like': {
+        'user': os.environ.get("BLOG_RATE_LIMIT_LIKE_USER", "30/60"),
+        'ip': os.environ.get("BLOG_RATE_LIMIT_LIKE_IP", "120/60"),
+    },
+    'comment': {
+        'user': os.environ.get("BLOG_RATE_LIMIT_COMMENT_USER", "5/60"),
+        'ip': os.environ.get("BLOG_RATE_LIMIT_COMMENT_IP", "20/60"),
+    },
 }
+# The number of proxies in front of the app that add the client's address to
+# X-Forwarded-For. On Heroku (which sets DYNO) that's its router; without
+# it every request would seem to come from the router's address.
+BLOG_RATE_LIMIT_PROXIES = int(os.environ.get(
+    "BLOG_RATE_LIMIT_PROXIES", 1 if os.environ.get("DYNO") else 0))
+
+# Serve the post list, post pages and likes with the async views in
+# blog/async_views.py, which run a page's independent queries concurrently.
+# Only worth it under ASGI, e.g. with uvicorn workers (see codestar/asgi.py);
+# under WSGI every request would need its own event loop. Keep the
+# middleware async-capable (like codestar.middleware's health check): a
+# sync-only one makes Django run the views below it on a single thread.
+# ReplicaPinningMiddleware is still sync-only.
+BLOG_ASYNC_VIEWS = os.environ.get("BLOG_ASYNC_VIEWS", "False") == "True"
+
+# Per-request instrumentation (codestar/timing.py): query count, SQL time,
+# template time and total time of every request, sent back as a
+# Server-Timing header and logged as one JSON line on the "codestar.timing"
+# logger. Requests slower than BLOG_REQUEST_TIMING_SLOW_MS are logged as
+# warnings with their slowest SQL statements. Off by default; when off the
+# middleware isn't installed at all.
+BLOG_REQUEST_TIMING = os.environ.get("BLOG_REQUEST_TIMING", "False") == "True"
+BLOG_REQUEST_TIMING_SLOW_MS = float(os.environ.get("BLOG_REQUEST_TIMING_SLOW_MS", 500))
+if BLOG_REQUEST_TIMING:
+    # outermost, so the total includes all the other middleware
+    MIDDLEWARE.insert(0, 'codestar.middleware.RequestTimingMiddleware')
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'handlers': {'console': {'class': 'logging.StreamHandler'}},
+        'loggers': {
+            'codestar.timing': {'handlers': ['console'], 'level': 'INFO'},
+        },
+    }
 
 # ==================================================
 # Password validation
@@ -204,6 +422,43 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
 
+# Local stand-in for Cloudinary, for working (and benchmarking) offline:
+# static and uploaded files are stored on disk, and image URLs are still
+# built the Cloudinary way - which happens locally anyway - for a fake
+# "local" cloud, so no CLOUDINARY_URL is needed and nothing is uploaded.
+CLOUDINARY_OFFLINE = os.environ.get("CLOUDINARY_OFFLINE", "False") == "True"
+if CLOUDINARY_OFFLINE:
+    CLOUDINARY_STORAGE = {
+        'CLOUD_NAME': 'local', 'API_KEY': 'local', 'API_SECRET': 'local'}
+    STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+    DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
+    MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+    import cloudinary
+    cloudinary.config(cloud_name='local', api_key='local', api_secret='local')
+
+# Where static files are served from:
+#   "cloudinary" - uploaded to Cloudinary by collectstatic and served from its
+#                  CDN (StaticHashedCloudinaryStorage above).
+#   "local"      - collected into STATIC_ROOT with content-hashed names and
+#                  precompressed brotli/gzip copies, and served by the app
+#                  itself (codestar/staticfiles.py, StaticFilesMiddleware) with
+#                  year-long immutable cache headers. Deploys don't upload
+#                  anything. `python manage.py bench_static` compares the two.
+STATIC_FILES = os.environ.get("STATIC_FILES", "cloudinary")
+if STATIC_FILES == 'local':
+    STATICFILES_STORAGE = 'codestar.staticfiles.CompressedManifestStaticFilesStorage'
+    # cloudinary_storage's own collectstatic, which only uploads to
+    # Cloudinary, wins if it's listed first; Django's is needed here
+    INSTALLED_APPS.remove('cloudinary_storage')
+    INSTALLED_APPS.insert(INSTALLED_APPS.index('django.contrib.staticfiles') + 1,
+                          'cloudinary_storage')
+    MIDDLEWARE.insert(MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1,
+                      'codestar.middleware.StaticFilesMiddleware')
+
+# Builds the featured image URLs stored on each post (blog/images.py).
+BLOG_IMAGE_URL_BUILDER = ('blog.images.local_image_url' if CLOUDINARY_OFFLINE
+                          else 'blog.images.cloudinary_image_url')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
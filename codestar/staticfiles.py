@@ -0,0 +1,114 @@
+"""
+Static files served by the app itself, for STATIC_FILES = "local" (see
+codestar/settings.py).
+
+CompressedManifestStaticFilesStorage is Django's ManifestStaticFilesStorage -
+file names carry a hash of their contents (css/style.3f2a....css) and
+staticfiles.json maps the original names to the hashed ones - which, at
+collectstatic time, also writes a gzip (.gz) and, if the Brotli package is
+installed, a brotli (.br) copy of every hashed text file. Serving them is then
+just picking a file; nothing is compressed per request.
+
+StaticFilesMiddleware (codestar/middleware.py) does the serving.
+"""
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip copies are made
+    brotli = None
+
+# images, fonts and archives are compressed already
+COMPRESSIBLE = ('.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt',
+                '.html', '.xml', '.ico', '.eot', '.ttf', '.otf')
+# smaller files gain nothing from it
+MIN_SIZE = 256
+# a compressed copy must save at least 5% to be worth serving
+MAX_RATIO = 0.95
+
+# extension and Content-Encoding of each variant, most preferred first
+ENCODINGS = (('.br', 'br'), ('.gz', 'gzip'))
+
+
+def compressors():
+    # (extension, compress function) for the formats available here
+    available = []
+    if brotli is not None:
+        available.append(('.br', lambda data: brotli.compress(data, quality=11)))
+    # mtime=0 so rebuilding gives byte-identical files
+    available.append(('.gz', lambda data: gzip.compress(data, 9, mtime=0)))
+    return available
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in set(self.hashed_files.values()):
+            self.compress(name)
+
+    def compress(self, name):
+        # Hashed names change with the content, so a copy that already exists
+        # is up to date and redeploys only compress what changed.
+        if not name.endswith(COMPRESSIBLE):
+            return
+        pending = [(ext, func) for ext, func in compressors()
+                   if not self.exists(name + ext)]
+        if not pending:
+            return
+        with self.open(name) as original:
+            data = original.read()
+        if len(data) < MIN_SIZE:
+            return
+        for ext, func in pending:
+            compressed = func(data)
+            if len(compressed) <= len(data) * MAX_RATIO:
+                self._save(name + ext, ContentFile(compressed))
+
+
+def index_static_root(root):
+    # {url path: {encoding or '': (file path, size)}} for every file under
+    # root, built once when the middleware starts (collectstatic has run by
+    # then), so serving a request never touches the disk except to read
+    # the file itself.
+    index = {}
+    for directory, _, files in os.walk(root):
+        for filename in files:
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, root).replace(os.sep, '/')
+            encoding = ''
+            for ext, content_encoding in ENCODINGS:
+                if name.endswith(ext):
+                    name, encoding = name[:-len(ext)], content_encoding
+                    break
+            index.setdefault(name, {})[encoding] = (path, os.path.getsize(path))
+    # a lone foo.gz (with no foo next to it) is a file of its own
+    for name in [name for name, variants in index.items() if '' not in variants]:
+        for ext, encoding in ENCODINGS:
+            if encoding in index[name]:
+                index[name + ext] = {'': index[name].pop(encoding)}
+        del index[name]
+    return index
+
+
+def accepted_encodings(header):
+    # the encodings an Accept-Encoding header allows (q > 0)
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
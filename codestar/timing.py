@@ -0,0 +1,128 @@
+"""
+Per-request timing, for RequestTimingMiddleware (codestar/middleware.py).
+
+A RequestTimer collects, for one request:
+
+  * the number of SQL queries and the time spent running them, through a
+    database execute wrapper on every connection;
+  * the time spent rendering templates, through a wrapper around Django's
+    template backend (installed once, the first time timing is switched on).
+    Querysets evaluated lazily inside a template count towards both;
+  * the SLOW_QUERY_SAMPLE slowest statements, kept so a slow request can be
+    logged together with the SQL that made it slow.
+
+Nothing is patched unless BLOG_REQUEST_TIMING is on.
+"""
+import heapq
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.template.backends.django import Template
+
+SLOW_QUERY_SAMPLE = 5
+
+_current = ContextVar('request_timer', default=None)
+
+
+class RequestTimer:
+
+    def __init__(self):
+        self.query_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.total_time = 0.0
+        # (duration, sql) of the slowest queries, smallest first
+        self._slowest = []
+
+    def __call__(self, execute, sql, params, many, context):
+        # a database execute wrapper
+        if _current.get() is not self:
+            # another request's query, on a connection shared under ASGI
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.query_count += 1
+            self.sql_time += duration
+            if len(self._slowest) < SLOW_QUERY_SAMPLE:
+                heapq.heappush(self._slowest, (duration, sql))
+            elif duration > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, (duration, sql))
+
+    @property
+    def slowest_queries(self):
+        return [{'ms': round(duration * 1000, 2), 'sql': sql}
+                for duration, sql in sorted(self._slowest, reverse=True)]
+
+    def measure(self, func, *args, **kwargs):
+        # Runs func with timing on and returns its result.
+        token = _current.set(self)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(self))
+                return func(*args, **kwargs)
+        finally:
+            self.total_time = time.perf_counter() - start
+            _current.reset(token)
+
+    async def ameasure(self, func, *args, **kwargs):
+        # The same for a coroutine function. Database connections belong to
+        # a thread, and an async request's queries run on the thread that
+        # sync_to_async hands sync code to, so the wrapper goes on that
+        # thread's connections. Other requests may be using them meanwhile,
+        # hence the check on _current in __call__.
+        token = _current.set(self)
+        start = time.perf_counter()
+        await sync_to_async(self._add_wrappers)()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            await sync_to_async(self._remove_wrappers)()
+            self.total_time = time.perf_counter() - start
+            _current.reset(token)
+
+    def _add_wrappers(self):
+        for connection in connections.all():
+            connection.execute_wrappers.append(self)
+
+    def _remove_wrappers(self):
+        # not execute_wrapper()'s pop(): requests don't finish in the order
+        # they started
+        for connection in connections.all():
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+    def server_timing(self):
+        # the Server-Timing header: shows up in the browser's dev tools
+        return (f'sql;dur={self.sql_time * 1000:.1f};desc="{self.query_count} queries", '
+                f'tpl;dur={self.template_time * 1000:.1f}, '
+                f'total;dur={self.total_time * 1000:.1f}')
+
+
+def _timed_render(render):
+    def timed(self, context=None, request=None):
+        timer = _current.get()
+        if timer is None:
+            return render(self, context, request)
+        start = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            timer.template_time += time.perf_counter() - start
+    timed.timed = True
+    return timed
+
+
+def install_template_timing():
+    # Only top-level templates go through the backend's render(); includes
+    # and {% extends %} parents are rendered inside it, so nothing is counted
+    # twice.
+    if not getattr(Template.render, 'timed', False):
+        Template.render = _timed_render(Template.render)